@@ -0,0 +1,117 @@
+"""
+Builds forums of a given size with the bulk importer, so that fixtures of
+millions of posts can be made in minutes.
+"""
+import datetime
+import itertools
+import json
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from wagtail.wagtailcore.models import Page
+
+from test.models import ForumIndex
+
+
+MESSAGE_WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua cheese bread wagtail"
+).split()
+
+
+def generate_message(i, length=40):
+    return ' '.join(MESSAGE_WORDS[(i * 7 + j * 3) % len(MESSAGE_WORDS)] for j in range(length))
+
+
+def generate_forum_records(forum_depth, forums_per_level):
+    """
+    Yields the records of a tree of forums, ``forum_depth`` levels deep with
+    ``forums_per_level`` forums under each one, a level at a time
+    """
+    level = [None]
+    counter = itertools.count()
+
+    for depth in range(forum_depth):
+        next_level = []
+
+        for parent in level:
+            for i in range(forums_per_level):
+                forum_id = 'f%d' % next(counter)
+                next_level.append(forum_id)
+                yield {'type': 'forum', 'id': forum_id, 'parent': parent, 'title': "Forum %s" % forum_id}
+
+        level = next_level
+
+
+def generate_records(posts, replies_per_topic=20, forum_depth=2, forums_per_level=3, users=100):
+    """
+    Yields the records of a forum with ``posts`` posts in it, spread over
+    topics of ``replies_per_topic`` replies in the leaf forums
+    """
+    forum_ids = []
+    for record in generate_forum_records(forum_depth, forums_per_level):
+        forum_ids.append(record['id'])
+        yield record
+
+    # Topics go in the forums on the bottom level
+    leaf_forums = forum_ids[-forums_per_level ** forum_depth:] if forum_ids else [None]
+    posted_at = timezone.now() - datetime.timedelta(seconds=posts)
+
+    post_count = 0
+    topic_count = 0
+    while post_count < posts:
+        topic_id = 't%d' % topic_count
+        yield {
+            'type': 'topic',
+            'id': topic_id,
+            'forum': leaf_forums[topic_count % len(leaf_forums)],
+            'title': "Topic %d" % topic_count,
+            'message': generate_message(post_count),
+            'author': 'user%d' % (post_count % users),
+            'posted_at': (posted_at + datetime.timedelta(seconds=post_count)).isoformat(),
+        }
+        topic_count += 1
+        post_count += 1
+
+        for i in range(min(replies_per_topic, posts - post_count)):
+            yield {
+                'type': 'reply',
+                'topic': topic_id,
+                'message': generate_message(post_count),
+                'author': 'user%d' % (post_count % users),
+                'posted_at': (posted_at + datetime.timedelta(seconds=post_count)).isoformat(),
+            }
+            post_count += 1
+
+
+def create_users(count):
+    usernames = ['user%d' % i for i in range(count)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+    User.objects.bulk_create([
+        User(username=username, email=username + '@example.com')
+        for username in usernames
+        if username not in existing
+    ])
+
+
+def create_forum(posts, replies_per_topic=20, forum_depth=2, forums_per_level=3, users=100, batch_size=1000):
+    """
+    Creates a forum index under the home page and fills it with posts.
+    Returns the forum index.
+    """
+    create_users(users)
+
+    home_page = Page.objects.get(id=2)
+    forum_index = home_page.add_child(instance=ForumIndex(
+        title="Benchmark forum",
+        slug='benchmark-forum-%d' % home_page.numchild,
+        live=True,
+    ))
+
+    records = generate_records(posts, replies_per_topic, forum_depth, forums_per_level, users)
+    # The importer adds the posts to the search index as well
+    forum_index.import_posts((json.dumps(record) for record in records), batch_size=batch_size)
+
+    return ForumIndex.objects.get(id=forum_index.id)
@@ -0,0 +1,72 @@
+"""
+Benchmarks of the forum views and the model methods behind them
+"""
+from django.contrib.auth.models import User
+from django.test import Client
+
+from wagtailforums import pageurls
+
+from benchmarks.runner import Benchmark
+from test.models import ForumIndex, ForumTopic, FlatForumTopic
+
+
+def get(client, url, data=None):
+    response = client.get(url, data or {})
+    assert response.status_code == 200, "%s returned %d" % (url, response.status_code)
+
+
+def post(client, url, data):
+    response = client.post(url, data)
+    assert response.status_code == 302, "%s returned %d" % (url, response.status_code)
+
+
+def without_reader_post_form(func):
+    def run():
+        ForumTopic.build_post_form_for_readers = False
+        try:
+            func()
+        finally:
+            ForumTopic.build_post_form_for_readers = True
+
+    return run
+
+
+def get_benchmarks(forum_index):
+    client = Client()
+    user_client = Client()
+    user = User.objects.get(username='user0')
+    user.set_password('password')
+    user.is_superuser = True
+    user.save()
+    user_client.login(username='user0', password='password')
+
+    # The biggest forum and topic
+    forum = ForumIndex.objects.descendant_of(forum_index, inclusive=True).order_by('-topic_count').first()
+    topic = ForumTopic.objects.descendant_of(forum_index).order_by('-reply_count').first()
+    last_page_number = topic.get_num_pages(topic.get_max_post_number())
+
+    # For comparing page-based replies with flat ones
+    flat_topic = forum.add_child(instance=FlatForumTopic(title="Flat topic", slug='flat-topic', message="Flat topic", live=True))
+
+    return [
+        Benchmark('forum_index.main', lambda: get(client, forum_index.url)),
+        Benchmark('forum.main', lambda: get(client, forum.url)),
+        Benchmark('forum.main.last_page', lambda: get(client, forum.get_page_url(forum.get_num_pages(forum.get_max_post_number())))),
+        Benchmark('forum.main.user', lambda: get(user_client, forum.url)),
+        Benchmark('topic.main', lambda: get(client, topic.url)),
+        Benchmark('topic.main.last_page', lambda: get(client, topic.get_page_url(last_page_number))),
+        Benchmark('topic.main.user', lambda: get(user_client, topic.url)),
+        Benchmark('topic.main.no_reader_form', without_reader_post_form(lambda: get(client, topic.url))),
+        Benchmark('topic.new_post', lambda: post(user_client, topic.new_post_url, {'message': "Benchmark reply"})),
+        Benchmark('flat_topic.new_post', lambda: post(user_client, flat_topic.new_post_url, {'message': "Benchmark reply"})),
+        Benchmark('forum.new_post', lambda: post(user_client, forum.new_post_url, {'title': "Benchmark topic", 'message': "Benchmark topic", 'custom_field': "Benchmark"})),
+        Benchmark('forum_index.search', lambda: get(client, forum_index.search_url, {'q': "cheese bread"})),
+        Benchmark('forum_index.search.rare', lambda: get(client, forum_index.search_url, {'q': "wagtail"})),
+        Benchmark('reply.build_form_class', lambda: topic.get_post_model().build_form_class()),
+        Benchmark('reply.get_form_class', lambda: topic.get_post_model().get_form_class()),
+        Benchmark('topic.get_next_post_number', lambda: topic.get_next_post_number()),
+        Benchmark('topic.post_urls', lambda: [(post.url, post.edit_url, post.delete_url) for post in topic.paginate_posts(None, last_page_number)]),
+        Benchmark('topic.post_urls.annotated', lambda: [(post.url, post.edit_url, post.delete_url) for post in pageurls.annotate_urls(topic.paginate_posts(None, last_page_number))]),
+        Benchmark('topic.paginate_posts', lambda: list(topic.paginate_posts(None, last_page_number))),
+        Benchmark('forum_index.rebuild_stats', lambda: forum_index.rebuild_stats()),
+    ]
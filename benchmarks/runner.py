@@ -0,0 +1,76 @@
+"""
+Times benchmarks and collects their results
+"""
+import gc
+import time
+
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, peak memory isn't recorded
+    tracemalloc = None
+
+
+class Benchmark(object):
+    """
+    A named function to time
+    """
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def run_once(self):
+        gc.collect()
+        if tracemalloc is not None:
+            tracemalloc.start()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            self.func()
+            duration = time.time() - start
+
+        if tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            peak_memory = None
+
+        query_count = len(queries)
+        query_time = sum(float(query['time']) for query in queries.captured_queries)
+
+        # Don't let the query log grow over the runs
+        reset_queries()
+
+        return duration, query_count, query_time, peak_memory
+
+    def run(self, repeat):
+        runs = [self.run_once() for i in range(repeat)]
+        times = sorted(duration for duration, query_count, query_time, peak_memory in runs)
+
+        return {
+            'name': self.name,
+            'runs': repeat,
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'max': times[-1],
+            'mean': sum(times) / len(times),
+            'queries': max(query_count for duration, query_count, query_time, peak_memory in runs),
+            'query_time': max(query_time for duration, query_count, query_time, peak_memory in runs),
+            'peak_memory': runs[-1][3],
+        }
+
+
+def run_benchmarks(benchmarks, repeat=5, stream=None):
+    results = []
+
+    for benchmark in benchmarks:
+        result = benchmark.run(repeat)
+        results.append(result)
+
+        if stream is not None:
+            stream.write("%-40s %8.2fms median %5d queries\n" % (result['name'], result['median'] * 1000, result['queries']))
+
+    return results
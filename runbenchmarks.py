@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Builds a forum of the given size in a fresh test database and times the
+forum views on it. Results are written as JSON so runs can be compared.
+
+    ./runbenchmarks.py --posts 100000 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'test.settings'
+
+
+def runbenchmarks():
+    parser = argparse.ArgumentParser(description="Benchmarks the forum views")
+    parser.add_argument('--posts', type=int, default=1000, help="Number of posts to create")
+    parser.add_argument('--replies-per-topic', type=int, default=20)
+    parser.add_argument('--forum-depth', type=int, default=2, help="Levels of sub forums")
+    parser.add_argument('--forums-per-level', type=int, default=3)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5, help="Number of times to run each benchmark")
+    parser.add_argument('--output', help="File to write the results to (defaults to stdout)")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from benchmarks.fixtures import create_forum
+    from benchmarks.forum import get_benchmarks
+    from benchmarks.runner import run_benchmarks
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+
+    try:
+        start = time.time()
+        forum_index = create_forum(
+            args.posts,
+            replies_per_topic=args.replies_per_topic,
+            forum_depth=args.forum_depth,
+            forums_per_level=args.forums_per_level,
+            users=args.users,
+        )
+        fixture_time = time.time() - start
+        sys.stderr.write("Created %d posts in %.1fs\n" % (args.posts, fixture_time))
+
+        results = {
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'scale': {
+                'posts': args.posts,
+                'replies_per_topic': args.replies_per_topic,
+                'forum_depth': args.forum_depth,
+                'forums_per_level': args.forums_per_level,
+                'users': args.users,
+            },
+            'fixture_time': fixture_time,
+            'benchmarks': run_benchmarks(get_benchmarks(forum_index), repeat=args.repeat, stream=sys.stderr),
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    runbenchmarks()
@@ -27,7 +27,13 @@ setup(
     author='Karl Hobley',
     author_email='karlhobley10@gmail.com',
     url='https://github.com/kaedroho/wagtailforums',
-    packages=['wagtailforums'],
+    packages=[
+        'wagtailforums',
+        'wagtailforums.migrations',
+        'wagtailforums.management',
+        'wagtailforums.management.commands',
+        'wagtailforums.templatetags',
+    ],
     include_package_data=True,
     license='BSD',
     long_description=open('README.md').read(),
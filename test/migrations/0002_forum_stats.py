@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wagtailcore', '0002_initial_data'),
+        ('test', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumindex',
+            name='last_post',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to='wagtailcore.Page', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='last_post_at',
+            field=models.DateTimeField(null=True, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='last_post_by',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='topic_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumreply',
+            name='stats_counted',
+            field=models.BooleanField(default=False, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='last_post',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to='wagtailcore.Page', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='last_post_at',
+            field=models.DateTimeField(null=True, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='last_post_by',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='stats_counted',
+            field=models.BooleanField(default=False, editable=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test', '0003_post_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='forumreply',
+            name='post_number',
+            field=models.PositiveIntegerField(null=True, editable=False, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='forumtopic',
+            name='post_number',
+            field=models.PositiveIntegerField(null=True, editable=False, db_index=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test', '0004_post_number_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumreply',
+            name='message_html',
+            field=models.TextField(editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='message_html',
+            field=models.TextField(editable=False, blank=True),
+            preserve_default=True,
+        ),
+    ]
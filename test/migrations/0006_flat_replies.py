@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import wagtailforums.models
+import django.utils.timezone
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wagtailcore', '0002_initial_data'),
+        ('test', '0005_message_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlatForumReply',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('post_number', models.PositiveIntegerField(editable=False)),
+                ('message', models.TextField()),
+                ('message_html', models.TextField(editable=False, blank=True)),
+                ('live', models.BooleanField(default=True, editable=False)),
+                ('stats_counted', models.BooleanField(default=False, editable=False)),
+                ('posted_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('edited_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('edited_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+                ('owner', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+                ('posted_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(wagtailforums.models.ForumMessageMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='FlatForumTopic',
+            fields=[
+                ('page_ptr', models.OneToOneField(parent_link=True, auto_created=True, primary_key=True, serialize=False, to='wagtailcore.Page')),
+                ('message', models.TextField()),
+                ('message_html', models.TextField(editable=False, blank=True)),
+                ('post_number', models.PositiveIntegerField(null=True, editable=False, db_index=True)),
+                ('stats_counted', models.BooleanField(default=False, editable=False)),
+                ('posted_at', models.DateTimeField(null=True, editable=False)),
+                ('edited_at', models.DateTimeField(null=True, editable=False)),
+                ('reply_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('last_post_at', models.DateTimeField(null=True, editable=False)),
+                ('edited_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+                ('last_post', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to='wagtailcore.Page', null=True)),
+                ('last_post_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+                ('posted_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, editable=False, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(wagtailforums.models.ForumMessageMixin, wagtailforums.models.ForumPageMixin, 'wagtailcore.page'),
+        ),
+        migrations.AddField(
+            model_name='flatforumreply',
+            name='topic',
+            field=models.ForeignKey(related_name='+', editable=False, to='wagtailcore.Page'),
+            preserve_default=True,
+        ),
+        migrations.AlterUniqueTogether(
+            name='flatforumreply',
+            unique_together=set([('topic', 'post_number')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test', '0006_flat_replies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumindex',
+            name='post_limit_per_forum',
+            field=models.PositiveIntegerField(help_text='Posts that can be made in this forum per period, by everyone', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='post_limit_per_ip',
+            field=models.PositiveIntegerField(help_text='Posts that can be made from each IP address in this forum per period', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='post_limit_per_user',
+            field=models.PositiveIntegerField(help_text='Posts that each user can make in this forum per period', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumindex',
+            name='post_limit_period',
+            field=models.PositiveIntegerField(help_text='Length of the period, in seconds', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
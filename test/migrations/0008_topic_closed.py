@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test', '0007_post_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatforumtopic',
+            name='closed',
+            field=models.BooleanField(default=False, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='forumtopic',
+            name='closed',
+            field=models.BooleanField(default=False, editable=False),
+            preserve_default=True,
+        ),
+    ]
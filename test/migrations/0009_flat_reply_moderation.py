@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test', '0008_topic_closed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flatforumreply',
+            name='submitted_for_moderation',
+            field=models.BooleanField(default=False, editable=False, db_index=True),
+            preserve_default=True,
+        ),
+    ]
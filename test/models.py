@@ -1,6 +1,6 @@
 from django.db import models
 
-from wagtailforums.models import AbstractForumIndex, AbstractForumTopic, AbstractForumReply
+from wagtailforums.models import AbstractFlatForumReply, AbstractForumIndex, AbstractForumTopic, AbstractForumReply
 
 
 class ForumReply(AbstractForumReply):
@@ -18,3 +18,11 @@ class ForumTopic(AbstractForumTopic):
 
 class ForumIndex(AbstractForumIndex):
     post_model = ForumTopic
+
+
+class FlatForumReply(AbstractFlatForumReply):
+    pass
+
+
+class FlatForumTopic(AbstractForumTopic):
+    post_model = FlatForumReply
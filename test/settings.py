@@ -48,6 +48,8 @@ MIDDLEWARE_CLASSES = (
     'wagtail.wagtailcore.middleware.SiteMiddleware',
 
     'wagtail.wagtailredirects.middleware.RedirectMiddleware',
+
+    'wagtailforums.middleware.TaskMiddleware',
 )
 
 INSTALLED_APPS = [
@@ -119,3 +121,7 @@ except ImportError:
 
 
 WAGTAIL_SITE_NAME = "Wagtail Forums test"
+
+# Tests need tasks to have run by the time the request returns
+WAGTAILFORUMS_TASK_EXECUTOR = 'wagtailforums.tasks.SynchronousExecutor'
+
@@ -1,10 +1,34 @@
-from django.test import TestCase
-from django.contrib.auth.models import User
-
-from wagtail.wagtailcore.models import Page
+import datetime
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+from django.contrib.auth.models import AnonymousUser, User, Group
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.urlresolvers import get_script_prefix, set_script_prefix
+
+from wagtail.wagtailcore.models import Page, PageRevision, GroupPagePermission, Site
 from wagtail.tests.utils import WagtailTestUtils
 
-from test.models import ForumIndex, ForumTopic, ForumReply
+from wagtailforums.importexport import ForumImportError
+from wagtailforums.models import ForumPostCounter, ForumReadMarker, ForumSearchDocument, ForumSearchPosting, ForumSubscription
+from wagtailforums.permissions import permissions_for_posts
+from wagtailforums.renderers import MessageRenderer, get_message_renderer
+from wagtailforums.signals import post_created
+from wagtailforums import cache, instrumentation, moderation, navigation, notifications, pageurls, ratelimit, readtracking, search, stats, tasks, templating, topics, views
+
+from test.models import ForumIndex, ForumTopic, ForumReply, FlatForumTopic, FlatForumReply
 
 
 class TestForumIndex(TestCase):
@@ -66,6 +90,17 @@ class TestForumIndex(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'test/forum_index_search.html')
 
+    def test_serve_without_view(self):
+        # Code written for plain pages calls serve with just the request
+        request = RequestFactory().get(self.forum_index.url)
+        request.user = AnonymousUser()
+        request.session = {}
+
+        response = self.forum_index.serve(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<h2>%s</h2>" % self.forum_index.title)
+
 
 class TestForumTopic(TestCase, WagtailTestUtils):
     def setUp(self):
@@ -309,3 +344,2796 @@ class TestForumTopic(TestCase, WagtailTestUtils):
 
         # Run tests for bad result
         self._test_post_delete_bad()
+
+
+class TestPostNumbers(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        # Create a reply that was posted before counters existed
+        self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            post_number=5,
+            live=True,
+        ))
+
+        self.user = self.login()
+
+    def test_new_posts_are_numbered_sequentially(self):
+        for i in range(3):
+            response = self.client.post(self.forum_topic.new_post_url, {
+                'message': "Reply " + str(i),
+            })
+            self.assertRedirects(response, self.forum_topic.url)
+
+        # Numbering continues on from the existing reply
+        post_numbers = ForumReply.objects.child_of(self.forum_topic).order_by('post_number').values_list('post_number', flat=True)
+        self.assertEqual(list(post_numbers), [5, 6, 7, 8])
+
+        # Check counter
+        self.assertEqual(ForumPostCounter.objects.get(page=self.forum_topic).last_post_number, 8)
+
+    def test_backfill_post_counters(self):
+        call_command('backfill_post_counters', stdout=StringIO())
+
+        self.assertEqual(ForumPostCounter.objects.get(page=self.forum_topic).last_post_number, 5)
+        self.assertEqual(self.forum_topic.get_next_post_number(), 6)
+
+    def test_posts_created_in_admin_are_numbered(self):
+        # The Wagtail admin adds the page then saves a revision of it
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Admin reply",
+            slug='admin-reply',
+            message="From the admin",
+            live=False,
+        ))
+        reply.save_revision(user=self.user).publish()
+
+        self.assertEqual(ForumReply.objects.get(id=reply.id).post_number, 6)
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertIn(reply.id, [post.id for post in response.context['posts']])
+
+    def test_backfill_numbers_unnumbered_posts(self):
+        ForumReply.objects.child_of(self.forum_topic).update(post_number=None)
+        second_reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Second reply",
+            slug='second-reply',
+            live=True,
+        ))
+
+        call_command('backfill_post_counters', stdout=StringIO())
+
+        post_numbers = ForumReply.objects.child_of(self.forum_topic).order_by('path').values_list('post_number', flat=True)
+        self.assertEqual(list(post_numbers), [1, 2])
+        self.assertEqual(ForumReply.objects.get(id=second_reply.id).post_number, 2)
+        self.assertEqual(ForumPostCounter.objects.get(page=self.forum_topic).last_post_number, 2)
+
+
+class TestForumStats(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a subforum
+        self.sub_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Subforum",
+            slug='subforum',
+            live=True,
+        ))
+
+        self.user = self.login()
+
+    def post_topic(self, forum_index, title):
+        self.client.post(forum_index.new_post_url, {
+            'title': title,
+            'message': "Hello",
+            'custom_field': "World",
+        })
+
+        return ForumTopic.objects.child_of(forum_index).get(title=title)
+
+    def post_reply(self, topic, message):
+        self.client.post(topic.new_post_url, {
+            'message': message,
+        })
+
+        return ForumReply.objects.child_of(topic).get(message=message)
+
+    def test_new_posts_update_stats(self):
+        topic = self.post_topic(self.sub_forum_index, "Topic")
+        reply = self.post_reply(topic, "Reply")
+
+        # Check topic
+        topic = ForumTopic.objects.get(id=topic.id)
+        self.assertEqual(topic.reply_count, 1)
+        self.assertEqual(topic.last_post_id, reply.id)
+        self.assertEqual(topic.last_post_by, self.user)
+        self.assertIsNotNone(topic.last_post_at)
+
+        # Check both forum indexes
+        for forum_index in [self.forum_index, self.sub_forum_index]:
+            forum_index = ForumIndex.objects.get(id=forum_index.id)
+            self.assertEqual(forum_index.topic_count, 1)
+            self.assertEqual(forum_index.reply_count, 1)
+            self.assertEqual(forum_index.last_post_id, reply.id)
+
+    def test_forum_rows_are_updated_after_commit(self):
+        topic = self.post_topic(self.sub_forum_index, "Topic")
+
+        executor = RecordingExecutor()
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = executor
+
+        with CaptureQueriesContext(connection) as queries:
+            reply = self.post_reply(topic, "Reply")
+
+        # The posting request doesn't write to the forums
+        forum_table = ForumIndex._meta.db_table
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE') and forum_table in query['sql']])
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 0)
+
+        for func, args, kwargs in executor.tasks:
+            func(*args, **kwargs)
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.reply_count, 1)
+        self.assertEqual(forum_index.last_post_id, reply.id)
+
+    def test_editing_doesnt_count_post_twice(self):
+        topic = self.post_topic(self.forum_index, "Topic")
+        reply = self.post_reply(topic, "Reply")
+
+        response = self.client.post(reply.edit_url, {
+            'message': "Edited reply",
+        })
+        self.assertRedirects(response, topic.url)
+
+        self.assertEqual(ForumTopic.objects.get(id=topic.id).reply_count, 1)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 1)
+
+    def test_editing_topic_keeps_stats(self):
+        topic = self.post_topic(self.forum_index, "Topic")
+        self.post_reply(topic, "Reply")
+
+        # Publishing a revision of the topic mustn't overwrite its stats
+        topic = ForumTopic.objects.get(id=topic.id)
+        topic.save_revision(user=self.user).publish()
+
+        self.assertEqual(ForumTopic.objects.get(id=topic.id).reply_count, 1)
+
+    def test_deleting_reply_updates_stats(self):
+        topic = self.post_topic(self.forum_index, "Topic")
+        self.post_reply(topic, "First reply")
+        second_reply = self.post_reply(topic, "Second reply")
+
+        response = self.client.post(second_reply.delete_url)
+        self.assertRedirects(response, topic.url)
+
+        topic = ForumTopic.objects.get(id=topic.id)
+        self.assertEqual(topic.reply_count, 1)
+        self.assertEqual(topic.last_post.specific.message, "First reply")
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.reply_count, 1)
+        self.assertEqual(forum_index.last_post.specific.message, "First reply")
+
+    def test_deleting_topic_with_replies_updates_stats(self):
+        other_topic = self.post_topic(self.sub_forum_index, "Other topic")
+        topic = self.post_topic(self.sub_forum_index, "Topic")
+        for i in range(5):
+            self.post_reply(topic, "Reply %d" % i)
+
+        response = self.client.post(topic.url + topic.reverse_subpage('delete'))
+        self.assertRedirects(response, self.sub_forum_index.url)
+
+        for forum_index in [self.forum_index, self.sub_forum_index]:
+            forum_index = ForumIndex.objects.get(id=forum_index.id)
+            self.assertEqual(forum_index.topic_count, 1)
+            self.assertEqual(forum_index.reply_count, 0)
+            self.assertEqual(forum_index.last_post_id, other_topic.id)
+
+    def test_deleting_topic_handles_replies_together(self):
+        def get_delete_query_count(reply_count):
+            topic = self.post_topic(self.sub_forum_index, "Topic %d" % reply_count)
+            for i in range(reply_count):
+                self.post_reply(topic, "Reply %d" % i)
+
+            # Outside a request, which would reset the query log
+            with CaptureQueriesContext(connection) as queries:
+                topic.delete()
+
+            # Only the forum statistics are of interest, the rest of the
+            # deletion naturally depends on the number of pages
+            return len([query for query in queries if '"test_forumindex"' in query['sql']])
+
+        self.assertEqual(get_delete_query_count(2), get_delete_query_count(10))
+
+    def test_unpublishing_topic_updates_stats(self):
+        topic = self.post_topic(self.forum_index, "Topic")
+        topic.unpublish()
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.topic_count, 0)
+        self.assertIsNone(forum_index.last_post)
+
+    def test_rebuild_forum_stats(self):
+        topic = self.post_topic(self.sub_forum_index, "Topic")
+        reply = self.post_reply(topic, "Reply")
+
+        # Scramble the stats
+        ForumTopic.objects.update(reply_count=10, last_post=None)
+        ForumIndex.objects.update(topic_count=0, reply_count=0)
+
+        call_command('rebuild_forum_stats', stdout=StringIO())
+
+        topic = ForumTopic.objects.get(id=topic.id)
+        self.assertEqual(topic.reply_count, 1)
+        self.assertEqual(topic.last_post_id, reply.id)
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.topic_count, 1)
+        self.assertEqual(forum_index.reply_count, 1)
+        self.assertEqual(forum_index.last_post_id, reply.id)
+
+
+class TestPostMetadata(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        self.user = self.login()
+
+    def test_metadata_is_stored_on_post(self):
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Reply",
+        })
+
+        reply = ForumReply.objects.select_related('posted_by', 'edited_by').get(message="Reply")
+        revision = reply.get_latest_revision()
+
+        # None of these should touch the revisions table
+        with self.assertNumQueries(0):
+            self.assertEqual(reply.get_posted_at(), reply.posted_at)
+            self.assertEqual(reply.get_posted_by(), self.user)
+            self.assertEqual(reply.get_edited_at(), reply.edited_at)
+            self.assertEqual(reply.get_edited_by(), self.user)
+
+        self.assertEqual(revision.user, self.user)
+
+    def test_editing_updates_edited_fields(self):
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Reply",
+        })
+        reply = ForumReply.objects.get(message="Reply")
+
+        other_user = User.objects.create_superuser(username='other', email='other@example.com', password='password')
+        self.client.login(username='other', password='password')
+        self.client.post(reply.edit_url, {
+            'message': "Edited reply",
+        })
+
+        reply = ForumReply.objects.get(id=reply.id)
+        self.assertEqual(reply.get_posted_by(), self.user)
+        self.assertEqual(reply.get_edited_by(), other_user)
+        self.assertGreaterEqual(reply.edited_at, reply.posted_at)
+
+    def test_legacy_posts_fall_back_to_revisions(self):
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Legacy reply",
+            slug='legacy-reply',
+            live=True,
+        ))
+        revision = reply.revisions.create(content_json=reply.to_json(), user=self.user)
+
+        # Prefetched revisions are used if they are available
+        reply = ForumReply.objects.prefetch_related('revisions').get(id=reply.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(reply.get_posted_at(), revision.created_at)
+            self.assertEqual(reply.get_posted_by(), self.user)
+
+    def test_editing_legacy_post_keeps_author(self):
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Legacy reply",
+            slug='legacy-reply',
+            owner=self.user,
+            live=True,
+        ))
+        revision = reply.revisions.create(content_json=reply.to_json(), user=self.user)
+        PageRevision.objects.filter(id=revision.id).update(created_at=timezone.now() - datetime.timedelta(days=30))
+        revision = PageRevision.objects.get(id=revision.id)
+
+        other_user = User.objects.create_superuser(username='other', email='other@example.com', password='password')
+        self.client.login(username='other', password='password')
+        self.client.post(reply.edit_url, {
+            'message': "Edited reply",
+        })
+
+        reply = ForumReply.objects.get(id=reply.id)
+        self.assertEqual(reply.posted_at, revision.created_at)
+        self.assertEqual(reply.posted_by, self.user)
+        self.assertEqual(reply.edited_by, other_user)
+
+    def test_backfill_post_metadata(self):
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Legacy reply",
+            slug='legacy-reply',
+            live=True,
+        ))
+        revision = reply.revisions.create(content_json=reply.to_json(), user=self.user)
+
+        call_command('backfill_post_metadata', stdout=StringIO())
+
+        reply = ForumReply.objects.get(id=reply.id)
+        self.assertEqual(reply.posted_at, revision.created_at)
+        self.assertEqual(reply.posted_by, self.user)
+        self.assertEqual(reply.edited_at, revision.created_at)
+        self.assertEqual(reply.edited_by, self.user)
+
+
+class TestPagination(TestCase):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create some topics
+        for i in range(1, 26):
+            self.forum_index.add_child(instance=ForumTopic(
+                title="Topic " + str(i),
+                slug='topic-' + str(i),
+                post_number=i,
+                live=True,
+            ))
+
+        self.forum_topic = ForumTopic.objects.get(post_number=25)
+
+        # Create some replies
+        for i in range(1, 46):
+            self.forum_topic.add_child(instance=ForumReply(
+                title="Reply " + str(i),
+                slug='reply-' + str(i),
+                message="Reply " + str(i),
+                post_number=i,
+                live=True,
+            ))
+
+    def get_post_numbers(self, response):
+        return [post.post_number for post in response.context['posts']]
+
+    def test_first_page(self):
+        response = self.client.get(self.forum_topic.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_post_numbers(response), list(range(1, 21)))
+        self.assertEqual(response.context['posts'].num_pages, 3)
+
+    def test_page_route(self):
+        response = self.client.get(self.forum_topic.get_page_url(3))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_post_numbers(response), list(range(41, 46)))
+        self.assertFalse(response.context['posts'].has_next())
+
+    def test_page_querystring(self):
+        response = self.client.get(self.forum_topic.url, {'page': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_post_numbers(response), list(range(21, 41)))
+
+    def test_page_out_of_range(self):
+        response = self.client.get(self.forum_topic.get_page_url(4))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_after(self):
+        response = self.client.get(self.forum_topic.url, {'after': 30})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_post_numbers(response), list(range(31, 46)))
+        self.assertEqual(response.context['posts'].number, 2)
+
+    def test_post_permalink(self):
+        response = self.client.get(self.forum_topic.get_post_permalink(25))
+
+        self.assertRedirects(response, self.forum_topic.get_page_url(2) + '#post-25')
+
+    def test_deleted_posts_leave_gaps(self):
+        ForumReply.objects.get(post_number=22).delete()
+
+        response = self.client.get(self.forum_topic.get_page_url(2))
+
+        self.assertEqual(len(response.context['posts']), 19)
+
+    def test_index_lists_newest_topics_first(self):
+        response = self.client.get(self.forum_index.url)
+        self.assertEqual(self.get_post_numbers(response), list(range(25, 5, -1)))
+
+        response = self.client.get(self.forum_index.get_page_url(2))
+        self.assertEqual(self.get_post_numbers(response), list(range(5, 0, -1)))
+
+
+class TestQueryCounts(TestCase):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            post_number=1,
+            live=True,
+        ))
+
+        self.post_count = 0
+
+    def add_posts(self, parent, model, count):
+        for i in range(count):
+            self.post_count += 1
+            user = User.objects.create_user(username='user' + str(self.post_count), password='password')
+
+            parent.add_child(instance=model(
+                title="Post " + str(self.post_count),
+                slug='post-' + str(self.post_count),
+                message="Hello",
+                post_number=self.post_count + 1,
+                owner=user,
+                posted_at=timezone.now(),
+                posted_by=user,
+                edited_at=timezone.now(),
+                edited_by=user,
+                live=True,
+            ))
+
+    def get_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_topic_query_count_doesnt_depend_on_reply_count(self):
+        self.add_posts(self.forum_topic, ForumReply, 2)
+        query_count = self.get_query_count(self.forum_topic.url)
+
+        self.add_posts(self.forum_topic, ForumReply, 10)
+        self.assertEqual(self.get_query_count(self.forum_topic.url), query_count)
+
+    def test_index_query_count_doesnt_depend_on_topic_count(self):
+        self.add_posts(self.forum_index, ForumTopic, 2)
+
+        # The forum tree is cached by the first request
+        self.client.get(self.forum_index.url)
+        query_count = self.get_query_count(self.forum_index.url)
+
+        self.add_posts(self.forum_index, ForumTopic, 10)
+        self.assertEqual(self.get_query_count(self.forum_index.url), query_count)
+
+    def test_permissions_are_loaded_once_per_request(self):
+        group = Group.objects.create(name="Forum users")
+        GroupPagePermission.objects.create(group=group, page=self.forum_index, permission_type='add')
+
+        user = User.objects.create_user(username='member', password='password')
+        user.groups.add(group)
+        self.client.login(username='member', password='password')
+
+        self.add_posts(self.forum_topic, ForumReply, 10)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.forum_topic.url)
+            self.assertEqual(response.status_code, 200)
+
+        permission_queries = [query for query in queries if 'wagtailcore_grouppagepermission' in query['sql']]
+        self.assertEqual(len(permission_queries), 1)
+
+    def test_permissions_for_posts(self):
+        self.add_posts(self.forum_topic, ForumReply, 3)
+        posts = list(ForumReply.objects.child_of(self.forum_topic))
+        user = posts[0].owner
+
+        permissions = permissions_for_posts(user, posts)
+
+        self.assertTrue(permissions[posts[0].pk].can_edit)
+        self.assertTrue(permissions[posts[0].pk].can_delete)
+        self.assertFalse(permissions[posts[1].pk].can_edit)
+        self.assertFalse(permissions[posts[2].pk].can_delete)
+
+
+class ShoutingRenderer(MessageRenderer):
+    def render(self, message):
+        return message.upper()
+
+
+class TestMessageRendering(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        self.login()
+
+    def test_new_post_stores_html(self):
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Hello <b>world</b>\n\nSecond paragraph",
+        })
+
+        reply = ForumReply.objects.child_of(self.forum_topic).get()
+        self.assertEqual(reply.message_html, "<p>Hello &lt;b&gt;world&lt;/b&gt;</p>\n\n<p>Second paragraph</p>")
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertContains(response, "<p>Hello &lt;b&gt;world&lt;/b&gt;</p>", html=False)
+
+    def test_edit_rerenders_html(self):
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Hello",
+        })
+        reply = ForumReply.objects.child_of(self.forum_topic).get()
+
+        self.client.post(reply.edit_url, {
+            'message': "Goodbye",
+        })
+
+        self.assertEqual(ForumReply.objects.get(id=reply.id).message_html, "<p>Goodbye</p>")
+
+    def test_legacy_posts_are_rendered_on_the_fly(self):
+        self.assertEqual(self.forum_topic.message_html, "")
+
+        self.forum_topic.message = "Hello"
+        self.assertEqual(self.forum_topic.rendered_message, "<p>Hello</p>")
+
+    def test_rerender_messages(self):
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Hello",
+        })
+
+        with override_settings(WAGTAILFORUMS_MESSAGE_RENDERER='test.tests.ShoutingRenderer'):
+            call_command('rerender_messages', stdout=StringIO())
+
+        self.assertEqual(ForumReply.objects.child_of(self.forum_topic).get().message_html, "HELLO")
+
+    def test_rerender_flat_reply_messages(self):
+        topic = self.forum_index.add_child(instance=FlatForumTopic(title="Flat topic", slug='flat-topic', live=True))
+        self.client.post(topic.new_post_url, {
+            'message': "Hello",
+        })
+
+        with override_settings(WAGTAILFORUMS_MESSAGE_RENDERER='test.tests.ShoutingRenderer'):
+            call_command('rerender_messages', stdout=StringIO())
+
+        self.assertEqual(FlatForumReply.objects.get(topic=topic).message_html, "HELLO")
+
+    def test_markdown_is_sanitised(self):
+        try:
+            renderer = get_message_renderer('wagtailforums.renderers.MarkdownRenderer')
+        except ImproperlyConfigured:
+            self.skipTest("markdown and bleach aren't installed")
+
+        html = renderer.render("*Hello*\n\n<script>alert(1)</script>\n\n[x](javascript:alert(1)) [y](http://example.com/)")
+
+        self.assertIn("<em>Hello</em>", html)
+        self.assertNotIn("<script", html)
+        self.assertNotIn("javascript:", html)
+        self.assertIn('<a href="http://example.com/">y</a>', html)
+
+
+class TestViewCache(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            message="Hello",
+            post_number=1,
+            live=True,
+        ))
+
+        # Turn on caching
+        ForumIndex.cache_views = ('main', )
+        ForumTopic.cache_views = ('main', )
+
+        self.addCleanup(setattr, ForumIndex, 'cache_views', ())
+        self.addCleanup(setattr, ForumTopic, 'cache_views', ())
+
+    def change_message_behind_cache(self, message):
+        # Queryset updates don't send any signals so the cache won't know about this
+        ForumTopic.objects.filter(id=self.forum_topic.id).update(message_html=message)
+
+    def test_anonymous_views_are_cached(self):
+        response = self.client.get(self.forum_topic.url)
+        self.assertContains(response, "Hello")
+
+        self.change_message_behind_cache("Changed")
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertContains(response, "Hello")
+
+    def test_new_reply_invalidates_topic_and_index(self):
+        self.client.get(self.forum_topic.url)
+        self.client.get(self.forum_index.url)
+        self.change_message_behind_cache("Changed")
+
+        self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            message="Reply",
+            post_number=1,
+            live=True,
+        ))
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertContains(response, "Changed")
+        self.assertContains(response, "Reply")
+
+        response = self.client.get(self.forum_index.url)
+        self.assertContains(response, "Topic")
+
+    def test_counting_post_invalidates_after_counts(self):
+        executor = RecordingExecutor()
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = executor
+
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            message="Reply",
+            post_number=1,
+        ))
+        with tasks.post_commit():
+            reply.save_revision().publish()
+
+        # A view cached after the post was saved, before it was counted,
+        # has the old counts
+        count_tasks = [task for task in executor.tasks if task[0] is stats.count_post]
+        for func, args, kwargs in executor.tasks:
+            if func is not stats.count_post:
+                func(*args, **kwargs)
+        versions = [cache.get_page_version(page) for page in (self.forum_index, self.forum_topic)]
+
+        self.assertEqual(len(count_tasks), 1)
+        for func, args, kwargs in count_tasks:
+            func(*args, **kwargs)
+
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 1)
+        self.assertNotEqual(cache.get_page_version(self.forum_index), versions[0])
+        self.assertNotEqual(cache.get_page_version(self.forum_topic), versions[1])
+
+    def test_deleting_invalidates_parent(self):
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            message="Goodbye",
+            post_number=1,
+            live=True,
+        ))
+        self.assertContains(self.client.get(self.forum_topic.url), "Goodbye")
+
+        reply.delete()
+
+        self.assertNotContains(self.client.get(self.forum_topic.url), "Goodbye")
+
+    def test_logged_in_views_arent_cached(self):
+        self.login()
+
+        self.client.get(self.forum_topic.url)
+        self.change_message_behind_cache("Changed")
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertContains(response, "Changed")
+
+
+class TestTasks(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        # Create a topic
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        self.user = self.login()
+
+    def test_post_created_is_sent(self):
+        received = []
+
+        def receiver(sender, instance, revision, published, **kwargs):
+            received.append((sender, instance.message, revision.user, published))
+
+        post_created.connect(receiver)
+        self.addCleanup(post_created.disconnect, receiver)
+
+        self.client.post(self.forum_topic.new_post_url, {
+            'message': "Reply",
+        })
+
+        self.assertEqual(received, [(ForumReply, "Reply", self.user, True)])
+
+    def test_tasks_run_after_block(self):
+        ran = []
+
+        with tasks.post_commit():
+            tasks.defer(ran.append, 1)
+            self.assertEqual(ran, [])
+
+        self.assertEqual(ran, [1])
+
+    def test_tasks_are_dropped_on_rollback(self):
+        ran = []
+
+        try:
+            with tasks.post_commit():
+                tasks.defer(ran.append, 1)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(ran, [])
+
+    def test_nested_blocks_wait_for_outer_block(self):
+        ran = []
+
+        with tasks.post_commit():
+            with tasks.post_commit():
+                tasks.defer(ran.append, 1)
+
+            self.assertEqual(ran, [])
+
+        self.assertEqual(ran, [1])
+
+    def test_tasks_wait_for_request_transaction(self):
+        ran = []
+
+        tasks.start_request()
+        with transaction.atomic():
+            with tasks.post_commit():
+                tasks.defer(ran.append, 1)
+            tasks.defer(ran.append, 2)
+
+            self.assertEqual(ran, [])
+
+        tasks.finish_request(committed=True)
+
+        self.assertEqual(ran, [1, 2])
+
+    def test_tasks_are_dropped_when_request_transaction_rolls_back(self):
+        ran = []
+
+        tasks.start_request()
+        try:
+            with transaction.atomic():
+                with tasks.post_commit():
+                    tasks.defer(ran.append, 1)
+                raise ValueError
+        except ValueError:
+            tasks.finish_request(committed=False)
+
+        tasks.finish_request(committed=True)
+
+        self.assertEqual(ran, [])
+
+    def test_atomic_requests(self):
+        connection.settings_dict['ATOMIC_REQUESTS'] = True
+        self.addCleanup(connection.settings_dict.__setitem__, 'ATOMIC_REQUESTS', False)
+
+        # Tasks are submitted once the request's transaction has finished,
+        # when the connection is back in just the test's transaction
+        depths = []
+        executor = RecordingExecutor()
+        executor.submit = lambda func, *args, **kwargs: depths.append(tasks.get_atomic_depth())
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = executor
+
+        test_depth = tasks.get_atomic_depth()
+        response = self.client.post(self.forum_topic.new_post_url, {
+            'message': "Reply",
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(depths)
+        self.assertEqual(set(depths), {test_depth})
+
+    def test_default_executor_doesnt_block(self):
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = None
+
+        with self.settings():
+            del settings.WAGTAILFORUMS_TASK_EXECUTOR
+            executor = tasks.get_executor()
+
+        self.assertIsInstance(executor, tasks.ThreadPoolExecutor)
+
+        # A slow task (like notifying thousands of subscribers) doesn't hold
+        # up the request that deferred it
+        release = threading.Event()
+        finished = []
+        tasks.defer(lambda: finished.append(release.wait(10)))
+
+        self.assertEqual(finished, [])
+        release.set()
+        executor.join()
+        self.assertEqual(finished, [True])
+
+    def test_thread_pool_executor(self):
+        ran = []
+        executor = tasks.ThreadPoolExecutor(max_workers=2)
+
+        for i in range(10):
+            executor.submit(ran.append, i)
+
+        executor.join()
+
+        self.assertEqual(sorted(ran), list(range(10)))
+
+
+class TestImportExport(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def get_dump(self):
+        records = [
+            {'type': 'forum', 'id': 'f1', 'parent': None, 'title': "General", 'slug': 'general'},
+            {'type': 'forum', 'id': 'f2', 'parent': 'f1', 'title': "Off topic"},
+        ]
+
+        for i in range(3):
+            records.append({
+                'type': 'topic',
+                'id': 't%d' % i,
+                'forum': 'f1',
+                'title': "Topic %d" % i,
+                'message': "Topic message",
+                'author': 'alice',
+                'posted_at': '2015-01-01T12:00:00Z',
+            })
+
+            for j in range(4):
+                records.append({
+                    'type': 'reply',
+                    'topic': 't%d' % i,
+                    'message': "Reply %d" % j,
+                    'author': 'alice',
+                    'posted_at': '2015-01-02T12:00:0%dZ' % j,
+                })
+
+        records.append({'type': 'topic', 'id': 't9', 'forum': None, 'title': "Announcement", 'message': "Hello"})
+
+        return StringIO('\n'.join(json.dumps(record) for record in records))
+
+    def test_import(self):
+        counts = self.forum_index.import_posts(self.get_dump(), batch_size=5)
+
+        self.assertEqual(counts, {'forum': 2, 'topic': 4, 'reply': 12})
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+        general = ForumIndex.objects.get(slug='general')
+        self.assertEqual(general.url_path, self.forum_index.url_path + 'general/')
+        self.assertEqual(general.topic_count, 3)
+        self.assertEqual(general.reply_count, 12)
+        self.assertEqual(ForumIndex.objects.get(slug='off-topic').get_parent().id, general.id)
+
+        topic = ForumTopic.objects.child_of(general).get(title="Topic 1")
+        self.assertEqual(topic.post_number, 2)
+        self.assertEqual(topic.owner, self.user)
+        self.assertEqual(topic.reply_count, 4)
+        self.assertEqual(topic.last_post.specific.message, "Reply 3")
+        self.assertEqual(list(topic.get_posts().values_list('post_number', flat=True)), [1, 2, 3, 4])
+        self.assertEqual(topic.revisions.count(), 1)
+        self.assertEqual(topic.get_next_post_number(), 5)
+
+        # Posts in the existing forum are numbered from its counter
+        self.assertEqual(ForumTopic.objects.child_of(self.forum_index).get().post_number, 1)
+        self.assertEqual(self.forum_index.get_next_post_number(), 2)
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.topic_count, 4)
+        self.assertEqual(forum_index.reply_count, 12)
+
+        response = self.client.get(topic.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Reply 3")
+
+    def test_latest_post_goes_by_posting_time(self):
+        records = [
+            {'type': 'topic', 'id': 'a', 'forum': None, 'title': "A", 'message': "A", 'author': 'alice', 'posted_at': '2015-03-01T12:00:00Z'},
+            {'type': 'reply', 'topic': 'a', 'message': "Reply to A", 'author': 'alice', 'posted_at': '2015-06-01T12:00:00Z'},
+            {'type': 'topic', 'id': 'b', 'forum': None, 'title': "B", 'message': "B", 'author': 'alice', 'posted_at': '2015-02-01T12:00:00Z'},
+        ]
+        self.forum_index.import_posts(StringIO('\n'.join(json.dumps(record) for record in records)))
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.last_post.specific.message, "Reply to A")
+        self.assertEqual(forum_index.last_post_at, datetime.datetime(2015, 6, 1, 12, tzinfo=timezone.utc))
+
+    def test_bad_posting_time(self):
+        records = [
+            {'type': 'topic', 'id': 't1', 'forum': None, 'title': "Topic", 'message': "Hello", 'posted_at': 'yesterday'},
+        ]
+        with self.assertRaisesRegexp(ForumImportError, "'t1'"):
+            self.forum_index.import_posts(StringIO(json.dumps(records[0])))
+
+        records = [
+            {'type': 'topic', 'id': 't2', 'forum': None, 'title': "Topic", 'message': "Hello", 'posted_at': '2015-01-01T12:00:00Z'},
+            {'type': 'reply', 'topic': 't2', 'message': "Reply", 'posted_at': '2015-13-45T12:00:00Z'},
+        ]
+        with self.assertRaisesRegexp(ForumImportError, "reply to topic u?'t2'"):
+            self.forum_index.import_posts(StringIO('\n'.join(json.dumps(record) for record in records)))
+
+    def test_imported_posts_are_indexed(self):
+        self.forum_index.import_posts(self.get_dump(), batch_size=5)
+
+        self.assertEqual(len(search.search("reply", scope=self.forum_index)), 12)
+        self.assertEqual(len(search.search("announcement", scope=self.forum_index)), 1)
+
+    def test_import_reserves_paths(self):
+        # Another process has reserved steps under the forum index for
+        # posts it's about to add
+        reserved_step = ForumPostCounter.objects.reserve_child_steps(self.forum_index, 2)
+
+        self.forum_index.import_posts(self.get_dump(), batch_size=5)
+
+        steps = [Page._str2int(path[-Page.steplen:]) for path in Page.objects.child_of(self.forum_index).values_list('path', flat=True)]
+        self.assertEqual(sorted(steps), [reserved_step + 1, reserved_step + 2])
+
+        # The rest of the reserved block is handed back
+        self.assertEqual(ForumPostCounter.objects.get(page=self.forum_index).last_child_step, reserved_step + 2)
+
+    def test_export_round_trip(self):
+        self.forum_index.import_posts(self.get_dump())
+
+        exported = StringIO()
+        self.forum_index.export_posts(exported)
+        records = [json.loads(line) for line in exported.getvalue().splitlines()]
+
+        self.assertEqual([record['type'] for record in records].count('reply'), 12)
+
+        # Import the export into a second forum index
+        other_index = self.home_page.add_child(instance=ForumIndex(
+            title="Other forums",
+            slug='other-forums',
+            live=True,
+        ))
+        counts = other_index.import_posts(StringIO(exported.getvalue()))
+
+        self.assertEqual(counts, {'forum': 2, 'topic': 4, 'reply': 12})
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+        messages = lambda index: sorted(ForumReply.objects.descendant_of(index).values_list('message', 'post_number'))
+        self.assertEqual(messages(other_index), messages(self.forum_index))
+
+    def test_import_command(self):
+        output = StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(self.get_dump().getvalue())
+        self.addCleanup(os.remove, f.name)
+
+        call_command('import_forum', str(self.forum_index.id), f.name, stdout=output)
+
+        self.assertEqual(output.getvalue().strip(), "Imported 2 forums, 4 topics and 12 replies")
+
+
+class TestSearch(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index with a sub forum
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.sub_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Sub forum",
+            slug='sub-forum',
+            live=True,
+        ))
+
+        self.user = self.login()
+        self.other_user = User.objects.create_user('other', 'other@example.com', 'password')
+
+        self.topic = self.create_topic(self.forum_index, "Cheese", "I like cheese and more cheese", self.user)
+        self.other_topic = self.create_topic(self.sub_forum_index, "Bread", "Bread goes with cheese", self.other_user)
+
+    def create_topic(self, parent, title, message, user):
+        topic = parent.add_child(instance=ForumTopic(
+            title=title,
+            slug=title.lower().replace(' ', '-'),
+            message=message,
+            owner=user,
+            live=False,
+        ))
+
+        with tasks.post_commit():
+            topic.save_revision(user=user).publish()
+
+        return ForumTopic.objects.get(id=topic.id)
+
+    def test_posts_are_indexed_on_publish(self):
+        self.assertEqual(ForumSearchDocument.objects.count(), 2)
+        self.assertEqual(
+            ForumSearchPosting.objects.get(document_id=self.topic.id, term='cheese').frequency,
+            3,
+        )
+
+    def test_ranking(self):
+        results = search.search("cheese", scope=self.forum_index)
+
+        self.assertEqual([page_id for page_id, score in results.hits], [self.topic.id, self.other_topic.id])
+        self.assertEqual(results.facets['forum'], {self.forum_index.id: 1, self.sub_forum_index.id: 1})
+
+    def test_filters(self):
+        self.assertEqual(len(search.search("cheese", scope=self.sub_forum_index)), 1)
+        self.assertEqual(len(search.search("cheese", author=self.other_user)), 1)
+        self.assertEqual(len(search.search("cheese", posted_after=timezone.now() + datetime.timedelta(days=1))), 0)
+        self.assertEqual(len(search.search("the")), 0)
+
+    def test_unpublish_and_delete(self):
+        with tasks.post_commit():
+            self.topic.unpublish()
+
+        self.assertEqual([page_id for page_id, score in search.search("cheese").hits], [self.other_topic.id])
+
+        self.other_topic.delete()
+
+        self.assertEqual(ForumSearchDocument.objects.count(), 0)
+
+    def test_highlight(self):
+        self.assertEqual(
+            search.highlight("Cheese & <bread>", ['cheese']),
+            "<mark>Cheese</mark> &amp; &lt;bread&gt;",
+        )
+
+    def test_search_view(self):
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese", 'author': 'other'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['search_results']), [self.other_topic])
+        self.assertContains(response, "Bread goes with <mark>cheese</mark>")
+
+    def test_search_view_bad_page(self):
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese", 'page': 10})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuild_command(self):
+        ForumSearchDocument.objects.all().delete()
+
+        call_command('rebuild_forum_search_index', stdout=StringIO())
+
+        self.assertEqual(len(search.search("cheese")), 2)
+
+    def test_result_limit(self):
+        results = search.search("cheese", limit=1)
+
+        self.assertEqual([page_id for page_id, score in results.hits], [self.topic.id])
+        self.assertEqual(sum(results.facets['author'].values()), 2)
+
+    def test_postings_per_term_are_capped(self):
+        self.addCleanup(setattr, search, 'MAX_POSTINGS_PER_TERM', search.MAX_POSTINGS_PER_TERM)
+        search.MAX_POSTINGS_PER_TERM = 1
+
+        results = search.search("cheese")
+
+        # Only the post that says "cheese" most is scored, both are counted
+        self.assertEqual([page_id for page_id, score in results.hits], [self.topic.id])
+        self.assertEqual(results.facets['author'], {self.user.id: 1, self.other_user.id: 1})
+
+    def test_search_view_scope(self):
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese", 'forum': self.sub_forum_index.id})
+
+        self.assertEqual(list(response.context['search_results']), [self.other_topic])
+
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese", 'topic': self.topic.id})
+
+        self.assertEqual(list(response.context['search_results']), [self.topic])
+
+    def test_search_view_scope_outside_forum(self):
+        response = self.client.get(self.sub_forum_index.search_url, {'q': "cheese", 'topic': self.topic.id})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_view_hides_unpublished_forums(self):
+        self.sub_forum_index.unpublish()
+
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese"})
+
+        self.assertEqual(list(response.context['search_results']), [self.topic])
+
+    def test_search_view_caches_results(self):
+        self.client.get(self.forum_index.search_url, {'q': "cheese"})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.forum_index.search_url, {'q': "cheese", 'page': 1})
+
+        self.assertFalse(any('wagtailforums_forumsearchposting' in query['sql'] for query in queries.captured_queries))
+
+        # Publishing a post replaces the cached results
+        self.create_topic(self.forum_index, "Cheese again", "Cheese", self.user)
+
+        response = self.client.get(self.forum_index.search_url, {'q': "cheese"})
+
+        self.assertEqual(len(response.context['search_results']), 3)
+
+
+class TestReadTracking(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index with a topic
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.add_post(self.forum_index, ForumTopic, 1, timezone.now() - datetime.timedelta(hours=2))
+
+        self.user = self.login()
+
+        # Throw away read positions left over from other tests
+        readtracking.buffer.take_pending()
+
+    def add_post(self, parent, model, post_number, posted_at):
+        post = parent.add_child(instance=model(
+            title="Post " + str(post_number),
+            slug='post-' + str(post_number),
+            message="Hello",
+            post_number=post_number,
+            posted_at=posted_at,
+            live=True,
+        ))
+
+        with tasks.post_commit():
+            post.save_revision().publish()
+
+        return post
+
+    def get_topic(self, response):
+        return [topic for topic in response.context['posts'] if topic.id == self.forum_topic.id][0]
+
+    def test_reading_topic(self):
+        self.add_post(self.forum_topic, ForumReply, 1, timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertTrue(self.get_topic(self.client.get(self.forum_index.url)).is_unread)
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertTrue(list(response.context['posts'])[0].is_unread)
+
+        # The read position is written by a task
+        marker = ForumReadMarker.objects.get(user=self.user, page=self.forum_topic)
+        self.assertEqual(marker.post_number, 1)
+        self.assertFalse(self.get_topic(self.client.get(self.forum_index.url)).is_unread)
+        self.assertFalse(list(self.client.get(self.forum_topic.url).context['posts'])[0].is_unread)
+
+        # A new reply makes the topic unread again
+        self.add_post(self.forum_topic, ForumReply, 2, timezone.now())
+
+        self.assertTrue(self.get_topic(self.client.get(self.forum_index.url)).is_unread)
+
+    def use_recording_executor(self):
+        executor = RecordingExecutor()
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = executor
+        return executor
+
+    def test_views_are_coalesced(self):
+        executor = self.use_recording_executor()
+
+        for i in range(3):
+            self.client.get(self.forum_topic.url)
+
+        # One flush is waiting for all of them
+        self.assertEqual(len(readtracking.buffer.pending), 1)
+        self.assertEqual(len(executor.tasks), 1)
+
+        readtracking.flush_read_markers()
+
+        self.assertEqual(ForumReadMarker.objects.count(), 1)
+
+    def test_rolled_back_view_doesnt_stop_flushes(self):
+        with self.assertRaises(ZeroDivisionError):
+            with tasks.post_commit():
+                self.client.get(self.forum_topic.url)
+                1 / 0
+
+        self.client.get(self.forum_topic.url)
+
+        self.assertEqual(readtracking.buffer.pending, {})
+        self.assertTrue(ForumReadMarker.objects.filter(user=self.user, page=self.forum_topic).exists())
+
+    def test_unwritten_positions_are_shown(self):
+        self.add_post(self.forum_topic, ForumReply, 1, timezone.now() - datetime.timedelta(hours=1))
+        self.use_recording_executor()
+
+        self.client.get(self.forum_topic.url)
+
+        self.assertFalse(ForumReadMarker.objects.exists())
+        self.assertFalse(self.get_topic(self.client.get(self.forum_index.url)).is_unread)
+
+    def test_mark_forum_read(self):
+        self.client.get(self.forum_topic.url)
+        readtracking.flush_read_markers()
+
+        other_topic = self.add_post(self.forum_index, ForumTopic, 2, timezone.now())
+        unread = lambda response: [topic.id for topic in response.context['posts'] if topic.is_unread]
+        self.assertEqual(unread(self.client.get(self.forum_index.url)), [other_topic.id])
+
+        response = self.client.post(self.forum_index.url + self.forum_index.reverse_subpage('mark_read'))
+        self.assertRedirects(response, self.forum_index.url)
+
+        # The watermark replaces the marker on the topic
+        self.assertEqual(list(ForumReadMarker.objects.values_list('page_id', 'post_number')), [(self.forum_index.id, None)])
+
+        self.assertEqual(unread(self.client.get(self.forum_index.url)), [])
+
+    def test_mark_read_requires_login(self):
+        self.client.logout()
+
+        response = self.client.post(self.forum_index.url + self.forum_index.reverse_subpage('mark_read'))
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_index_read_state_is_one_query(self):
+        for i in range(5):
+            self.add_post(self.forum_index, ForumTopic, i + 2, timezone.now())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.forum_index.url)
+
+        self.assertEqual(len([query for query in queries.captured_queries if 'wagtailforums_forumreadmarker' in query['sql']]), 1)
+
+
+class RecordingExecutor(object):
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, func, *args, **kwargs):
+        self.tasks.append((func, args, kwargs))
+
+
+@override_settings(WAGTAILFORUMS_NOTIFICATION_BACKEND='wagtailforums.notifications.MemoryBackend')
+class TestNotifications(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index with a topic
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        self.user = self.login()
+        self.subscribers = [
+            User.objects.create_user('subscriber' + str(i), 'subscriber%d@example.com' % i, 'password')
+            for i in range(3)
+        ]
+
+        notifications.MemoryBackend.outbox = []
+
+    def subscribe(self, users, page):
+        for user in users:
+            ForumSubscription.objects.create(user=user, page=page)
+
+    def post_reply(self, message="Reply"):
+        response = self.client.post(self.forum_topic.new_post_url, {
+            'message': message,
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_subscribe_view(self):
+        response = self.client.post(self.forum_topic.url + self.forum_topic.reverse_subpage('subscribe'))
+
+        self.assertRedirects(response, self.forum_topic.url)
+        self.assertTrue(ForumSubscription.objects.filter(user=self.user, page=self.forum_topic).exists())
+        self.assertTrue(self.client.get(self.forum_topic.url).context['user_is_subscribed'])
+
+        self.client.post(self.forum_topic.url + self.forum_topic.reverse_subpage('unsubscribe'))
+
+        self.assertFalse(ForumSubscription.objects.filter(user=self.user, page=self.forum_topic).exists())
+
+    def test_subscribers_are_notified(self):
+        self.subscribe(self.subscribers, self.forum_topic)
+        self.post_reply()
+
+        self.assertEqual(
+            sorted(notification.user.username for notification in notifications.MemoryBackend.outbox),
+            ['subscriber0', 'subscriber1', 'subscriber2'],
+        )
+        self.assertEqual(notifications.MemoryBackend.outbox[0].post.message, "Reply")
+
+        # The author is subscribed to the topic and isn't notified of their own post
+        self.assertTrue(ForumSubscription.objects.filter(user=self.user, page=self.forum_topic).exists())
+
+    def test_users_subscribed_twice_are_notified_once(self):
+        self.subscribe(self.subscribers[:1], self.forum_topic)
+        self.subscribe(self.subscribers[:1], self.forum_index)
+        self.post_reply()
+
+        self.assertEqual(len(notifications.MemoryBackend.outbox), 1)
+
+    def test_digest_window(self):
+        self.subscribe(self.subscribers, self.forum_topic)
+        self.post_reply()
+        self.post_reply("Another reply")
+
+        self.assertEqual(len(notifications.MemoryBackend.outbox), 3)
+
+        ForumSubscription.objects.update(last_notified_at=timezone.now() - datetime.timedelta(hours=2))
+        self.post_reply("A later reply")
+
+        self.assertEqual(len(notifications.MemoryBackend.outbox), 6)
+
+    @override_settings(WAGTAILFORUMS_NOTIFICATION_BATCH_SIZE=2)
+    def test_batches(self):
+        sent = []
+        self.subscribe(self.subscribers, self.forum_topic)
+
+        original_send = notifications.MemoryBackend.send
+        def send(backend, batch):
+            sent.append(len(batch))
+            original_send(backend, batch)
+        notifications.MemoryBackend.send = send
+        self.addCleanup(setattr, notifications.MemoryBackend, 'send', original_send)
+
+        self.post_reply()
+
+        self.assertEqual(sent, [2, 1])
+
+    def test_file_backend(self):
+        with tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False) as f:
+            pass
+        self.addCleanup(os.remove, f.name)
+        self.subscribe(self.subscribers[:1], self.forum_topic)
+
+        with self.settings(WAGTAILFORUMS_NOTIFICATION_BACKEND='wagtailforums.notifications.FileBackend', WAGTAILFORUMS_NOTIFICATION_FILE_PATH=f.name):
+            self.post_reply()
+
+        with open(f.name) as f:
+            self.assertEqual(json.loads(f.read())['user'], self.subscribers[0].pk)
+
+    def test_posting_cost_doesnt_depend_on_subscriber_count(self):
+        executor = RecordingExecutor()
+        self.addCleanup(setattr, tasks, '_executor', tasks._executor)
+        tasks._executor = executor
+
+        # The first post creates the counter
+        self.post_reply()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post_reply()
+        query_count = len(queries)
+
+        self.subscribe(self.subscribers, self.forum_topic)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post_reply()
+
+        self.assertEqual(len(queries), query_count)
+        self.assertEqual(notifications.MemoryBackend.outbox, [])
+
+
+class TestBenchmarks(TestCase):
+    def test_benchmarks_run(self):
+        from benchmarks.fixtures import create_forum
+        from benchmarks.forum import get_benchmarks
+        from benchmarks.runner import run_benchmarks
+
+        forum_index = create_forum(50, replies_per_topic=5, forum_depth=2, forums_per_level=2, users=5)
+
+        self.assertEqual(forum_index.topic_count + forum_index.reply_count, 50)
+        # The importer indexed them for the search benchmarks
+        self.assertEqual(ForumSearchDocument.objects.filter(path__startswith=forum_index.path).count(), 50)
+        self.assertEqual(ForumIndex.objects.descendant_of(forum_index).count(), 6)
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+        results = run_benchmarks(get_benchmarks(forum_index), repeat=1)
+
+        self.assertIn('topic.main', [result['name'] for result in results])
+        self.assertTrue(all(result['queries'] > 0 for result in results if not result['name'].endswith('form_class')))
+
+
+@override_settings(WAGTAILFORUMS_INSTRUMENTATION_SINK='wagtailforums.instrumentation.MemorySink')
+class TestInstrumentation(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        # Create a forum index with a topic
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        instrumentation.MemorySink.records = []
+
+    def test_views_are_recorded(self):
+        self.client.get(self.forum_topic.url)
+        self.client.get(self.forum_index.search_url, {'q': "topic"})
+
+        self.assertEqual(
+            [(view_name, page_type) for view_name, page_type, metrics in instrumentation.MemorySink.records],
+            [('main', 'forumtopic'), ('search', 'forumindex')],
+        )
+
+        metrics = instrumentation.MemorySink.records[0][2]
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreater(metrics['time'], 0)
+        self.assertGreater(metrics['render_time'], 0)
+        self.assertLessEqual(metrics['render_time'], metrics['time'])
+
+    def test_queries_arent_logged(self):
+        initial_queries = len(connection.queries)
+
+        self.client.get(self.forum_topic.url)
+
+        # Queries are counted without switching on Django's query log
+        self.assertFalse(connection.use_debug_cursor)
+        self.assertEqual(len(connection.queries), initial_queries)
+        self.assertGreater(instrumentation.MemorySink.records[0][2]['queries'], 0)
+
+    def test_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.forum_topic.url)
+
+        # The session and user are loaded outside the view
+        metrics = instrumentation.MemorySink.records[0][2]
+        self.assertGreater(metrics['queries'], 0)
+        self.assertLessEqual(metrics['queries'], len(queries))
+
+    def test_cache_hits(self):
+        ForumTopic.cache_views = ('main', )
+        self.addCleanup(setattr, ForumTopic, 'cache_views', ())
+
+        self.client.get(self.forum_topic.url)
+        self.client.get(self.forum_topic.url)
+
+        first, second = [metrics for view_name, page_type, metrics in instrumentation.MemorySink.records]
+        self.assertEqual(first['cache_misses'], 1)
+        self.assertEqual(second['cache_hits'], 2)
+        self.assertEqual(second['render_time'], 0)
+
+    def test_disabled(self):
+        with self.settings(WAGTAILFORUMS_INSTRUMENTATION_SINK=None):
+            self.client.get(self.forum_topic.url)
+
+        self.assertEqual(instrumentation.MemorySink.records, [])
+
+    def test_statsd_sink(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        self.addCleanup(listener.close)
+
+        with self.settings(WAGTAILFORUMS_STATSD_HOST='127.0.0.1', WAGTAILFORUMS_STATSD_PORT=listener.getsockname()[1]):
+            instrumentation.StatsdSink().record('main', 'forumtopic', {'time': 0.5, 'queries': 3})
+
+        self.assertEqual(
+            listener.recv(1024).decode('utf-8').splitlines(),
+            ['wagtailforums.forumtopic.main.queries:3|c', 'wagtailforums.forumtopic.main.time:500.000|ms'],
+        )
+
+
+class TestFlatReplies(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.user = self.login()
+        self.other_user = User.objects.create_user(username='other_user', password='hello123')
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=FlatForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+            message="Hello",
+            owner=self.user,
+        ))
+
+    def post_reply(self, message):
+        response = self.client.post(self.forum_topic.new_post_url, {
+            'message': message,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        return FlatForumReply.objects.get(topic=self.forum_topic, message=message)
+
+    def test_new_reply(self):
+        page_count = Page.objects.count()
+        reply = self.post_reply("Reply")
+
+        # No pages are created
+        self.assertEqual(Page.objects.count(), page_count)
+        self.assertEqual(reply.post_number, 1)
+        self.assertEqual(reply.owner, self.user)
+        self.assertEqual(reply.posted_by, self.user)
+        self.assertTrue(reply.live)
+        self.assertEqual(reply.message_html, "<p>Reply</p>")
+
+        # Stats count it, with the topic standing in as the latest post
+        topic = FlatForumTopic.objects.get(id=self.forum_topic.id)
+        self.assertEqual(topic.reply_count, 1)
+        self.assertEqual(topic.last_post_id, topic.id)
+        self.assertEqual(topic.last_post_at, reply.posted_at)
+
+        forum_index = ForumIndex.objects.get(id=self.forum_index.id)
+        self.assertEqual(forum_index.reply_count, 1)
+        self.assertEqual(forum_index.last_post_at, reply.posted_at)
+
+    def test_listing(self):
+        replies = [self.post_reply("Reply %d" % i) for i in range(3)]
+
+        response = self.client.get(self.forum_topic.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'test/flat_forum_topic.html')
+        self.assertEqual([post.pk for post in response.context['posts']], [reply.pk for reply in replies])
+        self.assertContains(response, replies[0].edit_url)
+        self.assertEqual(replies[0].edit_url, self.forum_topic.url + 'reply/1/edit/')
+        self.assertEqual(replies[0].url, self.forum_topic.url + 'post/1/')
+
+    def test_edit_reply(self):
+        reply = self.post_reply("Reply")
+
+        response = self.client.post(reply.edit_url, {
+            'message': "Edited",
+        })
+
+        self.assertRedirects(response, reply.url, target_status_code=302)
+        reply = FlatForumReply.objects.get(pk=reply.pk)
+        self.assertEqual(reply.message, "Edited")
+        self.assertEqual(reply.message_html, "<p>Edited</p>")
+        self.assertEqual(reply.edited_by, self.user)
+
+        # Editing doesn't count the reply again
+        self.assertEqual(FlatForumTopic.objects.get(id=self.forum_topic.id).reply_count, 1)
+
+    def test_other_user_cant_edit_or_delete(self):
+        reply = self.post_reply("Reply")
+        self.client.login(username='other_user', password='hello123')
+
+        self.assertEqual(self.client.post(reply.edit_url, {'message': "Edited"}).status_code, 403)
+        self.assertEqual(self.client.post(reply.delete_url).status_code, 403)
+        self.assertEqual(FlatForumReply.objects.get(pk=reply.pk).message, "Reply")
+
+    def test_missing_reply(self):
+        self.assertEqual(self.client.get(self.forum_topic.url + 'reply/5/edit/').status_code, 404)
+
+    def test_delete_reply(self):
+        first = self.post_reply("First")
+        second = self.post_reply("Second")
+
+        response = self.client.post(second.delete_url)
+
+        self.assertRedirects(response, self.forum_topic.url)
+        self.assertFalse(FlatForumReply.objects.filter(pk=second.pk).exists())
+
+        topic = FlatForumTopic.objects.get(id=self.forum_topic.id)
+        self.assertEqual(topic.reply_count, 1)
+        self.assertEqual(topic.last_post_at, first.posted_at)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 1)
+
+    def test_rebuild_forum_stats_resets_counted_flag(self):
+        reply = self.post_reply("Reply")
+        FlatForumReply.objects.filter(pk=reply.pk).update(stats_counted=False)
+
+        call_command('rebuild_forum_stats', stdout=StringIO())
+        self.assertTrue(FlatForumReply.objects.get(pk=reply.pk).stats_counted)
+
+        # Deleting it now takes it off the counts
+        self.client.post(reply.delete_url)
+        self.assertEqual(FlatForumTopic.objects.get(id=self.forum_topic.id).reply_count, 0)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 0)
+
+    def test_unpublish_reply(self):
+        reply = self.post_reply("Reply")
+        reply.unpublish()
+
+        self.assertEqual(FlatForumTopic.objects.get(id=self.forum_topic.id).reply_count, 0)
+        self.assertNotContains(self.client.get(self.forum_topic.url), "<p>Reply</p>")
+
+        reply.publish()
+        self.assertEqual(FlatForumTopic.objects.get(id=self.forum_topic.id).reply_count, 1)
+
+    def test_author_is_subscribed(self):
+        self.post_reply("Reply")
+
+        self.assertTrue(ForumSubscription.objects.filter(user=self.user, page=self.forum_topic).exists())
+
+    def test_convert_replies_to_flat(self):
+        topic = self.forum_index.add_child(instance=ForumTopic(title="Old topic", slug='old-topic', live=True))
+        for i in range(3):
+            self.client.post(topic.new_post_url, {'message': "Reply %d" % i})
+
+        # The topic model is switched over to flat replies before converting
+        ForumTopic.post_model = FlatForumReply
+        self.addCleanup(setattr, ForumTopic, 'post_model', ForumReply)
+
+        # The replies are in the search index, which flat replies aren't
+        with self.assertRaises(CommandError):
+            call_command('convert_replies_to_flat', 'test.ForumReply', 'test.FlatForumReply', stdout=StringIO())
+        self.assertEqual(ForumReply.objects.count(), 3)
+
+        call_command('convert_replies_to_flat', 'test.ForumReply', 'test.FlatForumReply', batch_size=2, drop_from_search=True, stdout=StringIO())
+
+        self.assertFalse(ForumReply.objects.exists())
+        replies = FlatForumReply.objects.filter(topic=topic).order_by('post_number')
+        self.assertEqual([(reply.post_number, reply.message) for reply in replies], [(1, "Reply 0"), (2, "Reply 1"), (3, "Reply 2")])
+        self.assertEqual(replies[0].posted_by, self.user)
+
+        topic = ForumTopic.objects.get(id=topic.id)
+        self.assertEqual(topic.numchild, 0)
+        self.assertEqual(topic.reply_count, 3)
+        self.assertEqual(topic.last_post_at, replies[2].posted_at)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 3)
+
+
+class TestBatchTreeWrites(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.user = self.login()
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+        ForumTopic.batch_tree_writes = True
+        self.addCleanup(setattr, ForumTopic, 'batch_tree_writes', False)
+
+        # Blocks reserved by other tests are for other pages
+        from wagtailforums import treewrites
+        treewrites.paths.blocks.clear()
+
+    def post_reply(self, message):
+        response = self.client.post(self.forum_topic.new_post_url, {
+            'message': message,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        return ForumReply.objects.child_of(self.forum_topic).get(message=message)
+
+    def test_new_replies(self):
+        replies = [self.post_reply("Reply %d" % i) for i in range(3)]
+
+        self.assertEqual([reply.path for reply in replies], [Page._get_path(self.forum_topic.path, self.forum_topic.depth + 1, i) for i in range(1, 4)])
+        self.assertEqual(replies[0].url_path, self.forum_topic.url_path + '1/')
+        self.assertTrue(replies[0].live)
+        self.assertEqual(Page.objects.get(id=self.forum_topic.id).numchild, 3)
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+        # One block was reserved for all of them
+        self.assertEqual(ForumPostCounter.objects.get(page=self.forum_topic).last_child_step, self.forum_topic.child_path_block_size)
+
+    def test_numchild_is_incremented(self):
+        # Not recounted, which would read every child of the topic
+        Page.objects.filter(id=self.forum_topic.id).update(numchild=10)
+        self.post_reply("Reply")
+
+        self.assertEqual(Page.objects.get(id=self.forum_topic.id).numchild, 11)
+
+    def test_rolled_back_post_isnt_counted(self):
+        from wagtailforums import treewrites
+
+        try:
+            with tasks.post_commit():
+                treewrites.add_child(self.forum_topic, ForumReply(title="Reply", slug='reply', message="Reply", live=True))
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(Page.objects.get(id=self.forum_topic.id).numchild, 0)
+        self.assertEqual(treewrites.numchild_buffer.take_pending(), {})
+
+    def test_page_added_with_add_child(self):
+        self.post_reply("First")
+
+        # This takes the next path in the block
+        Page.objects.get(id=self.forum_topic.id).specific.add_child(instance=ForumReply(title="Other", slug='other', live=True))
+
+        reply = self.post_reply("Second")
+
+        self.assertEqual(reply.path, Page._get_path(self.forum_topic.path, self.forum_topic.depth + 1, self.forum_topic.child_path_block_size + 1))
+        self.assertEqual(Page.objects.get(id=self.forum_topic.id).numchild, 3)
+
+    def test_repair_forum_tree(self):
+        reply = self.post_reply("Reply")
+        Page.objects.filter(id=self.forum_topic.id).update(numchild=0)
+        Page.objects.filter(id=reply.id).update(url_path='/wrong/')
+
+        call_command('repair_forum_tree', stdout=StringIO())
+
+        self.assertEqual(Page.objects.get(id=self.forum_topic.id).numchild, 1)
+        self.assertEqual(Page.objects.get(id=reply.id).url_path, self.forum_topic.url_path + '1/')
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+
+class TestFormClasses(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+        ))
+
+    def test_form_class_is_reused(self):
+        self.assertIs(ForumTopic.get_form_class(), ForumTopic.get_form_class())
+        self.assertIsNot(ForumTopic.get_form_class(), ForumReply.get_form_class())
+
+    def test_changing_form_fields(self):
+        self.addCleanup(setattr, ForumTopic, 'form_fields', ForumTopic.form_fields)
+        ForumTopic.form_fields = ('title', 'message')
+
+        self.assertEqual(list(ForumTopic.get_form_class().base_fields), ['title', 'message'])
+
+    def test_no_form_for_readers(self):
+        ForumTopic.build_post_form_for_readers = False
+        self.addCleanup(setattr, ForumTopic, 'build_post_form_for_readers', True)
+
+        response = self.client.get(self.forum_topic.url)
+        self.assertIsNone(response.context['post_form'])
+
+        self.login()
+        response = self.client.get(self.forum_topic.url)
+        self.assertIsNotNone(response.context['post_form'])
+
+
+class TestViewTemplates(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.user = self.login()
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+            owner=self.user,
+        ))
+
+    def test_template_names(self):
+        self.assertEqual(ForumTopic.get_view_template_names()['new_post'], ('test/forum_topic_new_post.html', 'wagtailforums/new_post.html'))
+        self.assertEqual(ForumReply.get_view_template_names()['edit'], ('test/forum_reply_edit.html', 'wagtailforums/edit.html'))
+
+    def test_page_type_template(self):
+        response = self.client.get(self.forum_topic.edit_url)
+
+        self.assertTemplateUsed(response, 'test/forum_topic_edit.html')
+
+    def test_generic_template(self):
+        response = self.client.post(self.forum_topic.new_post_url, {})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'wagtailforums/new_post.html')
+
+    @override_settings(WAGTAILFORUMS_CACHE_TEMPLATES=True)
+    def test_templates_are_kept(self):
+        templating.preload_templates([ForumTopic])
+
+        template = self.forum_topic.get_view_template('search')
+        self.assertEqual(template.name, 'wagtailforums/search.html')
+        self.assertIs(self.forum_topic.get_view_template('search'), template)
+
+    @override_settings(WAGTAILFORUMS_CACHE_TEMPLATES=False)
+    def test_templates_are_reloaded_when_not_cached(self):
+        self.assertIsNot(self.forum_topic.get_view_template('search'), self.forum_topic.get_view_template('search'))
+
+
+class TestForumTree(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.user = self.login()
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.sub_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Subforum",
+            slug='subforum',
+            live=True,
+        ))
+        self.unpublished_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Unpublished subforum",
+            slug='unpublished-subforum',
+            live=False,
+        ))
+        self.forum_topic = self.sub_forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+            owner=self.user,
+        ))
+        self.forum_reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            message="Hello",
+            live=True,
+            owner=self.user,
+        ))
+
+    def test_tree(self):
+        tree = navigation.get_forum_tree()
+
+        self.assertEqual([node.title for node in tree.roots], ["Forums"])
+        self.assertEqual([node.title for node in tree.get(self.forum_index.id).children], ["Subforum"])
+        self.assertEqual(tree.get(self.sub_forum_index.id).url, self.sub_forum_index.url)
+
+    def test_cached_tree_urls_follow_script_prefix(self):
+        navigation.get_forum_tree()
+
+        # Another request is served under a different SCRIPT_NAME
+        self.addCleanup(set_script_prefix, get_script_prefix())
+        set_script_prefix('/community/')
+
+        self.assertEqual(navigation.get_forum_tree().get(self.sub_forum_index.id).url, '/community/forums/subforum/')
+
+    def test_breadcrumbs(self):
+        tree = navigation.get_forum_tree()
+
+        self.assertEqual([node.id for node in tree.get_ancestors(self.forum_reply)], [self.forum_index.id, self.sub_forum_index.id])
+        self.assertEqual([node.id for node in tree.get_ancestors(self.sub_forum_index, inclusive=True)], [self.forum_index.id, self.sub_forum_index.id])
+
+    def test_warm_tree_doesnt_query_pages(self):
+        navigation.get_forum_tree()
+
+        with CaptureQueriesContext(connection) as queries:
+            tree = navigation.get_forum_tree()
+            tree.get_ancestors(self.forum_topic)
+            tree.get_children(self.forum_index)
+
+        # The tests use the database cache
+        self.assertEqual([query['sql'] for query in queries if 'FROM "cache"' not in query['sql']], [])
+
+    def test_tree_is_fetched_once_per_request(self):
+        request = self.client.get(self.forum_index.url).wsgi_request
+
+        with self.assertNumQueries(0):
+            navigation.get_request_forum_tree(request)
+
+    def test_tree_is_rebuilt_when_forum_changes(self):
+        navigation.get_forum_tree()
+
+        self.sub_forum_index.title = "Renamed subforum"
+        self.sub_forum_index.save()
+        self.forum_index.add_child(instance=ForumIndex(
+            title="New subforum",
+            slug='new-subforum',
+            live=True,
+        ))
+
+        tree = navigation.get_forum_tree()
+        self.assertEqual([node.title for node in tree.get_children(self.forum_index)], ["Renamed subforum", "New subforum"])
+
+    def test_tree_is_rebuilt_when_forum_moves(self):
+        navigation.get_forum_tree()
+
+        Page.objects.get(id=self.sub_forum_index.id).move(self.home_page, pos='last-child')
+
+        tree = navigation.get_forum_tree()
+        self.assertEqual(tree.get_children(self.forum_index), [])
+        self.assertEqual(tree.get(self.sub_forum_index.id).url, '/subforum/')
+
+    def test_index_lists_subforums(self):
+        response = self.client.get(self.forum_index.url)
+
+        self.assertEqual([node.id for node in response.context['indexes']], [self.sub_forum_index.id])
+
+    def test_parent_url(self):
+        self.assertEqual(pageurls.get_parent_url(self.forum_reply), self.forum_topic.url)
+
+    def test_reply_delete_redirects_to_topic(self):
+        response = self.client.post(self.forum_reply.delete_url)
+
+        self.assertRedirects(response, self.forum_topic.url)
+
+    def test_template_tags(self):
+        template = Template(
+            "{% load wagtailforums_tags %}"
+            "{% get_forum_breadcrumbs page as breadcrumbs %}{% for forum in breadcrumbs %}{{ forum }} / {% endfor %}|"
+            "{% get_subforums page as subforums %}{% for forum in subforums %}{{ forum }}{% endfor %}|"
+            "{% get_forum_tree as tree %}{{ tree.roots|length }}"
+        )
+
+        self.assertEqual(template.render(Context({'page': self.forum_topic})), "Forums / Subforum / ||1")
+        self.assertEqual(template.render(Context({'page': self.forum_index})), "Forums / |Subforum|1")
+
+
+class TestPageUrls(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+        self.user = self.login()
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            live=True,
+            owner=self.user,
+        ))
+        self.forum_replies = [
+            self.forum_topic.add_child(instance=ForumReply(
+                title="Reply " + str(i),
+                slug='reply-' + str(i),
+                message="Hello",
+                post_number=i + 2,
+                live=True,
+                owner=self.user,
+            ))
+            for i in range(5)
+        ]
+
+    def test_urls_match_wagtail(self):
+        reply = self.forum_replies[0]
+
+        self.assertEqual(reply.url, Page.url.fget(reply))
+        self.assertEqual(reply.edit_url, Page.url.fget(reply) + reply.reverse_subpage('edit'))
+        self.assertEqual(self.forum_index.search_url, Page.url.fget(self.forum_index) + self.forum_index.reverse_subpage('search'))
+        self.assertEqual(self.forum_topic.get_page_url(3), Page.url.fget(self.forum_topic) + self.forum_topic.reverse_subpage('page', kwargs={'page_number': '3'}))
+
+    def test_urls_with_several_sites(self):
+        Site.objects.create(hostname='other.example.com', root_page=self.forum_index)
+
+        self.assertEqual(self.forum_topic.url, Page.url.fget(self.forum_topic))
+        self.assertEqual(self.forum_topic.url, 'http://other.example.com/topic/')
+
+    def test_urls_follow_script_prefix(self):
+        self.assertEqual(self.forum_topic.url, '/forums/topic/')
+
+        # Another request is served under a different SCRIPT_NAME
+        self.addCleanup(set_script_prefix, get_script_prefix())
+        set_script_prefix('/community/')
+
+        self.assertEqual(self.forum_topic.url, '/community/forums/topic/')
+        self.assertEqual(self.forum_topic.url, Page.url.fget(self.forum_topic))
+
+    def test_root_paths_are_looked_up_once_per_request(self):
+        pageurls.get_site_root_paths()
+
+        with pageurls.request_scope():
+            # The tests use the database cache
+            with self.assertNumQueries(1):
+                for reply in self.forum_replies:
+                    reply.url, reply.edit_url, reply.delete_url
+
+    def test_annotated_urls_dont_query(self):
+        replies = pageurls.annotate_urls(Page.objects.get(id=reply.id).specific for reply in self.forum_replies)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [(reply.url, reply.edit_url) for reply in replies],
+                [('/forums/topic/reply-%d/' % i, '/forums/topic/reply-%d/edit/' % i) for i in range(5)]
+            )
+
+    def test_annotated_url_follows_url_path(self):
+        reply = pageurls.annotate_urls([self.forum_replies[0]])[0]
+
+        reply.slug = 'renamed'
+        reply.save()
+
+        self.assertEqual(reply.url, '/forums/topic/renamed/')
+
+    def test_flat_reply_urls(self):
+        topic = self.forum_index.add_child(instance=FlatForumTopic(
+            title="Flat topic",
+            slug='flat-topic',
+            message="Hello",
+            live=True,
+            owner=self.user,
+        ))
+        reply = FlatForumReply(message="Hello")
+        reply.save_new(topic, self.user, live=True)
+        pageurls.annotate_urls([reply])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(reply.edit_url, '/forums/flat-topic/reply/%d/edit/' % reply.post_number)
+            self.assertEqual(reply.url, '/forums/flat-topic/post/%d/' % reply.post_number)
+
+    def test_subpage_suffix(self):
+        self.assertEqual(ForumTopic.get_subpage_suffix('post', post_number=12), 'post/12/')
+        self.assertEqual(ForumTopic.get_subpage_suffix('new_post'), 'new_post/')
+
+
+class TestRateLimits(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+            post_limit_per_user=2,
+        ))
+        self.sub_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Subforum",
+            slug='subforum',
+            live=True,
+        ))
+        self.forum_topic = self.sub_forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            message="Hello",
+            live=True,
+        ))
+
+        self.user = User.objects.create_user(username='member', password='password')
+        self.other_user = User.objects.create_user(username='other', password='password')
+        self.client.login(username='member', password='password')
+
+    def post_reply(self, client=None, **extra):
+        return (client or self.client).post(self.forum_topic.new_post_url, {'message': "Reply"}, **extra)
+
+    def test_limit_per_user(self):
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.assertEqual(self.post_reply().status_code, 302)
+
+        response = self.post_reply()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertTemplateUsed(response, 'wagtailforums/rate_limited.html')
+        self.assertEqual(ForumReply.objects.child_of(self.forum_topic).count(), 2)
+
+        # Other users have their own limit
+        self.client.login(username='other', password='password')
+        self.assertEqual(self.post_reply().status_code, 302)
+
+    def test_checked_before_form(self):
+        self.post_reply()
+        self.post_reply()
+
+        # An invalid form would be shown again if it was built
+        response = self.client.post(self.forum_topic.new_post_url, {})
+        self.assertEqual(response.status_code, 429)
+
+    def test_showing_form_isnt_counted(self):
+        for i in range(3):
+            self.client.get(self.forum_topic.new_post_url)
+
+        self.assertEqual(self.post_reply().status_code, 302)
+
+    def test_nearest_forum_limit_is_used(self):
+        self.sub_forum_index.post_limit_per_user = 1
+        self.sub_forum_index.save()
+
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.assertEqual(self.post_reply().status_code, 429)
+
+    def test_limit_per_forum(self):
+        self.sub_forum_index.post_limit_per_forum = 1
+        self.sub_forum_index.save()
+
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.client.login(username='other', password='password')
+        self.assertEqual(self.post_reply().status_code, 429)
+
+    def test_limit_per_ip(self):
+        self.forum_index.post_limit_per_user = None
+        self.forum_index.post_limit_per_ip = 1
+        self.forum_index.save()
+
+        self.assertEqual(self.post_reply(REMOTE_ADDR='192.0.2.1').status_code, 302)
+        self.assertEqual(self.post_reply(REMOTE_ADDR='192.0.2.2').status_code, 302)
+        self.assertEqual(self.post_reply(REMOTE_ADDR='192.0.2.1').status_code, 429)
+
+    @override_settings(WAGTAILFORUMS_POST_LIMITS={'per_user': 1})
+    def test_default_limits(self):
+        self.forum_index.post_limit_per_user = None
+        self.forum_index.save()
+
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.assertEqual(self.post_reply().status_code, 429)
+
+    def test_edits_are_counted_separately(self):
+        reply = self.forum_topic.add_child(instance=ForumReply(
+            title="Reply",
+            slug='reply',
+            message="Hello",
+            live=True,
+            owner=self.user,
+        ))
+        self.post_reply()
+        self.post_reply()
+
+        self.assertEqual(self.client.post(reply.edit_url, {'message': "Edited"}).status_code, 302)
+        self.assertEqual(self.client.post(reply.edit_url, {'message': "Edited again"}).status_code, 302)
+        self.assertEqual(self.client.post(reply.edit_url, {'message': "Edited again"}).status_code, 429)
+
+    def test_moderators_arent_limited(self):
+        self.login()
+
+        for i in range(3):
+            self.assertEqual(self.post_reply().status_code, 302)
+
+    @override_settings(WAGTAILFORUMS_RATE_LIMIT_STORE='wagtailforums.ratelimit.LocalStore')
+    def test_local_store(self):
+        self.addCleanup(ratelimit._stores.clear)
+
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.assertEqual(self.post_reply().status_code, 302)
+        self.assertEqual(self.post_reply().status_code, 429)
+
+    def test_token_bucket_refills(self):
+        store = ratelimit.LocalStore()
+
+        self.assertEqual(store.hit('key', 2, 10), 0)
+        self.assertEqual(store.hit('key', 2, 10), 0)
+        self.assertEqual(store.hit('key', 2, 10), 5)
+
+        # The hit over the limit took a token too, so it takes a period to
+        # get one back
+        tokens, updated_at = store.buckets['key']
+        store.buckets['key'] = (tokens, updated_at - 5)
+        self.assertTrue(store.hit('key', 2, 10) > 0)
+
+        tokens, updated_at = store.buckets['key']
+        store.buckets['key'] = (tokens, updated_at - 10)
+        self.assertEqual(store.hit('key', 2, 10), 0)
+
+    def test_sliding_window_counts_previous_period(self):
+        store = ratelimit.CacheStore()
+        self.assertEqual(store.hit('key', 1, 3600), 0)
+
+        # Move the hit to the previous period, it's still partly in the window
+        window = int(time.time() // 3600)
+        cache_key = 'wagtailforums:ratelimit:key:%d' % window
+        cache.get_cache().set('wagtailforums:ratelimit:key:%d' % (window - 1), cache.get_cache().get(cache_key))
+        cache.get_cache().delete(cache_key)
+
+        self.assertTrue(store.hit('key', 1, 3600) > 0)
+
+
+class TestModeration(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.sub_forum_index = self.forum_index.add_child(instance=ForumIndex(
+            title="Subforum",
+            slug='subforum',
+            live=True,
+        ))
+        self.forum_topic = self.sub_forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            message="Hello",
+            live=True,
+        ))
+
+        self.flat_topic = self.sub_forum_index.add_child(instance=FlatForumTopic(
+            title="Flat topic",
+            slug='flat-topic',
+            message="Hello",
+            live=True,
+        ))
+
+        ForumTopic.moderate_posts = True
+        self.addCleanup(setattr, ForumTopic, 'moderate_posts', False)
+        FlatForumTopic.moderate_posts = True
+        self.addCleanup(setattr, FlatForumTopic, 'moderate_posts', False)
+
+        self.member = User.objects.create_user(username='member', password='password')
+        self.client.login(username='member', password='password')
+
+    def post_replies(self, *messages):
+        for message in messages:
+            response = self.client.post(self.forum_topic.new_post_url, {'message': message})
+            self.assertEqual(response.status_code, 302)
+
+        return list(moderation.get_pending_revisions().order_by('id'))
+
+    def post_flat_replies(self, *messages):
+        for message in messages:
+            response = self.client.post(self.flat_topic.new_post_url, {'message': message})
+            self.assertEqual(response.status_code, 302)
+
+        return list(FlatForumReply.objects.filter(submitted_for_moderation=True).order_by('id'))
+
+    def test_posts_are_queued(self):
+        revisions = self.post_replies("Hello")
+
+        self.assertEqual(len(revisions), 1)
+        self.assertFalse(revisions[0].page.live)
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).reply_count, 0)
+
+    def test_publishers_arent_moderated(self):
+        self.login()
+
+        self.assertEqual(self.post_replies("Hello"), [])
+
+    def test_pending_counts(self):
+        self.post_replies("One", "Two")
+
+        counts = moderation.count_pending(navigation.get_forum_tree())
+        self.assertEqual(counts[self.forum_index.id], 2)
+        self.assertEqual(counts[self.sub_forum_index.id], 2)
+
+    def test_pending_counts_are_one_query_per_depth(self):
+        self.post_replies("One", "Two")
+        other_topic = self.forum_index.add_child(instance=ForumTopic(title="Other topic", slug='other-topic', message="Hi", live=True))
+        self.client.post(other_topic.new_post_url, {'message': "Three"})
+
+        tree = navigation.get_forum_tree()
+        moderation.get_post_content_types()
+
+        # And one for the flat replies
+        with self.assertNumQueries(3):
+            counts = moderation.count_pending(tree)
+
+        self.assertEqual(counts, {self.forum_index.id: 3, self.sub_forum_index.id: 2})
+
+    def test_flat_replies_are_queued(self):
+        self.post_replies("One")
+        replies = self.post_flat_replies("Two")
+
+        self.assertEqual(len(replies), 1)
+        self.assertFalse(replies[0].live)
+        self.assertEqual(FlatForumTopic.objects.get(id=self.flat_topic.id).reply_count, 0)
+
+        counts = moderation.count_pending(navigation.get_forum_tree())
+        self.assertEqual(counts[self.forum_index.id], 2)
+        self.assertEqual(counts[self.sub_forum_index.id], 2)
+
+        # After the revisions
+        items = list(moderation.get_queue_page(self.forum_index))
+        self.assertEqual([item.post.message for item in items], ["One", "Two"])
+        self.assertIsNone(items[1].revision)
+        self.assertEqual(items[1].submitted_by, self.member)
+        self.assertEqual(items[1].author_history.pending_posts, 2)
+
+    def test_keyset_pagination(self):
+        revisions = self.post_replies("One", "Two", "Three")
+
+        first_page = moderation.get_queue_page(self.forum_index, per_page=2)
+        self.assertEqual([item.revision.id for item in first_page], [revisions[0].id, revisions[1].id])
+
+        second_page = moderation.get_queue_page(self.forum_index, after=first_page.next_after, per_page=2)
+        self.assertEqual([item.revision.id for item in second_page], [revisions[2].id])
+        self.assertIsNone(second_page.next_after)
+
+    def test_keyset_pagination_with_flat_replies(self):
+        self.post_replies("One", "Two")
+        self.post_flat_replies("Three", "Four", "Five")
+
+        messages = []
+        after = None
+        for i in range(3):
+            queue_page = moderation.get_queue_page(self.forum_index, after=after, per_page=2)
+            messages.append([item.post.message for item in queue_page])
+            after = queue_page.next_after
+
+        self.assertEqual(messages, [["One", "Two"], ["Three", "Four"], ["Five"]])
+        self.assertIsNone(after)
+
+        with self.assertRaises(ValueError):
+            moderation.get_queue_page(self.forum_index, after='wagtailcore.page-1')
+
+    def test_queue_query_count_doesnt_depend_on_page_size(self):
+        # More than fit on either page size, so neither gets to the flat replies
+        self.post_replies("One", "Two", "Three", "Four", "Five", "Six", "Seven")
+
+        with CaptureQueriesContext(connection) as queries:
+            moderation.get_queue_page(self.forum_index, per_page=2)
+        query_count = len(queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            moderation.get_queue_page(self.forum_index, per_page=6)
+        self.assertEqual(len(queries), query_count)
+
+    def test_author_history_and_spam_score(self):
+        self.post_replies("Buy now http://example.com http://example.com", "Buy now http://example.com http://example.com", "Hello")
+        moderation.reject(moderation.get_pending_revisions().filter(id=moderation.get_pending_revisions().order_by('id')[0].id))
+
+        items = list(moderation.get_queue_page(self.forum_index))
+        self.assertEqual(items[0].author_history, moderation.AuthorHistory(0, 2, 1, self.member.date_joined))
+
+        # Links, a copy of the message and a new author with a rejected post
+        self.assertEqual(items[0].spam_score, 30 + 30 + 15 + 10 + 10)
+        self.assertEqual(items[1].spam_score, 15 + 10 + 10)
+
+    def test_approve(self):
+        revisions = self.post_replies("One", "Two")
+        moderation.approve(moderation.get_pending_revisions())
+
+        self.assertEqual(ForumReply.objects.live().child_of(self.forum_topic).count(), 2)
+        self.assertEqual(moderation.get_pending_revisions().count(), 0)
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).reply_count, 2)
+        self.assertEqual(ForumReply.objects.get(id=revisions[0].page_id).url_path, '/home/forums/subforum/topic/1/')
+
+    @override_settings(WAGTAILFORUMS_NOTIFICATION_BACKEND='wagtailforums.notifications.MemoryBackend')
+    def test_approve_notifies_subscribers(self):
+        self.addCleanup(setattr, notifications.MemoryBackend, 'outbox', [])
+        notifications.MemoryBackend.outbox = []
+        subscriber = User.objects.create_user(username='subscriber', password='password')
+        ForumSubscription.objects.create(user=subscriber, page=self.forum_topic)
+
+        self.post_replies("One")
+        self.assertEqual(notifications.MemoryBackend.outbox, [])
+
+        moderation.approve(moderation.get_pending_revisions())
+        self.assertEqual([notification.user for notification in notifications.MemoryBackend.outbox], [subscriber])
+        self.assertEqual(notifications.MemoryBackend.outbox[0].post.message, "One")
+
+        # Approving an edit of a post that's already live doesn't notify again
+        reply = ForumReply.objects.get(message="One")
+        reply.message = "Edited"
+        reply.save_revision(user=self.member, submitted_for_moderation=True)
+        moderation.approve(moderation.get_pending_revisions())
+        self.assertEqual(len(notifications.MemoryBackend.outbox), 1)
+
+    def test_reject(self):
+        self.post_replies("One")
+        self.assertEqual(moderation.reject(moderation.get_pending_revisions()), 1)
+
+        self.assertEqual(moderation.get_pending_revisions().count(), 0)
+        self.assertEqual(ForumReply.objects.live().child_of(self.forum_topic).count(), 0)
+
+    @override_settings(WAGTAILFORUMS_NOTIFICATION_BACKEND='wagtailforums.notifications.MemoryBackend')
+    def test_approve_flat_replies(self):
+        self.addCleanup(setattr, notifications.MemoryBackend, 'outbox', [])
+        notifications.MemoryBackend.outbox = []
+        subscriber = User.objects.create_user(username='subscriber', password='password')
+        ForumSubscription.objects.create(user=subscriber, page=self.flat_topic)
+
+        self.post_flat_replies("One", "Two")
+        self.assertEqual(moderation.approve_flat_replies(moderation.get_pending_flat_replies(self.forum_index)), 2)
+
+        self.assertEqual(FlatForumReply.objects.filter(topic=self.flat_topic, live=True).count(), 2)
+        self.assertEqual(FlatForumReply.objects.filter(submitted_for_moderation=True).count(), 0)
+        self.assertEqual(FlatForumTopic.objects.get(id=self.flat_topic.id).reply_count, 2)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 2)
+
+        # Once, as notifications are sent at most once per digest window
+        self.assertEqual([notification.user for notification in notifications.MemoryBackend.outbox], [subscriber])
+        self.assertEqual(notifications.MemoryBackend.outbox[0].post.message, "One")
+
+    def test_reject_flat_replies(self):
+        self.post_flat_replies("One")
+        self.assertEqual(moderation.reject_flat_replies(moderation.get_pending_flat_replies()), 1)
+
+        self.assertEqual(FlatForumReply.objects.filter(submitted_for_moderation=True).count(), 0)
+        self.assertEqual(FlatForumReply.objects.filter(live=True).count(), 0)
+        self.assertEqual(moderation.get_author_histories([self.member.id])[self.member.id].rejected_posts, 1)
+
+    def test_dashboard(self):
+        revisions = self.post_replies("One", "Two")
+        self.login()
+
+        response = self.client.get('/admin/forums/moderation/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict((forum.id, forum.pending_count) for forum in response.context['forums'])[self.forum_index.id], 2)
+
+        response = self.client.get('/admin/forums/moderation/%d/' % self.forum_index.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['queue_page']), 2)
+
+        response = self.client.post('/admin/forums/moderation/%d/' % self.forum_index.id, {
+            'action': 'approve',
+            'revision': [revisions[0].id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ForumReply.objects.get(id=revisions[0].page_id).live)
+        self.assertFalse(ForumReply.objects.get(id=revisions[1].page_id).live)
+
+    def test_dashboard_flat_replies(self):
+        revisions = self.post_replies("One")
+        replies = self.post_flat_replies("Two", "Three")
+        self.login()
+
+        response = self.client.get('/admin/forums/moderation/%d/' % self.forum_index.id)
+        self.assertEqual(len(response.context['queue_page']), 3)
+        self.assertContains(response, 'value="%s"' % moderation.get_flat_reply_key(replies[0]))
+
+        response = self.client.post('/admin/forums/moderation/%d/' % self.forum_index.id, {
+            'action': 'approve',
+            'revision': [revisions[0].id],
+            'flat_reply': [moderation.get_flat_reply_key(replies[0])],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ForumReply.objects.get(id=revisions[0].page_id).live)
+        self.assertTrue(FlatForumReply.objects.get(id=replies[0].id).live)
+        self.assertFalse(FlatForumReply.objects.get(id=replies[1].id).live)
+
+        response = self.client.post('/admin/forums/moderation/%d/' % self.forum_index.id, {
+            'action': 'reject',
+            'flat_reply': [moderation.get_flat_reply_key(replies[1])],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(FlatForumReply.objects.get(id=replies[1].id).submitted_for_moderation)
+
+        response = self.client.post('/admin/forums/moderation/%d/' % self.forum_index.id, {
+            'action': 'approve',
+            'flat_reply': ['auth.user-1'],
+        })
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/admin/forums/moderation/%d/?after=nonsense' % self.forum_index.id)
+        self.assertEqual(response.status_code, 404)
+
+    def test_dashboard_bad_revision_id(self):
+        self.post_replies("One")
+        self.login()
+
+        response = self.client.post('/admin/forums/moderation/%d/' % self.forum_index.id, {
+            'action': 'approve',
+            'revision': ['1 OR 1=1'],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(moderation.get_pending_revisions().count(), 1)
+
+    def test_only_publishers_can_moderate(self):
+        tree, forums = views.get_moderated_forums(self.member)
+
+        self.assertEqual(forums, [])
+
+
+class TestTopicOperations(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.home_page = Page.objects.get(id=2)
+
+        self.forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Forums",
+            slug='forums',
+            live=True,
+        ))
+        self.other_forum_index = self.home_page.add_child(instance=ForumIndex(
+            title="Other forums",
+            slug='other-forums',
+            live=True,
+        ))
+        self.forum_topic = self.forum_index.add_child(instance=ForumTopic(
+            title="Topic",
+            slug='topic',
+            message="Hello",
+            live=True,
+        ))
+        self.other_forum_topic = self.other_forum_index.add_child(instance=ForumTopic(
+            title="Other topic",
+            slug='other-topic',
+            message="Hello again",
+            live=True,
+        ))
+
+        self.user = self.login()
+
+    def post_replies(self, topic, *messages):
+        for message in messages:
+            response = self.client.post(topic.new_post_url, {'message': message})
+            self.assertEqual(response.status_code, 302)
+
+    def get_replies(self, topic):
+        return list(ForumReply.objects.child_of(topic).order_by('post_number').values_list('post_number', 'slug', 'url_path', 'message'))
+
+    def test_closed_topic_only_takes_posts_from_moderators(self):
+        member = User.objects.create_user(username='member', password='password')
+        topics.close_topics([self.forum_topic])
+
+        topic = ForumTopic.objects.get(id=self.forum_topic.id)
+        self.assertTrue(topic.closed)
+        self.assertFalse(topic.user_can_create_post(member))
+        self.assertTrue(topic.user_can_create_post(self.user))
+
+        topics.close_topics([topic], closed=False)
+        self.assertTrue(ForumTopic.objects.get(id=self.forum_topic.id).user_can_create_post(member))
+
+    def test_closed_isnt_overwritten_by_publishing(self):
+        revision = self.forum_topic.save_revision()
+        topics.close_topics([self.forum_topic])
+        revision.publish()
+
+        self.assertTrue(ForumTopic.objects.get(id=self.forum_topic.id).closed)
+
+    def test_move_topic(self):
+        self.post_replies(self.forum_topic, "One", "Two")
+
+        topics.move_topic(self.forum_topic, self.other_forum_index)
+
+        topic = ForumTopic.objects.get(id=self.forum_topic.id)
+        self.assertEqual(topic.get_parent().id, self.other_forum_index.id)
+        self.assertEqual(topic.url_path, '/home/other-forums/topic/')
+        self.assertEqual([reply[2] for reply in self.get_replies(topic)], ['/home/other-forums/topic/1/', '/home/other-forums/topic/2/'])
+        self.assertEqual(ForumReply.objects.child_of(topic).count(), 2)
+
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).topic_count, 0)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 0)
+        self.assertEqual(ForumIndex.objects.get(id=self.other_forum_index.id).topic_count, 2)
+        self.assertEqual(ForumIndex.objects.get(id=self.other_forum_index.id).reply_count, 2)
+        self.assertEqual(Page.objects.get(id=self.forum_index.id).numchild, 0)
+        self.assertEqual(Page.objects.get(id=self.other_forum_index.id).numchild, 2)
+
+        self.assertEqual(set(ForumSearchDocument.objects.filter(path__startswith=topic.path).values_list('forum_id', flat=True)), {self.other_forum_index.id})
+        self.assertEqual(len(search.search("two", scope=self.other_forum_index)), 1)
+
+        # The tree is still valid
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+    def test_move_topic_takes_number_in_forum(self):
+        # Both topics are the first in their forum
+        ForumTopic.objects.filter(id__in=[self.forum_topic.id, self.other_forum_topic.id]).update(post_number=1)
+        self.forum_topic.post_number = 1
+
+        topics.move_topic(self.forum_topic, self.other_forum_index)
+
+        post_numbers = list(ForumTopic.objects.child_of(self.other_forum_index).values_list('post_number', flat=True))
+        self.assertEqual(sorted(post_numbers), [1, 2])
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).post_number, 2)
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).get_parent().specific.get_next_post_number(), 3)
+
+    def test_move_topic_updates_revisions(self):
+        revision = ForumTopic.objects.get(id=self.forum_topic.id).save_revision(user=self.user)
+        self.assertEqual(revision.as_page_object().post_number, 1)
+
+        # The other forum has had two topics
+        self.other_forum_index.get_next_post_number()
+        self.other_forum_index.get_next_post_number()
+        topics.move_topic(ForumTopic.objects.get(id=self.forum_topic.id), self.other_forum_index)
+
+        # Publishing the revision doesn't put back the old post number
+        PageRevision.objects.get(id=revision.id).publish()
+
+        topic = ForumTopic.objects.get(id=self.forum_topic.id)
+        self.assertEqual(topic.post_number, 3)
+        self.assertEqual(topic.url_path, '/home/other-forums/topic/')
+
+    def test_move_topic_with_clashing_slug(self):
+        self.other_forum_index.add_child(instance=ForumTopic(title="Topic", slug='topic', message="Hello", live=True))
+
+        with self.assertRaises(topics.TopicOperationError):
+            topics.move_topic(self.forum_topic, self.other_forum_index)
+
+    def test_merge_topics(self):
+        self.post_replies(self.forum_topic, "One", "Two")
+        self.post_replies(self.other_forum_topic, "Three")
+        member = User.objects.create_user(username='member', password='password')
+        ForumSubscription.objects.create(user=member, page=self.other_forum_topic)
+
+        topics.merge_topics(ForumTopic.objects.get(id=self.other_forum_topic.id), self.forum_topic)
+
+        self.assertFalse(Page.objects.filter(id=self.other_forum_topic.id).exists())
+        self.assertEqual(self.get_replies(self.forum_topic), [
+            (1, '1', '/home/forums/topic/1/', "One"),
+            (2, '2', '/home/forums/topic/2/', "Two"),
+            (3, '3-other-topic', '/home/forums/topic/3-other-topic/', "Hello again"),
+            (4, '4', '/home/forums/topic/4/', "Three"),
+        ])
+        self.assertEqual(ForumReply.objects.get(post_number=4).title, '4')
+
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).reply_count, 4)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).reply_count, 4)
+        self.assertEqual(ForumIndex.objects.get(id=self.other_forum_index.id).topic_count, 0)
+        self.assertEqual(ForumSubscription.objects.get(user=member).page_id, self.forum_topic.id)
+        self.assertEqual(ForumSubscription.objects.filter(page=self.forum_topic).count(), 2)
+        self.assertEqual(len(search.search("three", scope=self.forum_index)), 1)
+
+        # New replies are numbered after the merged ones
+        self.post_replies(self.forum_topic, "Five")
+        self.assertEqual(self.get_replies(self.forum_topic)[-1][:2], (5, '5'))
+
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+    def test_merge_then_approve(self):
+        self.post_replies(self.forum_topic, "One", "Two")
+        self.post_replies(self.other_forum_topic, "Three")
+
+        # An edit of "Three" is waiting for moderation
+        reply = ForumReply.objects.get(message="Three")
+        reply.message = "Edited"
+        reply.save_revision(user=self.user, submitted_for_moderation=True)
+
+        topics.merge_topics(ForumTopic.objects.get(id=self.other_forum_topic.id), self.forum_topic)
+        moderation.approve(moderation.get_pending_revisions())
+
+        reply = ForumReply.objects.get(id=reply.id)
+        self.assertEqual((reply.post_number, reply.title, reply.slug, reply.url_path), (4, '4', '4', '/home/forums/topic/4/'))
+        self.assertEqual(reply.message, "Edited")
+
+        # The opening post of the source has a revision in its new place
+        opening_post = ForumReply.objects.get(post_number=3).get_latest_revision().as_page_object()
+        self.assertEqual((opening_post.slug, opening_post.url_path), ('3-other-topic', '/home/forums/topic/3-other-topic/'))
+        self.assertEqual(opening_post.message, "Hello again")
+
+    def test_split_topic(self):
+        self.post_replies(self.forum_topic, "One", "Two", "Three")
+
+        new_topic = topics.split_topic(self.forum_topic, 2, "New topic", forum=self.other_forum_index)
+
+        self.assertEqual(new_topic.get_parent().id, self.other_forum_index.id)
+        self.assertEqual(new_topic.message, "Two")
+        self.assertEqual(self.get_replies(self.forum_topic), [(1, '1', '/home/forums/topic/1/', "One")])
+        self.assertEqual(self.get_replies(new_topic), [(1, '1', new_topic.url_path + '1/', "Three")])
+
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).reply_count, 1)
+        self.assertEqual(ForumTopic.objects.get(id=new_topic.id).reply_count, 1)
+        self.assertEqual(ForumIndex.objects.get(id=self.other_forum_index.id).topic_count, 2)
+
+        # It has a revision, made by the author of its opening post
+        revision = new_topic.get_latest_revision()
+        self.assertEqual(revision.user, self.user)
+        self.assertEqual(revision.as_page_object().message, "Two")
+
+        self.post_replies(new_topic, "Four")
+        self.assertEqual(self.get_replies(new_topic)[-1][:2], (2, '2'))
+
+        self.assertEqual(Page.find_problems(), ([], [], [], [], []))
+
+    def test_split_at_unpublished_post(self):
+        self.post_replies(self.forum_topic, "One", "Two")
+        with tasks.post_commit():
+            ForumReply.objects.get(message="Two").unpublish()
+
+        new_topic = topics.split_topic(self.forum_topic, 2, "New topic")
+
+        self.assertFalse(ForumTopic.objects.get(id=new_topic.id).live)
+        self.assertEqual(ForumIndex.objects.get(id=self.forum_index.id).topic_count, 1)
+
+    def test_split_without_replies(self):
+        with self.assertRaises(topics.TopicOperationError):
+            topics.split_topic(self.forum_topic, 1, "New topic")
+
+    def test_merge_flat_topics(self):
+        source = self.forum_index.add_child(instance=FlatForumTopic(title="Source", slug='source', message="Source", live=True))
+        target = self.forum_index.add_child(instance=FlatForumTopic(title="Target", slug='target', message="Target", live=True))
+        self.post_replies(source, "One")
+        self.post_replies(target, "Two")
+
+        topics.merge_topics(source, target)
+
+        self.assertEqual(
+            list(FlatForumReply.objects.filter(topic=target).order_by('post_number').values_list('post_number', 'message')),
+            [(1, "Two"), (2, "Source"), (3, "One")]
+        )
+        self.assertEqual(FlatForumTopic.objects.get(id=target.id).reply_count, 3)
+
+    def test_merge_needs_same_post_model(self):
+        flat_topic = self.forum_index.add_child(instance=FlatForumTopic(title="Flat", slug='flat', message="Flat", live=True))
+
+        with self.assertRaises(topics.TopicOperationError):
+            topics.merge_topics(flat_topic, self.forum_topic)
+
+    def test_admin_view(self):
+        self.post_replies(self.forum_topic, "One", "Two")
+        url = '/admin/forums/moderation/topics/%d/' % self.forum_topic.id
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(url, {'action': 'close'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ForumTopic.objects.get(id=self.forum_topic.id).closed)
+
+        response = self.client.post(url, {'action': 'split', 'post_number': 2, 'title': "Split"})
+        new_topic = ForumTopic.objects.get(title="Split")
+        self.assertRedirects(response, '/admin/forums/moderation/topics/%d/' % new_topic.id)
+
+        response = self.client.post(url, {'action': 'move', 'forum': self.other_forum_index.id})
+        self.assertEqual(ForumTopic.objects.get(id=self.forum_topic.id).get_parent().id, self.other_forum_index.id)
+
+    def test_admin_view_needs_publish_permission(self):
+        User.objects.create_user(username='member', password='password')
+        self.client.login(username='member', password='password')
+
+        response = self.client.get('/admin/forums/moderation/topics/%d/' % self.forum_topic.id)
+        self.assertNotEqual(response.status_code, 200)
+
+    def test_userbar_item(self):
+        response = self.client.get('/admin/userbar/%d/' % self.forum_topic.id)
+        self.assertContains(response, '/admin/forums/moderation/topics/%d/' % self.forum_topic.id)
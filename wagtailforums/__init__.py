@@ -1 +1,3 @@
 __version__ = '0.1a3'
+
+default_app_config = 'wagtailforums.apps.WagtailForumsAppConfig'
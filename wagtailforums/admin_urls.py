@@ -0,0 +1,10 @@
+from django.conf.urls import url
+
+from wagtailforums import views
+
+
+urlpatterns = [
+    url(r'^$', views.moderation_index, name='wagtailforums_moderation_index'),
+    url(r'^(\d+)/$', views.moderation_queue, name='wagtailforums_moderation_queue'),
+    url(r'^topics/(\d+)/$', views.topic_actions, name='wagtailforums_topic_actions'),
+]
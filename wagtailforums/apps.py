@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class WagtailForumsAppConfig(AppConfig):
+    name = 'wagtailforums'
+    label = 'wagtailforums'
+    verbose_name = "Wagtail forums"
+
+    def ready(self):
+        from wagtailforums.signal_handlers import register_signal_handlers
+        register_signal_handlers()
+
+        from wagtailforums import templating
+        if templating.get_cache_templates():
+            from wagtailforums.models import get_forum_page_models
+            templating.preload_templates(get_forum_page_models())
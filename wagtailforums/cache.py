@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from wagtailforums import instrumentation
+
+
+def get_cache():
+    return caches[getattr(settings, 'WAGTAILFORUMS_CACHE', 'default')]
+
+
+def get_version_key(path):
+    return 'wagtailforums:version:' + path
+
+
+def new_version():
+    # Versions are seeded from the clock so that, if a version key gets
+    # evicted, the recreated version can't match any entries made before
+    return int(time.time() * 1000000)
+
+
+def get_version(key):
+    cache = get_cache()
+
+    version = cache.get(key)
+    if version is None:
+        instrumentation.incr('cache_misses')
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    else:
+        instrumentation.incr('cache_hits')
+
+    return version
+
+
+def bump_version(key):
+    cache = get_cache()
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), None)
+
+
+def get_page_version(page):
+    return get_version(get_version_key(page.path))
+
+
+def invalidate_page(page):
+    """
+    Bumps the cache version of the page and all of its ancestors so every
+    cached view that could be showing it is ignored from now on.
+
+    Ancestors are found by path so this doesn't need any queries.
+    """
+    for depth in range(1, page.depth + 1):
+        bump_version(get_version_key(page.path[:depth * page.steplen]))
+
+
+def get_view_cache_key(page, view_name, request):
+    url = request.get_host() + request.get_full_path()
+
+    return 'wagtailforums:view:%d:%s:%s:%s' % (
+        page.id,
+        get_page_version(page),
+        view_name,
+        hashlib.md5(url.encode('utf-8')).hexdigest(),
+    )
@@ -0,0 +1,500 @@
+"""
+Streaming import and export of forums as JSON lines.
+
+Each line is one record. Records look like this::
+
+    {"type": "forum", "id": "1", "parent": null, "title": "General"}
+    {"type": "topic", "id": "2", "forum": "1", "title": "Hello", "message": "...", "author": "alice", "posted_at": "2015-01-01T12:00:00Z"}
+    {"type": "reply", "topic": "2", "message": "...", "author": "bob", "posted_at": "2015-01-01T13:00:00Z"}
+
+A ``null`` parent/forum means the forum index that's being imported into.
+Forums must come before the topics in them, and the replies to a topic must
+come straight after it. This lets the importer forget about each topic once
+it's done with it, so memory use doesn't grow with the size of the dump.
+
+The importer doesn't use ``add_child``. It allocates treebeard paths and
+post numbers itself and inserts pages, posts and their initial revisions in
+batches, adding the live posts to the search index as it goes. Replies to
+topics that use flat replies are inserted as plain rows.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from wagtail.wagtailcore.models import Page, PageRevision
+
+from wagtailforums import search
+from wagtailforums.models import AbstractFlatForumReply, AbstractForumIndex, ForumPostCounter, get_last_post_fields
+
+
+class ForumImportError(Exception):
+    pass
+
+
+class ParentState(object):
+    """
+    Keeps track of the paths and post numbers handed out under a parent page
+    """
+    def __init__(self, importer, page, is_new):
+        self.importer = importer
+        self.page = page
+        self.is_new = is_new
+        self.added_children = 0
+
+        # Post numbers of pages created by the import are counted from 1 and
+        # written to a counter once the import is finished with them. Existing
+        # pages reserve blocks of numbers from their counter.
+        self.next_post_number = 1
+        self.last_post_number = float('inf') if is_new else 0
+
+        # Paths are handed out the same way. Existing pages reserve blocks of
+        # steps from their counter, so pages added to them while the import
+        # is running don't take the same paths.
+        self.next_step = 1
+        self.last_step = float('inf') if is_new else 0
+
+    def allocate_path(self):
+        if self.next_step > self.last_step:
+            block_size = self.importer.batch_size
+            self.last_step = ForumPostCounter.objects.reserve_child_steps(self.page, block_size)
+            self.next_step = self.last_step - block_size + 1
+
+        path = Page._get_path(self.page.path, self.page.depth + 1, self.next_step)
+        self.next_step += 1
+        self.added_children += 1
+
+        return path
+
+    def allocate_post_number(self):
+        if self.next_post_number > self.last_post_number:
+            block_size = self.importer.batch_size
+            self.last_post_number = ForumPostCounter.objects.increment(self.page, count=block_size)
+            self.next_post_number = self.last_post_number - block_size + 1
+
+        post_number = self.next_post_number
+        self.next_post_number += 1
+
+        return post_number
+
+
+class ForumImporter(object):
+    def __init__(self, forum_index, batch_size=1000, user_cache_size=10000):
+        self.forum_index = forum_index.specific
+        self.batch_size = batch_size
+        self.user_cache_size = user_cache_size
+        self.db = router.db_for_write(Page)
+
+        self.forums = {None: ParentState(self, self.forum_index, is_new=False)}
+        self.topic_id = None
+        self.topic = None
+        self.topic_state = None
+        self.topic_replies = 0
+        self.topic_last_post = None
+
+        self.pages = []
+        self.flat_replies = []
+        self.parents = [self.forums[None]]
+        self.topic_stats = []
+        self.counters = []
+
+        self.users = {}
+        self.counts = {'forum': 0, 'topic': 0, 'reply': 0}
+
+    def get_user_id(self, username):
+        if not username:
+            return
+
+        if username not in self.users:
+            if len(self.users) >= self.user_cache_size:
+                self.users.clear()
+
+            User = get_user_model()
+            self.users[username] = User.objects.filter(**{User.USERNAME_FIELD: username}).values_list('pk', flat=True).first()
+
+        return self.users[username]
+
+    def parse_datetime(self, record, field):
+        value = record.get(field)
+        if not value:
+            return timezone.now()
+
+        try:
+            value = parse_datetime(value)
+        except (TypeError, ValueError):
+            # Well formatted but out of range, or not a string
+            value = None
+        if value is None:
+            raise ForumImportError("Invalid %s %r in %s" % (field, record.get(field), describe_record(record)))
+
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+
+        return value
+
+    def build_page(self, model, parent_state, record, **kwargs):
+        page = model(
+            title=record.get('title') or '',
+            live=record.get('live', True),
+            **kwargs
+        )
+        page.has_unpublished_changes = not page.live
+        page.path = parent_state.allocate_path()
+        page.depth = parent_state.page.depth + 1
+        page.numchild = 0
+
+        return page
+
+    def build_post(self, model, parent_state, record):
+        posted_at = self.parse_datetime(record, 'posted_at')
+        user_id = self.get_user_id(record.get('author'))
+
+        post = self.build_page(
+            model, parent_state, record,
+            message=record.get('message') or '',
+            post_number=parent_state.allocate_post_number(),
+            owner_id=user_id,
+            posted_at=posted_at,
+            posted_by_id=user_id,
+            edited_at=posted_at,
+            edited_by_id=user_id,
+            latest_revision_created_at=posted_at,
+        )
+        post.stats_counted = post.live
+        post.first_published_at = posted_at if post.live else None
+        post.message_html = post.render_message()
+
+        post.slug = post.get_slug()
+        if not post.title:
+            post.title = str(post.post_number)
+        post.url_path = parent_state.page.url_path + post.slug + '/'
+
+        return post
+
+    def build_flat_reply(self, model, record):
+        posted_at = self.parse_datetime(record, 'posted_at')
+        user_id = self.get_user_id(record.get('author'))
+
+        reply = model(
+            message=record.get('message') or '',
+            post_number=self.topic_state.allocate_post_number(),
+            live=record.get('live', True),
+            owner_id=user_id,
+            posted_at=posted_at,
+            posted_by_id=user_id,
+            edited_at=posted_at,
+            edited_by_id=user_id,
+        )
+        reply.stats_counted = reply.live
+        reply.message_html = reply.render_message()
+
+        # The topic might not have been inserted yet, its id is filled in
+        # when the reply is
+        reply.import_topic = self.topic
+
+        return reply
+
+    def import_forum(self, record):
+        try:
+            parent_state = self.forums[record.get('parent')]
+        except KeyError:
+            raise ForumImportError("Forum %r comes before its parent %r" % (record.get('id'), record.get('parent')))
+
+        forum = self.build_page(type(self.forum_index), parent_state, record)
+        forum.slug = record.get('slug') or slugify(forum.title)
+        forum.url_path = parent_state.page.url_path + forum.slug + '/'
+        self.add_page(forum)
+
+        state = ParentState(self, forum, is_new=True)
+        self.forums[record['id']] = state
+        self.parents.append(state)
+
+    def import_topic(self, record):
+        try:
+            forum_state = self.forums[record.get('forum')]
+        except KeyError:
+            raise ForumImportError("Topic %r comes before its forum %r" % (record.get('id'), record.get('forum')))
+
+        self.finish_topic()
+
+        topic = self.build_post(forum_state.page.get_post_model(), forum_state, record)
+        self.add_page(topic)
+
+        self.topic_id = record['id']
+        self.topic = topic
+        self.topic_state = ParentState(self, topic, is_new=True)
+        self.topic_replies = 0
+        self.topic_last_post = topic if topic.live else None
+        self.parents.append(self.topic_state)
+
+    def import_reply(self, record):
+        if self.topic is None or record.get('topic') != self.topic_id:
+            raise ForumImportError("Replies to topic %r must come straight after it" % record.get('topic'))
+
+        reply_model = self.topic.get_post_model()
+        if issubclass(reply_model, AbstractFlatForumReply):
+            reply = self.build_flat_reply(reply_model, record)
+            self.add_flat_reply(reply)
+        else:
+            reply = self.build_post(reply_model, self.topic_state, record)
+            self.add_page(reply)
+
+        if reply.live:
+            self.topic_replies += 1
+            self.topic_last_post = reply
+
+    def finish_topic(self):
+        if self.topic is None:
+            return
+
+        # Statistics and the post counter need the ids of the pages so are
+        # written after the next insert
+        self.topic_stats.append((self.topic, self.topic_replies, self.topic_last_post))
+        self.counters.append((self.topic, self.topic_state.next_post_number - 1))
+        self.topic = None
+        self.topic_state = None
+
+    def add_page(self, page):
+        self.pages.append(page)
+        self.counts[page_type(page)] += 1
+
+        if len(self.pages) >= self.batch_size:
+            self.flush()
+
+    def add_flat_reply(self, reply):
+        self.flat_replies.append(reply)
+        self.counts['reply'] += 1
+
+        if len(self.flat_replies) >= self.batch_size:
+            self.flush()
+
+    def insert_rows(self, model, objs, fields):
+        connection = connections[self.db]
+        batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+
+        for start in range(0, len(objs), batch_size):
+            model._base_manager._insert(objs[start:start + batch_size], fields=fields, using=self.db)
+
+    @transaction.atomic
+    def flush(self):
+        if self.pages:
+            # Insert the wagtailcore_page rows
+            Page.objects.bulk_create([
+                Page(**dict(
+                    (field.attname, getattr(page, field.attname))
+                    for field in Page._meta.concrete_fields
+                    if not field.primary_key
+                ))
+                for page in self.pages
+            ])
+
+            # Bulk create can't give us the new ids so look them up by path
+            ids = dict(Page.objects.filter(path__in=[page.path for page in self.pages]).values_list('path', 'id'))
+
+            pages_by_model = {}
+            for page in self.pages:
+                page.id = page.page_ptr_id = ids[page.path]
+                pages_by_model.setdefault(type(page), []).append(page)
+
+            # Insert the rows of the specific page models
+            for model, pages in pages_by_model.items():
+                if list(model._meta.get_parent_list()) != [Page]:
+                    raise ForumImportError("%s must inherit directly from Page to be imported" % model.__name__)
+
+                self.insert_rows(model, pages, model._meta.local_concrete_fields)
+
+            posts = [page for page in self.pages if page_type(page) != 'forum']
+
+            # Give each post its initial revision
+            PageRevision.objects.bulk_create([
+                PageRevision(
+                    page_id=page.id,
+                    content_json=page.to_json(),
+                    user_id=page.owner_id,
+                    created_at=page.latest_revision_created_at or timezone.now(),
+                )
+                for page in posts
+            ])
+
+            search.index_posts(posts)
+
+            self.pages = []
+
+        if self.flat_replies:
+            replies_by_model = {}
+            for reply in self.flat_replies:
+                reply.topic_id = reply.import_topic.pk
+                replies_by_model.setdefault(type(reply), []).append(reply)
+
+            for model, replies in replies_by_model.items():
+                model.objects.bulk_create(replies)
+
+            self.flat_replies = []
+
+        for parent_state in self.parents:
+            if parent_state.added_children:
+                Page.objects.filter(path=parent_state.page.path).update(numchild=F('numchild') + parent_state.added_children)
+                parent_state.added_children = 0
+
+        # Forget the topics that are finished with
+        self.parents = list(self.forums.values())
+        if self.topic_state is not None:
+            self.parents.append(self.topic_state)
+
+        for topic, reply_count, last_post in self.topic_stats:
+            type(topic).objects.filter(pk=topic.pk).update(
+                reply_count=reply_count,
+                **get_last_post_fields(last_post)
+            )
+        self.topic_stats = []
+
+        if self.counters:
+            ForumPostCounter.objects.bulk_create([
+                ForumPostCounter(page_id=page.pk, last_post_number=last_post_number)
+                for page, last_post_number in self.counters
+            ])
+            self.counters = []
+
+    def finish(self):
+        self.finish_topic()
+
+        for state in self.forums.values():
+            if state.is_new:
+                self.counters.append((state.page, state.next_post_number - 1))
+            elif state.last_post_number:
+                # Hand back the unused end of the last reserved block, unless
+                # another post has been numbered from the counter since
+                ForumPostCounter.objects.filter(
+                    page_id=state.page.pk,
+                    last_post_number=state.last_post_number,
+                ).update(last_post_number=state.next_post_number - 1)
+
+            if not state.is_new and state.last_step:
+                ForumPostCounter.objects.filter(
+                    page_id=state.page.pk,
+                    last_child_step=state.last_step,
+                ).update(last_child_step=state.next_step - 1)
+
+        self.flush()
+
+        # Recount the forums that were imported into and the new ones. There
+        # are few enough of these to do with a few aggregate queries each.
+        forum_indexes = Page.objects.ancestor_of(self.forum_index, inclusive=True).type(AbstractForumIndex)
+        for forum in forum_indexes:
+            forum.specific.rebuild_stats()
+
+        for state in self.forums.values():
+            if state.is_new:
+                state.page.rebuild_stats()
+
+    def run(self, stream):
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+
+            record = json.loads(line)
+            record_type = record.get('type')
+
+            if record_type == 'forum':
+                self.import_forum(record)
+            elif record_type == 'topic':
+                self.import_topic(record)
+            elif record_type == 'reply':
+                self.import_reply(record)
+            else:
+                raise ForumImportError("Unknown record type %r" % record_type)
+
+        self.finish()
+
+        return self.counts
+
+
+def describe_record(record):
+    if record.get('type') == 'reply':
+        return "reply to topic %r" % record.get('topic')
+
+    return "%s %r" % (record.get('type'), record.get('id'))
+
+
+def page_type(page):
+    if isinstance(page, AbstractForumIndex):
+        return 'forum'
+    elif hasattr(page, 'reply_count'):
+        return 'topic'
+    else:
+        return 'reply'
+
+
+def get_username(user):
+    if user is not None:
+        return user.get_username()
+
+
+def serialize_post(post):
+    return {
+        # Flat replies don't have titles
+        'title': getattr(post, 'title', ''),
+        'message': post.message,
+        'author': get_username(post.owner),
+        'posted_at': post.get_posted_at().isoformat() if post.get_posted_at() else None,
+        'live': post.live,
+    }
+
+
+def export_forum(forum_index, stream):
+    """
+    Writes the forums, topics and replies below the forum index to the
+    stream as JSON lines. Pages are read with iterators, one topic at a time,
+    so this works on forums of any size.
+    """
+    def write(record):
+        stream.write(json.dumps(record) + '\n')
+
+    forum_index = forum_index.specific
+    forums = [forum_index] + [page.specific for page in Page.objects.descendant_of(forum_index).type(AbstractForumIndex)]
+
+    for forum in forums[1:]:
+        write({
+            'type': 'forum',
+            'id': str(forum.id),
+            'parent': str(forum.get_parent().id) if forum.depth > forum_index.depth + 1 else None,
+            'title': forum.title,
+            'slug': forum.slug,
+            'live': forum.live,
+        })
+
+    for forum in forums:
+        topic_model = forum.get_post_model()
+        if not topic_model:
+            continue
+
+        topics = topic_model.objects.child_of(forum).order_by('post_number', 'path').select_related('owner')
+        for topic in topics.iterator():
+            record = serialize_post(topic)
+            record.update({
+                'type': 'topic',
+                'id': str(topic.id),
+                'forum': str(forum.id) if forum is not forum_index else None,
+            })
+            write(record)
+
+            reply_model = topic.get_post_model()
+            if not reply_model:
+                continue
+
+            if issubclass(reply_model, AbstractFlatForumReply):
+                replies = reply_model.objects.filter(topic=topic).order_by('post_number').select_related('owner')
+            else:
+                replies = reply_model.objects.child_of(topic).order_by('post_number', 'path').select_related('owner')
+            for reply in replies.iterator():
+                record = serialize_post(reply)
+                record.update({
+                    'type': 'reply',
+                    'topic': str(topic.id),
+                })
+                write(record)
@@ -0,0 +1,227 @@
+"""
+Records how long each forum view takes, and where the time goes.
+
+Set WAGTAILFORUMS_INSTRUMENTATION_SINK to turn this on. For each request to
+a forum page, the sink is given the name of the view (eg, 'main',
+'new_post'), the page type and these metrics:
+
+``time``
+    Wall time of the view, in seconds
+``queries`` and ``query_time``
+    Number of queries to the default database and the time spent in them.
+    These are counted by wrapping its cursors, Django's query log isn't used.
+``cache_hits`` and ``cache_misses``
+    Lookups of cached views and page versions
+``render_time``
+    Time spent rendering templates
+
+When it's off, the only cost is checking the setting.
+"""
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.template import RequestContext
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('wagtailforums.instrumentation')
+
+
+class Sink(object):
+    def record(self, view_name, page_type, metrics):
+        raise NotImplementedError
+
+
+class LoggingSink(Sink):
+    """
+    Logs a line for each request to the 'wagtailforums.instrumentation' logger
+    """
+    def record(self, view_name, page_type, metrics):
+        logger.info(
+            "%s.%s %s",
+            page_type, view_name,
+            ' '.join('%s=%s' % (name, round(value, 6) if isinstance(value, float) else value) for name, value in sorted(metrics.items())),
+        )
+
+
+class StatsdSink(Sink):
+    """
+    Sends metrics as StatsD packets over UDP to WAGTAILFORUMS_STATSD_HOST and
+    WAGTAILFORUMS_STATSD_PORT. Times are sent as timers in milliseconds and
+    counts as counters.
+    """
+    def __init__(self):
+        self.address = (
+            getattr(settings, 'WAGTAILFORUMS_STATSD_HOST', 'localhost'),
+            getattr(settings, 'WAGTAILFORUMS_STATSD_PORT', 8125),
+        )
+        self.prefix = getattr(settings, 'WAGTAILFORUMS_STATSD_PREFIX', 'wagtailforums')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, name, value):
+        if name.endswith('time'):
+            return '%s:%.3f|ms' % (name, value * 1000)
+        else:
+            return '%s:%d|c' % (name, value)
+
+    def record(self, view_name, page_type, metrics):
+        prefix = '%s.%s.%s.' % (self.prefix, page_type, view_name)
+        packet = '\n'.join(prefix + self.format(name, value) for name, value in sorted(metrics.items()))
+
+        try:
+            self.socket.sendto(packet.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics are best effort
+            pass
+
+
+class MemorySink(Sink):
+    """
+    Keeps records in ``MemorySink.records``. For tests.
+    """
+    records = []
+
+    def record(self, view_name, page_type, metrics):
+        self.records.append((view_name, page_type, metrics))
+
+
+_sinks = {}
+
+
+def get_sink():
+    path = getattr(settings, 'WAGTAILFORUMS_INSTRUMENTATION_SINK', None)
+    if path is None:
+        return
+
+    if path not in _sinks:
+        _sinks[path] = import_string(path)()
+
+    return _sinks[path]
+
+
+_local = threading.local()
+
+
+def get_current_metrics():
+    return getattr(_local, 'metrics', None)
+
+
+def incr(name, value=1):
+    """
+    Adds to a metric of the view that's being measured, if there is one
+    """
+    metrics = getattr(_local, 'metrics', None)
+
+    if metrics is not None:
+        metrics[name] = metrics.get(name, 0) + value
+
+
+class QueryCountingCursor(object):
+    """
+    Wraps a database cursor to add the queries it runs, and the time spent
+    in them, to the metrics of the view that's being measured. Unlike
+    Django's debug cursor, this doesn't keep the SQL of each query.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            incr('queries')
+            incr('query_time', time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            incr('queries')
+            incr('query_time', time.time() - start)
+
+
+@contextmanager
+def count_queries():
+    """
+    Wraps the cursors that the default connection hands out inside the
+    block with QueryCountingCursor
+    """
+    make_cursor = connection.cursor
+    connection.cursor = lambda: QueryCountingCursor(make_cursor())
+
+    try:
+        yield
+    finally:
+        del connection.cursor
+
+
+@contextmanager
+def measure(view_name, page_type):
+    sink = get_sink()
+
+    # Don't measure when off, or when this is inside another measured view
+    if sink is None or get_current_metrics() is not None:
+        yield
+        return
+
+    metrics = _local.metrics = {
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'queries': 0,
+        'query_time': 0.0,
+        'render_time': 0.0,
+    }
+    start = time.time()
+
+    try:
+        with count_queries():
+            yield
+    finally:
+        metrics['time'] = time.time() - start
+        _local.metrics = None
+
+        sink.record(view_name, page_type, metrics)
+
+
+def render_template(request, template, context):
+    # Templates can be passed already loaded, see wagtailforums.templating
+    if hasattr(template, 'render'):
+        return HttpResponse(template.render(RequestContext(request, context)))
+
+    return render(request, template, context)
+
+
+def measured_render(request, template, context):
+    """
+    Like django.shortcuts.render, but counts the time spent in the template.
+    ``template`` can be a name, a list of names or a loaded template.
+    """
+    if get_current_metrics() is None:
+        return render_template(request, template, context)
+
+    start = time.time()
+    response = render_template(request, template, context)
+    incr('render_time', time.time() - start)
+
+    return response
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wagtailforums.models import AbstractFlatForumReply, ForumPostCounter, get_forum_page_models
+
+
+class Command(BaseCommand):
+    help = "Numbers posts that don't have a post number and creates or fast-forwards the post number counter of every forum page"
+
+    def handle(self, *args, **options):
+        for model in get_forum_page_models():
+            if not model.get_post_model():
+                continue
+
+            for page in model.objects.all().iterator():
+                self.number_posts(page)
+                max_post_number = page.get_max_post_number()
+
+                with transaction.atomic():
+                    counter, created = ForumPostCounter.objects.select_for_update().get_or_create(
+                        page_id=page.id,
+                        defaults={'last_post_number': max_post_number},
+                    )
+
+                    if counter.last_post_number < max_post_number:
+                        counter.last_post_number = max_post_number
+                        counter.save(update_fields=['last_post_number'])
+
+            self.stdout.write("Backfilled post counters for %s" % model._meta.verbose_name_plural)
+
+    def number_posts(self, page):
+        """
+        Numbers the posts on the page that were saved without a post number
+        (such as those created in the Wagtail admin before save_revision
+        numbered them), after the numbered ones and in the order they were
+        made
+        """
+        post_model = page.get_post_model()
+        if issubclass(post_model, AbstractFlatForumReply):
+            # These always have one
+            return
+
+        unnumbered = list(page.get_child_posts().filter(post_number__isnull=True).order_by('path').values_list('pk', flat=True))
+        if not unnumbered:
+            return
+
+        last_post_number = page.get_max_post_number()
+
+        with transaction.atomic():
+            for post_number, pk in enumerate(unnumbered, last_post_number + 1):
+                post_model.objects.filter(pk=pk, post_number__isnull=True).update(post_number=post_number)
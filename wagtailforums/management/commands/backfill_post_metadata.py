@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from wagtail.wagtailcore.models import PageRevision
+
+from wagtailforums.models import AbstractForumPost, get_forum_page_models
+
+
+class Command(BaseCommand):
+    help = "Fills in posted_at, posted_by, edited_at and edited_by on posts that were created before they were stored"
+
+    batch_size = 500
+
+    def handle(self, *args, **options):
+        for model in get_forum_page_models(AbstractForumPost):
+            post_ids = list(model.objects.filter(posted_at__isnull=True).values_list('id', flat=True))
+
+            for start in range(0, len(post_ids), self.batch_size):
+                self.backfill(model, post_ids[start:start + self.batch_size])
+
+            self.stdout.write("Backfilled %d %s" % (len(post_ids), model._meta.verbose_name_plural))
+
+    def backfill(self, model, post_ids):
+        earliest = {}
+        latest = {}
+
+        revisions = PageRevision.objects.filter(page_id__in=post_ids).order_by('created_at', 'id')
+        for page_id, created_at, user_id in revisions.values_list('page_id', 'created_at', 'user_id').iterator():
+            earliest.setdefault(page_id, (created_at, user_id))
+            latest[page_id] = (created_at, user_id)
+
+        for page_id, (posted_at, posted_by_id) in earliest.items():
+            edited_at, edited_by_id = latest[page_id]
+
+            model.objects.filter(pk=page_id).update(
+                posted_at=posted_at,
+                posted_by_id=posted_by_id,
+                edited_at=edited_at,
+                edited_by_id=edited_by_id,
+            )
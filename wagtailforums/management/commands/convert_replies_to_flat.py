@@ -0,0 +1,111 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from wagtail.wagtailcore.models import Page, PageRevision
+from wagtail.wagtailcore.utils import resolve_model_string
+
+from wagtailforums.models import AbstractFlatForumReply, AbstractForumIndex, AbstractForumReply, ForumSearchDocument, get_post_time
+
+
+class Command(BaseCommand):
+    args = '<reply_model> <flat_reply_model>'
+    help = "Moves the replies of one page-based reply model into a flat reply model, keeping their post numbers"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help="Number of replies to convert at a time"),
+        make_option('--drop-from-search', action='store_true', dest='drop_from_search', default=False,
+            help="Convert replies that are in the search index. Flat replies aren't indexed, so they can't be found by searches any more."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: convert_replies_to_flat %s" % self.args)
+
+        try:
+            source_model = resolve_model_string(args[0])
+            target_model = resolve_model_string(args[1])
+        except (ValueError, LookupError) as e:
+            raise CommandError(str(e))
+
+        if not issubclass(source_model, AbstractForumReply):
+            raise CommandError("%s is not a page-based reply model" % args[0])
+        if not issubclass(target_model, AbstractFlatForumReply):
+            raise CommandError("%s is not a flat reply model" % args[1])
+        if source_model.objects.filter(post_number__isnull=True).exists():
+            raise CommandError("Some replies don't have post numbers, run backfill_post_metadata and backfill_post_counters first")
+
+        # Deleting the reply pages takes them out of the search index, and flat
+        # replies aren't indexed
+        if not options['drop_from_search'] and ForumSearchDocument.objects.filter(page_id__in=source_model.objects.values('pk')).exists():
+            raise CommandError("Flat replies aren't in the search index, so converted replies won't be found by searches. Pass --drop-from-search to convert them anyway.")
+
+        topic_ids = set()
+        count = 0
+        while True:
+            with transaction.atomic():
+                replies = list(
+                    source_model.objects.order_by('pk').select_related('posted_by', 'edited_by')
+                    .prefetch_related('revisions__user')[:options['batch_size']]
+                )
+                if not replies:
+                    break
+
+                topic_ids.update(self.convert(replies, target_model))
+                count += len(replies)
+
+        # Topics and forums that were showing a converted reply as their
+        # latest post have lost it
+        with transaction.atomic():
+            forum_paths = set()
+            for topic in Page.objects.filter(id__in=topic_ids):
+                topic = topic.specific
+                topic.rebuild_stats()
+                forum_paths.update(topic.path[:i] for i in range(topic.steplen, len(topic.path), topic.steplen))
+
+            for forum in Page.objects.filter(path__in=forum_paths).type(AbstractForumIndex):
+                forum.specific.rebuild_stats()
+
+        self.stdout.write("Converted %d replies" % count)
+
+    def convert(self, replies, target_model):
+        topic_ids = dict(
+            Page.objects.filter(path__in=set(reply.path[:-reply.steplen] for reply in replies)).values_list('path', 'id')
+        )
+
+        # Replies waiting for moderation stay in the queue
+        pending_ids = set(
+            PageRevision.objects.filter(page_id__in=[reply.id for reply in replies], submitted_for_moderation=True)
+            .values_list('page_id', flat=True)
+        )
+
+        flat_replies = []
+        for reply in replies:
+            posted_at = get_post_time(reply)
+
+            flat_replies.append(target_model(
+                topic_id=topic_ids[reply.path[:-reply.steplen]],
+                post_number=reply.post_number,
+                message=reply.message,
+                message_html=reply.message_html,
+                live=reply.live,
+                submitted_for_moderation=not reply.live and reply.id in pending_ids,
+                stats_counted=reply.live,
+                owner_id=reply.owner_id,
+                posted_at=posted_at,
+                posted_by=reply.get_posted_by(),
+                edited_at=reply.get_edited_at() or posted_at,
+                edited_by=reply.get_edited_by(),
+            ))
+
+        target_model.objects.bulk_create(flat_replies)
+
+        # The counts don't change, stop the deletes from taking the replies
+        # off them one at a time
+        reply_ids = [reply.id for reply in replies]
+        type(replies[0]).objects.filter(id__in=reply_ids).update(stats_counted=False)
+        Page.objects.filter(id__in=reply_ids).delete()
+
+        return set(topic_ids.values())
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums.models import AbstractForumIndex
+
+
+class Command(BaseCommand):
+    args = '<forum_index_id> [<file>]'
+    help = "Exports the forums, topics and replies in a forum index as JSON lines"
+
+    def handle(self, *args, **options):
+        if len(args) not in (1, 2):
+            raise CommandError("Usage: export_forum %s" % self.args)
+
+        try:
+            forum_index = Page.objects.get(id=args[0]).specific
+        except Page.DoesNotExist:
+            raise CommandError("Page %s does not exist" % args[0])
+
+        if not isinstance(forum_index, AbstractForumIndex):
+            raise CommandError("Page %s is not a forum index" % args[0])
+
+        if len(args) == 2 and args[1] != '-':
+            with open(args[1], 'w') as f:
+                forum_index.export_posts(f)
+        else:
+            forum_index.export_posts(self.stdout)
@@ -0,0 +1,38 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums.models import AbstractForumIndex
+
+
+class Command(BaseCommand):
+    args = '<forum_index_id> <file>'
+    help = "Imports forums, topics and replies from a JSON lines file into a forum index"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help="Number of pages to insert at a time"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: import_forum %s" % self.args)
+
+        try:
+            forum_index = Page.objects.get(id=args[0]).specific
+        except Page.DoesNotExist:
+            raise CommandError("Page %s does not exist" % args[0])
+
+        if not isinstance(forum_index, AbstractForumIndex):
+            raise CommandError("Page %s is not a forum index" % args[0])
+
+        if args[1] == '-':
+            counts = forum_index.import_posts(sys.stdin, batch_size=options['batch_size'])
+        else:
+            with open(args[1]) as f:
+                counts = forum_index.import_posts(f, batch_size=options['batch_size'])
+
+        self.stdout.write("Imported %(forum)d forums, %(topic)d topics and %(reply)d replies" % counts)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from wagtailforums.models import AbstractForumPost, ForumSearchDocument, ForumSearchPosting, get_forum_page_models
+from wagtailforums.search import index_posts
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the forum search index from the live posts"
+
+    batch_size = 500
+
+    def handle(self, *args, **options):
+        # Postings can be deleted without loading them first
+        ForumSearchPosting.objects.all().delete()
+        ForumSearchDocument.objects.all().delete()
+
+        for model in get_forum_page_models(AbstractForumPost):
+            count = 0
+            batch = []
+
+            for post in model.objects.live().iterator():
+                batch.append(post)
+
+                if len(batch) >= self.batch_size:
+                    index_posts(batch)
+                    count += len(batch)
+                    batch = []
+
+            index_posts(batch)
+            count += len(batch)
+
+            self.stdout.write("Indexed %d %s" % (count, model._meta.verbose_name_plural))
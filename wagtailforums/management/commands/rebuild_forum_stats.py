@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wagtailforums.models import AbstractForumPost, AbstractForumTopic, AbstractForumIndex, get_flat_reply_models, get_forum_page_models
+
+
+class Command(BaseCommand):
+    help = "Recalculates the reply/topic counts and latest post of every forum topic and index"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Posts are counted while they are live
+            for model in get_forum_page_models(AbstractForumPost) + get_flat_reply_models():
+                model.objects.filter(live=True).update(stats_counted=True)
+                model.objects.filter(live=False).update(stats_counted=False)
+
+            for model in get_forum_page_models(AbstractForumTopic) + get_forum_page_models(AbstractForumIndex):
+                for page in model.objects.all().iterator():
+                    page.rebuild_stats()
+
+                self.stdout.write("Rebuilt stats for %s" % model._meta.verbose_name_plural)
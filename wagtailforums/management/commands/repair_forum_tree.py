@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums.models import AbstractForumIndex
+
+
+class Command(BaseCommand):
+    args = '[<page_id> ...]'
+    help = "Corrects numchild and url_path of the pages in forums, which can fall behind on pages with batch_tree_writes"
+
+    def handle(self, *args, **options):
+        if args:
+            roots = list(Page.objects.filter(id__in=args))
+        else:
+            # The forum indexes that aren't inside another one
+            roots = []
+            for page in Page.objects.type(AbstractForumIndex).order_by('path'):
+                if not roots or not page.path.startswith(roots[-1].path):
+                    roots.append(page)
+
+        for root in roots:
+            numchild_fixes, url_path_fixes = self.repair(root)
+            self.stdout.write("%s: fixed numchild of %d pages and url_path of %d pages" % (root.title, numchild_fixes, url_path_fixes))
+
+    def repair(self, root):
+        """
+        Walks the pages below ``root`` in path order, one query for all of
+        them, keeping only the current page's ancestors in memory
+        """
+        numchild_fixes = {}
+        url_path_fixes = {}
+
+        def finish(entry):
+            path, url_path, numchild, counted = entry
+            if numchild != counted:
+                numchild_fixes[path] = counted
+
+        stack = []
+        pages = Page.objects.filter(path__startswith=root.path).order_by('path').values_list('path', 'numchild', 'slug', 'url_path')
+        for path, numchild, slug, url_path in pages.iterator():
+            while stack and not path.startswith(stack[-1][0]):
+                finish(stack.pop())
+
+            if stack:
+                parent = stack[-1]
+                parent[3] += 1
+
+                expected_url_path = parent[1] + slug + '/'
+                if url_path != expected_url_path:
+                    url_path_fixes[path] = url_path = expected_url_path
+
+            stack.append([path, url_path, numchild, 0])
+
+        while stack:
+            finish(stack.pop())
+
+        for path, numchild in numchild_fixes.items():
+            Page.objects.filter(path=path).update(numchild=numchild)
+
+        for path, url_path in url_path_fixes.items():
+            Page.objects.filter(path=path).update(url_path=url_path)
+
+        return len(numchild_fixes), len(url_path_fixes)
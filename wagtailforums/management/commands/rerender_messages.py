@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from wagtailforums.models import AbstractForumPost, get_flat_reply_models, get_forum_page_models
+
+
+class Command(BaseCommand):
+    help = "Regenerates the stored HTML of every forum post. Run this after changing the message renderer"
+
+    def handle(self, *args, **options):
+        for model in get_forum_page_models(AbstractForumPost) + get_flat_reply_models():
+            count = 0
+
+            for post in model.objects.only('id', 'message', 'message_html').iterator():
+                message_html = post.render_message()
+
+                if message_html != post.message_html:
+                    model.objects.filter(pk=post.pk).update(message_html=message_html)
+                    count += 1
+
+            self.stdout.write("Rerendered %d %s" % (count, model._meta.verbose_name_plural))
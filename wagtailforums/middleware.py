@@ -0,0 +1,22 @@
+from wagtailforums import tasks
+
+
+class TaskMiddleware(object):
+    """
+    Holds forum tasks deferred inside the view's transaction (with
+    ATOMIC_REQUESTS) until it has committed, and drops them if it rolls back.
+
+    Put this at the end of MIDDLEWARE_CLASSES so its process_exception is
+    called before any other middleware handles the exception.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # This runs before the view's transaction is opened
+        tasks.start_request()
+
+    def process_exception(self, request, exception):
+        # The view's transaction has been rolled back
+        tasks.finish_request(committed=False)
+
+    def process_response(self, request, response):
+        tasks.finish_request(committed=True)
+        return response
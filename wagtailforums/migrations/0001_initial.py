@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0002_initial_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForumPostCounter',
+            fields=[
+                ('page', models.OneToOneField(related_name='+', primary_key=True, serialize=False, to='wagtailcore.Page')),
+                ('last_post_number', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wagtailcore', '0002_initial_data'),
+        ('wagtailforums', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForumSearchDocument',
+            fields=[
+                ('page', models.OneToOneField(related_name='+', primary_key=True, serialize=False, to='wagtailcore.Page')),
+                ('path', models.CharField(max_length=255, db_index=True)),
+                ('posted_at', models.DateTimeField(db_index=True)),
+                ('length', models.PositiveIntegerField(default=0)),
+                ('author', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, null=True)),
+                ('forum', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to='wagtailcore.Page', null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ForumSearchPosting',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField()),
+                ('document', models.ForeignKey(related_name='postings', to='wagtailforums.ForumSearchDocument')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='forumsearchposting',
+            index_together=set([('term', 'document')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wagtailcore', '0002_initial_data'),
+        ('wagtailforums', '0002_forum_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForumReadMarker',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('post_number', models.PositiveIntegerField(null=True)),
+                ('read_until', models.DateTimeField()),
+                ('page', models.ForeignKey(related_name='+', to='wagtailcore.Page')),
+                ('user', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='forumreadmarker',
+            unique_together=set([('user', 'page')]),
+        ),
+    ]
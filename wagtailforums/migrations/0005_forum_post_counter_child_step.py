@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailforums', '0004_forum_subscriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumpostcounter',
+            name='last_child_step',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+    ]
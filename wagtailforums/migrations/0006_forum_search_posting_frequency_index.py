@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailforums', '0005_forum_post_counter_child_step'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='forumsearchposting',
+            index_together=set([('term', 'document'), ('term', 'frequency', 'document')]),
+        ),
+    ]
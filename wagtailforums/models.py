@@ -1,23 +1,189 @@
-import os
+import datetime
 
-from django.db import models
-from django.shortcuts import render, redirect
+from django.apps import apps
+from django.db import models, transaction, IntegrityError
+from django.shortcuts import redirect
 from django.conf import settings
 from django.conf.urls import url
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import InvalidPage
+from django.http import Http404
 from django.utils.text import slugify
+from django.utils.safestring import mark_safe
+from django.utils import dateparse, timezone
 from django import forms
 
-from wagtail.wagtailcore.models import Page
+from wagtail.wagtailcore.models import Page, PAGE_MODEL_CLASSES
 from wagtail.wagtailcore.utils import resolve_model_string
-from wagtail.wagtailadmin.edit_handlers import FieldPanel
+from wagtail.wagtailadmin.edit_handlers import FieldPanel, MultiFieldPanel
 from wagtail.contrib.wagtailroutablepage.models import RoutablePageMixin, route
 
+from wagtailforums import cache, instrumentation, pageurls, tasks, templating
+from wagtailforums.signals import post_created, post_edited
+from wagtailforums.pagination import PostPage
+from wagtailforums.permissions import get_permission_cache, annotate_permissions
+from wagtailforums.renderers import get_message_renderer
+
+
+class ForumPostCounterManager(models.Manager):
+    def increment(self, page, count=1):
+        """
+        Reserves the next ``count`` post numbers under ``page`` and returns the
+        last one.
+
+        The counter row is updated with an ``F()`` expression so it stays
+        locked until the surrounding transaction commits. Concurrent posters
+        queue on that single row instead of racing on ``Max('post_number')``.
+        """
+        with transaction.atomic():
+            updated = self.filter(page_id=page.id).update(last_post_number=models.F('last_post_number') + count)
+
+            if not updated:
+                # No counter yet, seed it from the posts that already exist
+                try:
+                    with transaction.atomic():
+                        self.create(page_id=page.id, last_post_number=page.get_max_post_number() + count)
+                except IntegrityError:
+                    # Somebody else created it first
+                    self.filter(page_id=page.id).update(last_post_number=models.F('last_post_number') + count)
+
+            return self.select_for_update().filter(page_id=page.id).values_list('last_post_number', flat=True).get()
+
+    def reserve_child_steps(self, page, count):
+        """
+        Reserves the next ``count`` treebeard steps for children of ``page``
+        and returns the last one.
+
+        Reservations start after the page's last child, so steps taken by
+        pages added with ``add_child`` are skipped over.
+        """
+        last_child_path = (
+            Page.objects.filter(path__startswith=page.path, depth=page.depth + 1)
+            .order_by('-path').values_list('path', flat=True).first()
+        )
+        last_child_step = Page._str2int(last_child_path[-Page.steplen:]) if last_child_path else 0
+
+        with transaction.atomic():
+            # Makes sure the counter exists and locks it
+            self.increment(page, count=0)
+
+            last_step = max(self.filter(page_id=page.id).values_list('last_child_step', flat=True).get(), last_child_step) + count
+            self.filter(page_id=page.id).update(last_child_step=last_step)
+
+            return last_step
+
+
+class ForumPostCounter(models.Model):
+    page = models.OneToOneField('wagtailcore.Page', primary_key=True, related_name='+')
+    last_post_number = models.PositiveIntegerField(default=0)
+    last_child_step = models.PositiveIntegerField(default=0)
+
+    objects = ForumPostCounterManager()
+
+
+class ForumSearchDocument(models.Model):
+    """
+    A post in the forum search index. The fields that searches can be
+    filtered on are copied here so they don't need a join on the page tables.
+    """
+    page = models.OneToOneField('wagtailcore.Page', primary_key=True, related_name='+')
+    path = models.CharField(max_length=255, db_index=True)
+    forum = models.ForeignKey('wagtailcore.Page', null=True, on_delete=models.SET_NULL, related_name='+')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='+')
+    posted_at = models.DateTimeField(db_index=True)
+    length = models.PositiveIntegerField(default=0)
+
+
+class ForumSearchPosting(models.Model):
+    """
+    The number of times a term appears in a document
+    """
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(ForumSearchDocument, related_name='postings')
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [
+            ('term', 'document'),
+            # Searches read each term's postings, most frequent first
+            ('term', 'frequency', 'document'),
+        ]
+
+
+class ForumReadMarker(models.Model):
+    """
+    Records how far a user has read.
+
+    On a topic, the user has read up to ``post_number`` and every post made
+    up to ``read_until``. On a forum (where ``post_number`` is null) it's a
+    watermark: everything below the forum made up to ``read_until`` has been
+    read, so "mark all read" doesn't need a row for each topic.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    page = models.ForeignKey('wagtailcore.Page', related_name='+')
+    post_number = models.PositiveIntegerField(null=True)
+    read_until = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'page')
+
+
+class ForumSubscription(models.Model):
+    """
+    A user who is notified of new posts in a topic or forum
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    page = models.ForeignKey('wagtailcore.Page', related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_notified_at = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = ('user', 'page')
+
 
 class ForumPageMixin(RoutablePageMixin):
 
     post_model = None
+    posts_per_page = 20
+
+    # Set this to list the newest posts first
+    reverse_post_order = False
+
+    # Related objects to fetch along with the posts in a listing
+    post_select_related = ('owner', 'posted_by', 'edited_by')
+    post_prefetch_related = ()
+
+    # Names of the views (eg, 'main', 'search') whose responses are cached for
+    # anonymous users. Cached responses are invalidated whenever this page or
+    # one of its descendants is saved or deleted.
+    cache_views = ()
+    cache_timeout = 300
+
+    # Fields that are maintained with queryset updates (eg, statistics).
+    # Saving the whole page (which happens when a revision is published) must
+    # not write back the stale copies of these that are held in the revision.
+    denormalized_fields = ()
+
+    # Whether users can subscribe to notifications of new posts on this page
+    subscribable = False
+
+    # Set this to send posts by users that can't publish here to the
+    # moderation queue (see wagtailforums.moderation) rather than publishing
+    # them straight away
+    moderate_posts = False
+
+    # Set this to False to leave post_form out of the main view for users
+    # that can't post
+    build_post_form_for_readers = True
+
+    # Set this to add new posts without treebeard's add_child, for pages that
+    # get many posts at once. Paths are handed out from blocks of this many
+    # that each process reserves, and numchild is updated after the post has
+    # been committed. See wagtailforums.treewrites.
+    batch_tree_writes = False
+    child_path_block_size = 50
 
     @classmethod
     def get_post_model(cls):
@@ -26,9 +192,25 @@ class ForumPageMixin(RoutablePageMixin):
 
         return resolve_model_string(cls.post_model)
 
+    @property
+    def url(self):
+        return pageurls.get_page_url(self)
+
+    @classmethod
+    def get_subpage_suffix(cls, name, **kwargs):
+        """
+        Returns the URL of a route relative to the page, like reverse_subpage
+        but only reversing the route once
+        """
+        return pageurls.get_subpage_suffix(cls, name, kwargs)
+
     @property
     def new_post_url(self):
-        return self.url + self.reverse_subpage('new_post')
+        return self.url + self.get_subpage_suffix('new_post')
+
+    def permissions_for_user(self, user):
+        # All forum permission checks for a user share one set of group permissions
+        return get_permission_cache(user).for_page(self)
 
     def user_can_create_post(self, user):
         # If theres no post model, no posts can be created
@@ -54,70 +236,416 @@ class ForumPageMixin(RoutablePageMixin):
         if self.permissions_for_user(user).can_publish_subpage():
             return True
 
-        return True
+        return not self.moderate_posts
 
-    def get_next_post_number(self):
-        children = self.get_post_model().objects.child_of(self)
+    def get_child_posts(self):
+        """
+        Returns every post on this page, live or not
+        """
+        post_model = self.get_post_model()
+        if not post_model:
+            return Page.objects.none()
+
+        if issubclass(post_model, AbstractFlatForumReply):
+            return post_model.objects.filter(topic=self)
+
+        return post_model.objects.child_of(self)
+
+    def get_posts(self):
+        return self.get_child_posts().filter(live=True)
+
+    def get_posts_queryset(self, request):
+        """
+        Returns the posts to list on this page, with everything that the
+        listing template needs fetched up front
+        """
+        return self.get_posts().select_related(*self.post_select_related).prefetch_related(*self.post_prefetch_related)
+
+    def get_last_post_number(self):
+        return self.get_posts().order_by('-post_number').values_list('post_number', flat=True).first() or 0
+
+    def get_num_pages(self, last_post_number):
+        return max(last_post_number - 1, 0) // self.posts_per_page + 1
+
+    def get_post_page_number(self, post_number, last_post_number=None):
+        # Pages cover fixed ranges of post numbers so a post always stays on
+        # the same page (apart from the reversed order, which shifts as new
+        # posts are added)
+        if self.reverse_post_order:
+            if last_post_number is None:
+                last_post_number = self.get_last_post_number()
+
+            return max(last_post_number - post_number, 0) // self.posts_per_page + 1
+        else:
+            return max(post_number - 1, 0) // self.posts_per_page + 1
+
+    def get_page_url(self, page_number):
+        if page_number == 1:
+            return self.url
 
-        return (children.aggregate(models.Max('post_number'))['post_number__max'] or 0) + 1
+        return self.url + self.get_subpage_suffix('page', page_number=page_number)
+
+    def get_post_permalink(self, post_number):
+        return self.url + self.get_subpage_suffix('post', post_number=post_number)
+
+    def paginate_posts(self, request, page_number=1, after=None):
+        """
+        Returns a PostPage of posts. Either by page number or, if ``after`` is
+        set, the page of posts that follow the post with that post number.
+        """
+        posts = self.get_posts_queryset(request)
+        last_post_number = self.get_last_post_number()
+        num_pages = self.get_num_pages(last_post_number)
+
+        if after is not None:
+            if self.reverse_post_order:
+                posts = posts.filter(post_number__lt=after).order_by('-post_number')
+            else:
+                posts = posts.filter(post_number__gt=after).order_by('post_number')
+
+            posts = list(posts[:self.posts_per_page])
+
+            if posts:
+                page_number = self.get_post_page_number(posts[0].post_number, last_post_number)
+            else:
+                page_number = num_pages
+        else:
+            if page_number < 1 or page_number > num_pages:
+                raise Http404
+
+            if self.reverse_post_order:
+                highest = last_post_number - (page_number - 1) * self.posts_per_page
+                posts = posts.filter(post_number__gt=highest - self.posts_per_page, post_number__lte=highest).order_by('-post_number')
+            else:
+                lowest = (page_number - 1) * self.posts_per_page
+                posts = posts.filter(post_number__gt=lowest, post_number__lte=lowest + self.posts_per_page).order_by('post_number')
+
+        return PostPage(self, posts, page_number, num_pages)
+
+    def get_max_post_number(self):
+        return self.get_child_posts().aggregate(models.Max('post_number'))['post_number__max'] or 0
+
+    def get_next_post_number(self):
+        return ForumPostCounter.objects.increment(self)
 
     def get_create_post_redirect_url(self, post):
         return post.url
 
+    @classmethod
+    def get_view_template_names(cls):
+        # Worked out once for each page type, not shared with subclasses
+        if '_view_template_names' not in cls.__dict__:
+            cls._view_template_names = templating.build_template_names(cls)
+
+        return cls._view_template_names
+
+    def get_view_template(self, view_name):
+        return templating.get_template(self.get_view_template_names()[view_name])
+
+    def check_rate_limit(self, request, action):
+        """
+        Counts a post or edit (``action``) here against the post limits of the
+        forum. Returns the number of seconds the user has to wait if it's
+        over one, or 0. Users that can publish here aren't limited.
+        """
+        if self.permissions_for_user(request.user).can_publish():
+            return 0
+
+        from wagtailforums import ratelimit
+        return ratelimit.check(self, request, action)
+
+    def rate_limited_response(self, request, retry_after):
+        context = self.get_context(request)
+        context['retry_after'] = retry_after
+
+        response = instrumentation.measured_render(request, self.get_view_template('rate_limited'), context)
+        response.status_code = 429
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def get_view_cache_key(self, request, view_name):
+        if view_name not in self.cache_views:
+            return
+
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated():
+            return
+
+        return cache.get_view_cache_key(self, view_name, request)
+
+    def serve(self, request, view=None, args=None, kwargs=None):
+        # Called without a view (eg, by code written for a plain Page), serve
+        # the main view like the page's URL would
+        if view is None:
+            view, args, kwargs = self.resolve_subpage('/')
+        args = args or ()
+        kwargs = kwargs or {}
+
+        view_name = getattr(view, '__name__', type(view).__name__)
+        if view_name.endswith('_view'):
+            view_name = view_name[:-5]
+
+        with instrumentation.measure(view_name, self._meta.model_name), pageurls.request_scope():
+            cache_key = self.get_view_cache_key(request, view_name)
+            if cache_key:
+                response = cache.get_cache().get(cache_key)
+
+                if response is not None:
+                    instrumentation.incr('cache_hits')
+                    return response
+
+                instrumentation.incr('cache_misses')
+
+            response = super(ForumPageMixin, self).serve(request, view, args, kwargs)
+
+            # Responses with a CSRF token in them are specific to one visitor
+            if cache_key and response.status_code == 200 and not request.META.get('CSRF_COOKIE_USED'):
+                cache.get_cache().set(cache_key, response, self.cache_timeout)
+
+            return response
+
+    def save(self, *args, **kwargs):
+        if self.pk and self.denormalized_fields and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+
+        return super(ForumPageMixin, self).save(*args, **kwargs)
+
     @route(r'^new_post/$', name='new_post')
     def new_post_view(self, request):
         if not self.user_can_create_post(request.user):
             raise PermissionDenied
 
+        # Before the form is built, so rejecting floods is cheap
+        if request.method == 'POST':
+            retry_after = self.check_rate_limit(request, 'post')
+            if retry_after:
+                return self.rate_limited_response(request, retry_after)
+
         form = self.get_post_model().get_form_class()(request.POST or None, request.FILES or None)
 
         if form.is_valid():
             publishing = self.user_can_publish_post(request.user)
-
             page = form.save(commit=False)
-            page.owner  = request.user
-            page.post_number = self.get_next_post_number()
-            page.slug = page.get_slug()
-            if not page.title:
-                page.title = str(page.post_number)
-            page.live = False
-            page.has_unpublished_changes = True
-
-            self.add_child(instance=page)
-            revision = page.save_revision(user=request.user, submitted_for_moderation=not publishing)
 
-            if publishing:
-                revision.publish()
+            # The post number (and, with batch_tree_writes, the path) are
+            # reserved in short transactions of their own, so concurrent posts
+            # don't hold the counter row while they're saved. A post that
+            # then fails leaves a gap in the numbers.
+            page.post_number = self.get_next_post_number()
+            if self.batch_tree_writes and not isinstance(page, AbstractFlatForumReply):
+                from wagtailforums import treewrites
+                treewrites.reserve_path(self, page)
+
+            with tasks.post_commit():
+                if isinstance(page, AbstractFlatForumReply):
+                    page.save_new(self, request.user, publishing)
+                    revision = None
+                else:
+                    page.owner  = request.user
+                    page.slug = page.get_slug()
+                    if not page.title:
+                        page.title = str(page.post_number)
+                    page.live = False
+                    page.has_unpublished_changes = True
+                    page.update_message_html()
+
+                    if self.batch_tree_writes:
+                        from wagtailforums import treewrites
+                        treewrites.add_child(self, page)
+                    else:
+                        self.add_child(instance=page)
+
+                    revision = page.save_revision(user=request.user, submitted_for_moderation=not publishing)
+
+                    if publishing:
+                        revision.publish()
+
+                tasks.defer(post_created.send, sender=type(page), instance=page, revision=revision, published=publishing)
 
             return redirect(self.get_create_post_redirect_url(page))
         else:
             context = self.get_context(request)
             context['post_form'] = form
             context['user_can_publish_post'] = self.user_can_publish_post(request.user)
-            return render(request, get_template_name(self.template, 'new_post'), context)
+            return instrumentation.measured_render(request, self.get_view_template('new_post'), context)
 
     @route(r'^$', name='main')
-    def main_view(self, request):
-        form = self.get_post_model().get_form_class()(request.POST or None, request.FILES or None)
+    @route(r'^page/(?P<page_number>\d+)/$', name='page')
+    def main_view(self, request, page_number=None):
+        try:
+            page_number = int(page_number or request.GET.get('page', 1))
+            after = int(request.GET['after']) if request.GET.get('after') else None
+        except ValueError:
+            raise Http404
+
+        post_model = self.get_post_model()
+        user_can_create_post = self.user_can_create_post(request.user)
+
+        if post_model:
+            if user_can_create_post or self.build_post_form_for_readers:
+                form = post_model.get_form_class()(request.POST or None, request.FILES or None)
+            else:
+                form = None
+
+            posts = self.paginate_posts(request, page_number, after=after)
+        else:
+            form = None
+            posts = None
 
         context = self.get_context(request)
         context['post_form'] = form
-        context['user_can_create_post'] = self.user_can_create_post(request.user)
+        context['posts'] = posts
+        context['user_can_create_post'] = user_can_create_post
         context['user_can_publish_post'] = self.user_can_publish_post(request.user)
-        return render(request, self.get_template(request), context)
+        self.annotate_listing(request, context)
+        return instrumentation.measured_render(request, self.get_template(request), context)
+
+    def annotate_listing(self, request, context):
+        """
+        Sets the per-user state (permissions, unread markers) on the pages
+        listed by main_view
+        """
+        post_model = self.get_post_model()
+
+        if post_model and issubclass(post_model, AbstractFlatForumReply):
+            # Saves each reply looking its topic up again
+            for post in context['posts']:
+                post.topic = self
+
+        if post_model and issubclass(post_model, (AbstractForumPost, AbstractFlatForumReply)):
+            pageurls.annotate_urls(context['posts'])
+            annotate_permissions(request.user, context['posts'])
+
+        if self.subscribable and request.user.is_authenticated():
+            context['user_is_subscribed'] = ForumSubscription.objects.filter(user=request.user, page=self).exists()
+
+    @route(r'^subscribe/$', name='subscribe')
+    def subscribe_view(self, request):
+        if not self.subscribable:
+            raise Http404
+        if not request.user.is_authenticated():
+            raise PermissionDenied
+
+        if request.method == 'POST':
+            ForumSubscription.objects.get_or_create(user=request.user, page=self)
+
+        return redirect(self.url)
+
+    @route(r'^unsubscribe/$', name='unsubscribe')
+    def unsubscribe_view(self, request):
+        if not self.subscribable:
+            raise Http404
+        if not request.user.is_authenticated():
+            raise PermissionDenied
+
+        if request.method == 'POST':
+            ForumSubscription.objects.filter(user=request.user, page=self).delete()
+
+        return redirect(self.url)
+
+    @route(r'^mark-read/$', name='mark_read')
+    def mark_read_view(self, request):
+        if not request.user.is_authenticated():
+            raise PermissionDenied
+
+        if request.method == 'POST':
+            from wagtailforums import readtracking
+            readtracking.mark_read(request.user, self)
+
+        return redirect(self.url)
+
+    @route(r'^post/(?P<post_number>\d+)/$', name='post')
+    def post_view(self, request, post_number):
+        post_number = int(post_number)
+
+        return redirect(self.get_page_url(self.get_post_page_number(post_number)) + '#post-' + str(post_number))
+
+    def get_flat_reply(self, post_number):
+        post_model = self.get_post_model()
+        if not post_model or not issubclass(post_model, AbstractFlatForumReply):
+            raise Http404
+
+        try:
+            reply = post_model.objects.get(topic=self, post_number=post_number)
+        except post_model.DoesNotExist:
+            raise Http404
+
+        reply.topic = self
+        return reply
+
+    @route(r'^reply/(?P<post_number>\d+)/edit/$', name='edit_reply')
+    def edit_reply_view(self, request, post_number):
+        reply = self.get_flat_reply(int(post_number))
+
+        if not reply.user_can_edit(request.user):
+            if request.method == 'POST':
+                raise PermissionDenied
+            else:
+                return redirect(reply.url)
+
+        if request.method == 'POST':
+            retry_after = self.check_rate_limit(request, 'edit')
+            if retry_after:
+                return self.rate_limited_response(request, retry_after)
+
+        form = reply.get_form_class()(request.POST or None, request.FILES or None, instance=reply)
+
+        if form.is_valid():
+            form.save(commit=False)
+
+            with tasks.post_commit():
+                reply.save_edit(request.user)
+
+                tasks.defer(post_edited.send, sender=type(reply), instance=reply, revision=None)
+
+            return redirect(reply.url)
+        else:
+            context = self.get_context(request)
+            context['reply'] = reply
+            context['form'] = form
+            return instrumentation.measured_render(request, self.get_view_template('edit_reply'), context)
+
+    @route(r'^reply/(?P<post_number>\d+)/delete/$', name='delete_reply')
+    def delete_reply_view(self, request, post_number):
+        reply = self.get_flat_reply(int(post_number))
+
+        if not reply.user_can_delete(request.user):
+            if request.method == 'POST':
+                raise PermissionDenied
+            else:
+                return redirect(reply.url)
+
+        if request.method == 'POST':
+            with tasks.post_commit():
+                reply.delete()
+
+            return redirect(self.url)
+        else:
+            context = self.get_context(request)
+            context['reply'] = reply
+            return instrumentation.measured_render(request, self.get_view_template('delete_reply'), context)
 
     class Meta:
         abstract = True
 
 
-class AbstractForumPost(ForumPageMixin, Page):
-    message = models.TextField()
-    post_number = models.PositiveIntegerField(editable=False, null=True)
+_form_classes = {}
 
+
+class ForumMessageMixin(object):
+    """
+    The message handling shared by page-based posts and flat replies
+    """
     form_fields = ('message', )
 
+    # Dotted path to the MessageRenderer for this post type. Defaults to the
+    # WAGTAILFORUMS_MESSAGE_RENDERER setting
+    message_renderer = None
+
     @classmethod
-    def get_form_class(cls):
+    def build_form_class(cls):
         class form(forms.ModelForm):
             class Meta:
                 model = cls
@@ -127,13 +655,56 @@ class AbstractForumPost(ForumPageMixin, Page):
 
         return form
 
+    @classmethod
+    def get_form_class(cls):
+        # Building a ModelForm class introspects every field of the model, so
+        # each one is only built once. Changing form_fields builds a new one.
+        key = (cls, tuple(cls.form_fields))
+
+        if key not in _form_classes:
+            _form_classes[key] = cls.build_form_class()
+
+        return _form_classes[key]
+
+    def render_message(self):
+        return get_message_renderer(self.message_renderer).render(self.message)
+
+    def update_message_html(self):
+        # Only render when the message has changed since it was last rendered
+        if getattr(self, '_message_html_source', None) != self.message:
+            self.message_html = self.render_message()
+            self._message_html_source = self.message
+
+    @property
+    def rendered_message(self):
+        # Posts saved before message_html existed get rendered on the fly
+        if self.message and not self.message_html:
+            return mark_safe(self.render_message())
+
+        return mark_safe(self.message_html)
+
+
+class AbstractForumPost(ForumMessageMixin, ForumPageMixin, Page):
+    message = models.TextField()
+    message_html = models.TextField(editable=False, blank=True)
+    post_number = models.PositiveIntegerField(editable=False, null=True, db_index=True)
+    stats_counted = models.BooleanField(default=False, editable=False)
+    posted_at = models.DateTimeField(null=True, editable=False)
+    posted_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    edited_at = models.DateTimeField(null=True, editable=False)
+    edited_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+
+    denormalized_fields = (
+        'stats_counted', 'posted_at', 'posted_by', 'edited_at', 'edited_by',
+    )
+
     @property
     def edit_url(self):
-        return self.url + self.reverse_subpage('edit')
+        return self.url + self.get_subpage_suffix('edit')
 
     @property
     def delete_url(self):
-        return self.url + self.reverse_subpage('delete')
+        return self.url + self.get_subpage_suffix('delete')
 
     def user_can_edit(self, user):
         # Check if the user has permission to do this in wagtail
@@ -145,7 +716,7 @@ class AbstractForumPost(ForumPageMixin, Page):
             return False
 
         # Owner can edit
-        if user == self.owner:
+        if user.pk == self.owner_id:
             return True
 
         return False
@@ -160,27 +731,106 @@ class AbstractForumPost(ForumPageMixin, Page):
             return False
 
         # Owner can delete
-        if user == self.owner:
+        if user.pk == self.owner_id:
             return True
 
         return False
 
+    def save_revision(self, user=None, **kwargs):
+        now = timezone.now()
+
+        self.update_message_html()
+
+        if self.posted_at is None:
+            # Posts from before these fields were stored were posted when
+            # their first revision was made, not now
+            earliest_revision = self.get_earliest_revision()
+
+            if earliest_revision is not None:
+                self.posted_at = earliest_revision.created_at
+                self.posted_by = earliest_revision.user
+            else:
+                self.posted_at = now
+                self.posted_by = user
+
+        self.edited_at = now
+        self.edited_by = user
+
+        if self.post_number is None:
+            # Posts created in the Wagtail admin don't go through
+            # new_post_view, number them when their first revision is saved
+            self.assign_post_number()
+
+        revision = super(AbstractForumPost, self).save_revision(user=user, **kwargs)
+
+        type(self).objects.filter(pk=self.pk).update(
+            post_number=self.post_number,
+            posted_at=self.posted_at,
+            posted_by=self.posted_by,
+            edited_at=self.edited_at,
+            edited_by=self.edited_by,
+        )
+
+        return revision
+
+    def assign_post_number(self):
+        """
+        Gives the post the next post number of the page it's on, if that page
+        lists it
+        """
+        parent = self.get_parent().specific
+        if isinstance(parent, ForumPageMixin) and isinstance(self, parent.get_post_model() or ()):
+            self.post_number = parent.get_next_post_number()
+
+    def _get_prefetched_revisions(self):
+        # Use revisions loaded with prefetch_related('revisions') if there are any
+        if 'revisions' in getattr(self, '_prefetched_objects_cache', {}):
+            return sorted(self.revisions.all(), key=lambda revision: (revision.created_at, revision.id))
+
     def get_earliest_revision(self):
-        return self.revisions.order_by('-created_at').last()
+        revisions = self._get_prefetched_revisions()
+        if revisions is not None:
+            return revisions[0] if revisions else None
+
+        return self.revisions.order_by('created_at', 'id').first()
+
+    def get_latest_revision(self):
+        revisions = self._get_prefetched_revisions()
+        if revisions is not None:
+            return revisions[-1] if revisions else None
 
-    # get_latest_revision is implemented in wagtailcore.Page
+        return super(AbstractForumPost, self).get_latest_revision()
+
+    # The get_(posted|edited)_(at|by) methods fall back to looking at the
+    # revisions for posts that were created before these fields were stored
 
     def get_posted_at(self):
-        return self.get_earliest_revision().created_at
+        if self.posted_at is None:
+            revision = self.get_earliest_revision()
+            return revision.created_at if revision else None
+
+        return self.posted_at
 
     def get_posted_by(self):
-        return self.get_earliest_revision().user
+        if self.posted_at is None:
+            revision = self.get_earliest_revision()
+            return revision.user if revision else None
+
+        return self.posted_by
 
     def get_edited_at(self):
-        return self.get_latest_revision().created_at
+        if self.edited_at is None:
+            revision = self.get_latest_revision()
+            return revision.created_at if revision else None
+
+        return self.edited_at
 
     def get_edited_by(self):
-        return self.get_latest_revision().user
+        if self.edited_at is None:
+            revision = self.get_latest_revision()
+            return revision.user if revision else None
+
+        return self.edited_by
 
     def get_slug(self):
         if self.title:
@@ -197,6 +847,9 @@ class AbstractForumPost(ForumPageMixin, Page):
     def get_edit_redirect_url(self):
         return self.url
 
+    def get_parent_url(self):
+        return pageurls.get_parent_url(self)
+
     @route(r'^edit/$', name='edit')
     def edit_view(self, request):
         if not self.user_can_edit(request.user):
@@ -205,20 +858,30 @@ class AbstractForumPost(ForumPageMixin, Page):
             else:
                 return redirect(self.url)
 
+        if request.method == 'POST':
+            retry_after = self.check_rate_limit(request, 'edit')
+            if retry_after:
+                return self.rate_limited_response(request, retry_after)
+
         form = self.get_form_class()(request.POST or None, request.FILES or None, instance=self)
 
         if form.is_valid():
             form.save(commit=False)
-            self.save_revision(user=request.user).publish()
+
+            with tasks.post_commit():
+                revision = self.save_revision(user=request.user)
+                revision.publish()
+
+                tasks.defer(post_edited.send, sender=type(self), instance=self, revision=revision)
 
             return redirect(self.get_edit_redirect_url())
         else:
             context = self.get_context(request)
             context['form'] = form
-            return render(request, get_template_name(self.template, 'edit'), context)
+            return instrumentation.measured_render(request, self.get_view_template('edit'), context)
 
     def get_delete_redirect_url(self):
-        return self.get_parent().url
+        return self.get_parent_url()
 
     @route(r'^delete/$', name='delete')
     def delete_view(self, request):
@@ -229,10 +892,12 @@ class AbstractForumPost(ForumPageMixin, Page):
                 return redirect(self.url)
 
         if request.method == 'POST':
-            self.delete()
+            with tasks.post_commit():
+                self.delete()
+
             return redirect(self.get_delete_redirect_url())
         else:
-            return render(request, get_template_name(self.template, 'delete'), self.get_context(request))
+            return instrumentation.measured_render(request, self.get_view_template('delete'), self.get_context(request))
 
     is_abstract = True
 
@@ -246,7 +911,7 @@ AbstractForumPost.content_panels = Page.content_panels + [
 
 class AbstractForumReply(AbstractForumPost):
     def get_edit_redirect_url(self):
-        return self.get_parent().url
+        return self.get_parent_url()
 
     is_abstract = True
 
@@ -254,12 +919,204 @@ class AbstractForumReply(AbstractForumPost):
         abstract = True
 
 
+class AbstractFlatForumReply(ForumMessageMixin, models.Model):
+    """
+    A reply that is stored as a plain row with a foreign key to its topic,
+    rather than as a page in the tree.
+
+    Creating one is a single insert: there's no treebeard path to allocate,
+    no numchild or url_path to update and no revision. Replies are edited and
+    deleted through routes on the topic. Replies held for moderation are
+    saved with ``live`` off and ``submitted_for_moderation`` on.
+
+    Flat replies aren't added to the search index.
+    """
+    topic = models.ForeignKey('wagtailcore.Page', editable=False, related_name='+')
+    post_number = models.PositiveIntegerField(editable=False)
+    message = models.TextField()
+    message_html = models.TextField(editable=False, blank=True)
+    live = models.BooleanField(default=True, editable=False)
+    submitted_for_moderation = models.BooleanField(default=False, editable=False, db_index=True)
+    stats_counted = models.BooleanField(default=False, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    posted_at = models.DateTimeField(default=timezone.now, editable=False)
+    posted_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    edited_at = models.DateTimeField(default=timezone.now, editable=False)
+    edited_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+
+    # Maintained with queryset updates by wagtailforums.stats
+    denormalized_fields = ('stats_counted', )
+
+    def get_topic(self):
+        topic = self.topic
+        if not isinstance(topic, ForumPageMixin):
+            topic = self.topic = topic.specific
+
+        return topic
+
+    @property
+    def url(self):
+        return self.get_topic().get_post_permalink(self.post_number)
+
+    @property
+    def full_url(self):
+        topic = self.get_topic()
+        return topic.full_url + topic.get_subpage_suffix('post', post_number=self.post_number)
+
+    @property
+    def edit_url(self):
+        topic = self.get_topic()
+        return topic.url + topic.get_subpage_suffix('edit_reply', post_number=self.post_number)
+
+    @property
+    def delete_url(self):
+        topic = self.get_topic()
+        return topic.url + topic.get_subpage_suffix('delete_reply', post_number=self.post_number)
+
+    def user_can_moderate(self, user):
+        # Users that can publish the topic look after its replies
+        return self.get_topic().permissions_for_user(user).can_publish()
+
+    def user_can_edit(self, user):
+        if self.user_can_moderate(user):
+            return True
+
+        # Make sure the user is active
+        if not user.is_active:
+            return False
+
+        # Owner can edit
+        if user.pk == self.owner_id:
+            return True
+
+        return False
+
+    def user_can_delete(self, user):
+        return self.user_can_edit(user)
+
+    def get_posted_at(self):
+        return self.posted_at
+
+    def get_posted_by(self):
+        return self.posted_by
+
+    def get_edited_at(self):
+        return self.edited_at
+
+    def get_edited_by(self):
+        return self.edited_by
+
+    def save_new(self, topic, user, live=True):
+        now = timezone.now()
+
+        self.topic = topic
+        if self.post_number is None:
+            self.post_number = topic.get_next_post_number()
+        self.owner = user
+        self.live = live
+        self.submitted_for_moderation = not live
+        self.posted_at = self.edited_at = now
+        self.posted_by = self.edited_by = user
+        self.update_message_html()
+        self.save()
+
+    def save_edit(self, user):
+        self.edited_at = timezone.now()
+        self.edited_by = user
+        self.update_message_html()
+        self.save()
+
+    def publish(self):
+        self.live = True
+        self.save()
+
+    def unpublish(self):
+        self.live = False
+        self.save()
+
+    def save(self, *args, **kwargs):
+        if self.pk and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+
+        return super(AbstractFlatForumReply, self).save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+        unique_together = ('topic', 'post_number')
+
+
 class AbstractForumTopic(AbstractForumPost):
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post_at = models.DateTimeField(null=True, editable=False)
+    last_post_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    last_post = models.ForeignKey('wagtailcore.Page', null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+
+    # Closed topics only take replies from users that can publish in them,
+    # see wagtailforums.topics
+    closed = models.BooleanField(default=False, editable=False)
+
     form_fields = ('title', 'message')
+    subscribable = True
+    denormalized_fields = AbstractForumPost.denormalized_fields + (
+        'reply_count', 'last_post_at', 'last_post_by', 'last_post', 'closed',
+    )
+
+    def user_can_create_post(self, user):
+        if self.closed and not self.permissions_for_user(user).can_publish():
+            return False
+
+        return super(AbstractForumTopic, self).user_can_create_post(user)
 
     def get_create_post_redirect_url(self, post):
         return self.url
 
+    def annotate_listing(self, request, context):
+        super(AbstractForumTopic, self).annotate_listing(request, context)
+
+        if request.user.is_authenticated():
+            from wagtailforums import readtracking
+
+            posts = list(context['posts'])
+            readtracking.annotate_read_state(request.user, [self])
+
+            for post in posts:
+                post.is_unread = self.read_until is None or get_post_time(post) > self.read_until
+
+            # Remember that the user has read up to the last post on this page
+            read_posts = [post for post in posts if post.post_number is not None]
+            if context['posts'].number == 1:
+                read_posts.append(self)
+            if read_posts:
+                last_read_post = max(read_posts, key=get_post_time)
+                readtracking.record_read(
+                    request.user,
+                    self,
+                    max(post.post_number for post in posts) if posts else 0,
+                    get_post_time(last_read_post),
+                )
+
+    def rebuild_stats(self, exclude_post=None, exclude_path=None):
+        replies = self.get_posts()
+
+        if isinstance(exclude_post, replies.model):
+            replies = replies.exclude(pk=exclude_post.pk)
+        if exclude_path and not issubclass(replies.model, AbstractFlatForumReply):
+            replies = replies.exclude(path__startswith=exclude_path)
+
+        # A topic is its own latest post until somebody replies to it
+        latest_post = get_latest_post(replies) or (self if self.live else None)
+
+        type(self).objects.filter(pk=self.pk).update(
+            reply_count=replies.count(),
+            **get_last_post_fields(latest_post)
+        )
+
+        # Once the new counts are committed
+        tasks.defer(cache.invalidate_page, self)
+
     is_abstract = True
 
     class Meta:
@@ -267,31 +1124,274 @@ class AbstractForumTopic(AbstractForumPost):
 
 
 class AbstractForumIndex(ForumPageMixin, Page):
+    topic_count = models.PositiveIntegerField(default=0, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post_at = models.DateTimeField(null=True, editable=False)
+    last_post_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    last_post = models.ForeignKey('wagtailcore.Page', null=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+
+    # Post limits, see wagtailforums.ratelimit. Blank ones are taken from the
+    # forum above.
+    post_limit_per_user = models.PositiveIntegerField(null=True, blank=True, help_text="Posts that each user can make in this forum per period")
+    post_limit_per_ip = models.PositiveIntegerField(null=True, blank=True, help_text="Posts that can be made from each IP address in this forum per period")
+    post_limit_per_forum = models.PositiveIntegerField(null=True, blank=True, help_text="Posts that can be made in this forum per period, by everyone")
+    post_limit_period = models.PositiveIntegerField(null=True, blank=True, help_text="Length of the period, in seconds")
+
+    reverse_post_order = True
+    subscribable = True
+    post_select_related = ForumPageMixin.post_select_related + ('last_post_by', )
+    denormalized_fields = (
+        'topic_count', 'reply_count', 'last_post_at', 'last_post_by', 'last_post',
+    )
+
+    def get_indexes(self, request=None):
+        """
+        Returns the live forums inside this one, as nodes of the forum tree
+        """
+        from wagtailforums import navigation
+        return navigation.get_request_forum_tree(request).get_children(self)
+
+    def get_context(self, request):
+        context = super(AbstractForumIndex, self).get_context(request)
+        context['indexes'] = self.get_indexes(request)
+        return context
+
+    def annotate_listing(self, request, context):
+        super(AbstractForumIndex, self).annotate_listing(request, context)
+
+        if request.user.is_authenticated():
+            from wagtailforums import readtracking
+
+            # Sub forums and topics are looked up together
+            context['indexes'] = list(context['indexes'])
+            readtracking.annotate_read_state(request.user, context['indexes'] + list(context['posts'] or []))
+
+    def rebuild_stats(self, exclude_post=None, exclude_path=None):
+        posts = Page.objects.live().descendant_of(self).type(AbstractForumPost)
+
+        if isinstance(exclude_post, Page):
+            posts = posts.exclude(pk=exclude_post.pk)
+        if exclude_path:
+            posts = posts.exclude(path__startswith=exclude_path)
+        topic_count = posts.type(AbstractForumTopic).count()
+        reply_count = posts.count() - topic_count
+
+        # Posts are ordered by the fields of their own models
+        latest_posts = []
+        for model in get_forum_page_models(AbstractForumPost):
+            latest_post = get_latest_post(model.objects.filter(id__in=posts.values('id')))
+            if latest_post is not None:
+                latest_posts.append(latest_post)
+
+        for model in get_flat_reply_models():
+            replies = model.objects.filter(live=True, topic__path__startswith=self.path)
+
+            if isinstance(exclude_post, model):
+                replies = replies.exclude(pk=exclude_post.pk)
+            if exclude_path:
+                replies = replies.exclude(topic__path__startswith=exclude_path)
+            reply_count += replies.count()
+
+            latest_reply = get_latest_post(replies)
+            if latest_reply is not None:
+                latest_posts.append(latest_reply)
+
+        type(self).objects.filter(pk=self.pk).update(
+            topic_count=topic_count,
+            reply_count=reply_count,
+            **get_last_post_fields(max(latest_posts, key=get_post_time) if latest_posts else None)
+        )
+
+        # Once the new counts are committed
+        tasks.defer(cache.invalidate_page, self)
+
+    def import_posts(self, stream, batch_size=1000):
+        """
+        Imports forums, topics and replies from a stream of JSON lines into
+        this forum. See wagtailforums.importexport for the format.
+        """
+        from wagtailforums.importexport import ForumImporter
+
+        counts = ForumImporter(self, batch_size=batch_size).run(stream)
+        cache.invalidate_page(self)
+
+        return counts
+
+    def export_posts(self, stream):
+        """
+        Writes the forums, topics and replies in this forum to the stream as
+        JSON lines that import_posts can read back.
+        """
+        from wagtailforums.importexport import export_forum
+
+        export_forum(self, stream)
 
     @property
     def search_url(self):
-        return self.url + self.reverse_subpage('search')
+        return self.url + self.get_subpage_suffix('search')
+
+    search_results_per_page = 20
+
+    # Searches only rank this many results, so common words don't load and
+    # sort every post in the forum
+    search_result_limit = 1000
+
+    # How long the ranked results of a search are cached for
+    search_cache_timeout = 300
+
+    def get_search_scope(self, request, hidden_paths):
+        """
+        Returns the page that the search is limited to. This is this forum
+        unless a forum or topic inside it is given in the query string.
+        """
+        scope_id = request.GET.get('topic') or request.GET.get('forum')
+        if not scope_id:
+            return self
+
+        scope = Page.objects.live().descendant_of(self).filter(id=scope_id).first()
+        if scope is None or any(scope.path.startswith(path) for path in hidden_paths):
+            raise Http404
+
+        return scope
 
     @route(r'^search/$', name='search')
     def search_view(self, request):
-        if 'q' in request.GET:
-            query_string = request.GET['q']
-            search_results = self.get_post_model().objects.live().descendant_of(self).search(query_string)
+        from wagtailforums import search
+
+        query_string = request.GET.get('q')
+        filters = {}
+
+        try:
+            page_number = int(request.GET.get('page', 1))
+
+            if request.GET.get('author'):
+                User = get_user_model()
+                filters['author'] = User.objects.filter(**{User.USERNAME_FIELD: request.GET['author']}).values_list('pk', flat=True).first()
+            if request.GET.get('from'):
+                filters['posted_after'] = parse_search_date(request.GET['from'])
+            if request.GET.get('to'):
+                filters['posted_before'] = parse_search_date(request.GET['to']) + datetime.timedelta(days=1)
+
+            hidden_paths = search.get_hidden_paths(self, request.session.get('passed_page_view_restrictions', []))
+            scope = self.get_search_scope(request, hidden_paths)
+        except ValueError:
+            raise Http404
+
+        if query_string and filters.get('author', True) is not None:
+            search_results = search.cached_search(
+                query_string,
+                scope,
+                exclude_paths=[path for path in hidden_paths if path.startswith(scope.path)],
+                limit=self.search_result_limit,
+                timeout=self.search_cache_timeout,
+                **filters
+            )
+
+            try:
+                results_page = search_results.get_page(page_number, self.search_results_per_page)
+            except InvalidPage:
+                raise Http404
         else:
-            query_string = None
-            search_results = self.get_post_model().objects.none()
+            search_results = None
+            results_page = None
 
-        return render(request, get_template_name(self.template, 'search'), {
+        context = self.get_context(request)
+        context.update({
             'query_string': query_string,
-            'search_results': search_results,
+            'search_scope': scope,
+            'search_results': results_page,
+            'search_facets': search_results.facets if search_results else None,
         })
 
+        return instrumentation.measured_render(request, self.get_view_template('search'), context)
+
     is_abstract = True
 
     class Meta:
         abstract = True
 
+AbstractForumIndex.settings_panels = Page.settings_panels + [
+    MultiFieldPanel([
+        FieldPanel('post_limit_per_user'),
+        FieldPanel('post_limit_per_ip'),
+        FieldPanel('post_limit_per_forum'),
+        FieldPanel('post_limit_period'),
+    ], "Post limits"),
+]
+
+
+def parse_search_date(value):
+    date = dateparse.parse_date(value)
+    if date is None:
+        raise ValueError("Invalid date: %r" % value)
+
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()), timezone.get_default_timezone())
+
+
+def get_post_time(post):
+    return post.get_posted_at() or post.first_published_at or timezone.now()
+
+
+def get_ancestor_paths(post):
+    """
+    Returns the paths of the pages above the post. For a flat reply, this
+    includes its topic.
+    """
+    if isinstance(post, AbstractFlatForumReply):
+        path = Page.objects.filter(pk=post.topic_id).values_list('path', flat=True).first()
+        if path is None:
+            return []
+
+        return [path[:i] for i in range(Page.steplen, len(path) + 1, Page.steplen)]
+
+    return [post.path[:i] for i in range(post.steplen, len(post.path), post.steplen)]
+
+
+def get_latest_post(posts):
+    """
+    Returns the post in the queryset that was made last, going by the same
+    time as get_post_time. Imported and merged posts have ids that don't
+    follow their posting times. Posts that haven't had their posting time
+    stored (see backfill_post_metadata) only count if none of the others have.
+    """
+    return (
+        posts.exclude(posted_at=None).order_by('-posted_at', '-id').first() or
+        posts.filter(posted_at=None).order_by('-id').first()
+    )
+
+
+def get_last_post_fields(post):
+    if post is None:
+        return {'last_post_id': None, 'last_post_at': None, 'last_post_by_id': None}
+
+    return {
+        # Flat replies aren't pages, the topic stands in for them
+        'last_post_id': post.topic_id if isinstance(post, AbstractFlatForumReply) else post.pk,
+        'last_post_at': get_post_time(post),
+        'last_post_by_id': post.posted_by_id if post.posted_at else post.owner_id,
+    }
+
+
+def get_specific_pages(page_ids):
+    """
+    Returns a dict of the pages with these ids, as their specific types, with
+    one query per page type
+    """
+    page_ids_by_type = {}
+    for page_id, content_type_id in Page.objects.filter(id__in=page_ids).values_list('id', 'content_type_id'):
+        page_ids_by_type.setdefault(content_type_id, []).append(page_id)
+
+    pages = {}
+    for content_type_id, ids in page_ids_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class() or Page
+        pages.update((page.id, page) for page in model.objects.filter(id__in=ids))
+
+    return pages
+
+
+def get_forum_page_models(base_class=ForumPageMixin):
+    return [model for model in PAGE_MODEL_CLASSES if issubclass(model, base_class)]
+
 
-def get_template_name(main_template_name, view_name):
-    root, ext = os.path.splitext(main_template_name)
-    return root + '_' + view_name + ext
+def get_flat_reply_models():
+    return [model for model in apps.get_models() if issubclass(model, AbstractFlatForumReply)]
@@ -0,0 +1,420 @@
+"""
+The queue of forum posts waiting for moderation.
+
+Posts made by users that can't publish them (see ``moderate_posts``) are
+saved as revisions submitted for moderation. Flat replies don't have
+revisions, they're saved unpublished with ``submitted_for_moderation`` set.
+The moderation dashboard in the Wagtail admin lists them per forum, oldest
+first, a page at a time: the revisions, then the flat replies. Pages are
+found by id rather than by offset so they're as quick to load at the end of
+a long queue as at the start.
+
+Each post is shown with a spam score and its author's history. These are
+worked out for the whole page of posts with a few aggregate queries.
+"""
+import datetime
+import re
+from collections import Counter, namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from wagtail.wagtailcore.models import Page, PageRevision
+
+from wagtailforums import tasks
+from wagtailforums.models import AbstractFlatForumReply, AbstractForumPost, get_flat_reply_models, get_forum_page_models, get_specific_pages
+from wagtailforums.signals import post_created
+
+
+AuthorHistory = namedtuple('AuthorHistory', ['live_posts', 'pending_posts', 'rejected_posts', 'date_joined'])
+
+LINK_RE = re.compile(r'https?://|www\.', re.IGNORECASE)
+
+# Revisions are published this many at a time
+APPROVE_BATCH_SIZE = 100
+
+
+def get_post_content_types():
+    return list(ContentType.objects.get_for_models(*get_forum_page_models(AbstractForumPost)).values())
+
+
+def get_pending_revisions(scope=None):
+    """
+    Returns the revisions of forum posts that are waiting for moderation,
+    in ``scope`` (a forum) if it's given
+    """
+    revisions = PageRevision.objects.filter(submitted_for_moderation=True, page__content_type__in=get_post_content_types())
+
+    if scope is not None:
+        revisions = revisions.filter(page__path__startswith=scope.path)
+
+    return revisions
+
+
+def get_pending_flat_replies(scope=None):
+    """
+    Returns a queryset of the flat replies that are waiting for moderation
+    for each flat reply model, in ``scope`` (a forum) if it's given
+    """
+    querysets = []
+    for model in get_flat_reply_models():
+        replies = model.objects.filter(submitted_for_moderation=True)
+
+        if scope is not None:
+            replies = replies.filter(topic__path__startswith=scope.path)
+
+        querysets.append(replies)
+
+    return querysets
+
+
+def get_flat_reply_key(reply):
+    """
+    Returns a string that identifies the flat reply among the replies of all
+    flat reply models, for forms and for paging the queue
+    """
+    return '%s.%s-%d' % (reply._meta.app_label, reply._meta.model_name, reply.pk)
+
+
+def parse_flat_reply_key(key):
+    """
+    Returns the model and id from a key made by get_flat_reply_key. Raises
+    ValueError if it isn't one.
+    """
+    label, reply_id = key.rsplit('-', 1)
+
+    try:
+        model = apps.get_model(label)
+    except LookupError:
+        raise ValueError("%r isn't a model" % label)
+    if not issubclass(model, AbstractFlatForumReply):
+        raise ValueError("%r isn't a flat reply model" % label)
+
+    return model, int(reply_id)
+
+
+def count_pending(tree):
+    """
+    Returns the number of posts waiting for moderation in each forum of the
+    tree, including those in its subforums, keyed by forum id.
+
+    The database counts them, with one query for each depth that forums are
+    at. Revisions are grouped on the start of their page's path that's as
+    long as the paths of the forums at that depth. Flat replies are counted
+    per topic, with one query for each flat reply model, and added to the
+    forums above the topic.
+    """
+    paths_by_length = {}
+    for node in tree:
+        paths_by_length.setdefault(len(node.path), []).append(node.path)
+
+    counts = Counter()
+    for length, paths in paths_by_length.items():
+        # The length is in the SQL rather than a parameter so the GROUP BY
+        # matches the select
+        forum_path = 'SUBSTR(%s.path, 1, %d)' % (connection.ops.quote_name(Page._meta.db_table), length)
+
+        pending = get_pending_revisions().extra(
+            select={'forum_path': forum_path},
+            where=['%s IN (%s)' % (forum_path, ', '.join(['%s'] * len(paths)))],
+            params=paths,
+        )
+
+        for path, count in pending.values_list('forum_path').annotate(Count('id')).order_by():
+            counts[tree.by_path[path].id] = count
+
+    for replies in get_pending_flat_replies():
+        for topic_path, count in replies.values_list('topic__path').annotate(Count('id')).order_by():
+            for length in paths_by_length:
+                forum = tree.by_path.get(topic_path[:length])
+                if forum is not None:
+                    counts[forum.id] += count
+
+    return counts
+
+
+def get_author_histories(user_ids):
+    """
+    Returns an AuthorHistory for each user, keyed by id. Rejected posts are
+    those that were never published and aren't waiting for moderation. Flat
+    replies don't record whether they were published before, any that are
+    unpublished and not waiting count as rejected.
+    """
+    content_types = get_post_content_types()
+    posts = Page.objects.filter(owner__in=user_ids, content_type__in=content_types)
+
+    live_posts = Counter(dict(posts.filter(live=True).values_list('owner').annotate(Count('id')).order_by()))
+    pending_posts = Counter(dict(
+        get_pending_revisions().filter(user__in=user_ids)
+        .values_list('user').annotate(Count('id')).order_by()
+    ))
+    rejected_posts = Counter(dict(
+        posts.filter(live=False, first_published_at__isnull=True)
+        .exclude(revisions__submitted_for_moderation=True)
+        .values_list('owner').annotate(Count('id')).order_by()
+    ))
+
+    for model in get_flat_reply_models():
+        replies = model.objects.filter(owner__in=user_ids)
+
+        live_posts.update(dict(replies.filter(live=True).values_list('owner').annotate(Count('id')).order_by()))
+        pending_posts.update(dict(replies.filter(submitted_for_moderation=True).values_list('owner').annotate(Count('id')).order_by()))
+        rejected_posts.update(dict(
+            replies.filter(live=False, submitted_for_moderation=False)
+            .values_list('owner').annotate(Count('id')).order_by()
+        ))
+
+    # Custom user models might not have date_joined
+    User = get_user_model()
+    if 'date_joined' in User._meta.get_all_field_names():
+        users = User.objects.filter(pk__in=user_ids).values_list('pk', 'date_joined')
+    else:
+        users = ((user_id, None) for user_id in User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    return dict(
+        (user_id, AuthorHistory(live_posts.get(user_id, 0), pending_posts.get(user_id, 0), rejected_posts.get(user_id, 0), date_joined))
+        for user_id, date_joined in users
+    )
+
+
+def count_duplicates(posts):
+    """
+    Returns the number of posts of the same type with each post's message,
+    keyed by post (flat replies and pages can have the same id)
+    """
+    messages_by_model = {}
+    for post in posts:
+        messages_by_model.setdefault(type(post), set()).add(post.message)
+
+    counts = {}
+    for model, messages in messages_by_model.items():
+        counts[model] = dict(model.objects.filter(message__in=messages).values_list('message').annotate(Count('id')).order_by())
+
+    return dict((post, counts[type(post)].get(post.message, 1)) for post in posts)
+
+
+def score_post(post, history, duplicates):
+    """
+    Returns a rough score out of 100 of how likely the post is to be spam,
+    from its links, copies of it and its author's history
+    """
+    score = min(len(LINK_RE.findall(post.message)) * 15, 45)
+
+    if duplicates > 1:
+        score += 30
+
+    if history is not None:
+        if not history.live_posts:
+            score += 15
+        score += min(history.rejected_posts * 10, 30)
+
+        if history.date_joined and timezone.now() - history.date_joined < datetime.timedelta(days=1):
+            score += 10
+
+    return min(score, 100)
+
+
+def get_spam_scorer():
+    return import_string(getattr(settings, 'WAGTAILFORUMS_SPAM_SCORER', 'wagtailforums.moderation.score_post'))
+
+
+class QueueItem(object):
+    """
+    A post in the moderation queue. ``revision`` is the revision waiting for
+    moderation, or None if the post is a flat reply, which waits itself.
+    """
+    def __init__(self, revision, post, history, spam_score):
+        self.revision = revision
+        self.post = post
+        self.author_history = history
+        self.spam_score = spam_score
+
+        if revision is not None:
+            self.submitted_by, self.submitted_at = revision.user, revision.created_at
+            self.flat_reply_key = None
+        else:
+            self.submitted_by, self.submitted_at = post.owner, post.edited_at
+            self.flat_reply_key = get_flat_reply_key(post)
+
+
+class QueuePage(object):
+    """
+    A page of the moderation queue. ``next_after`` is the value to pass as
+    ``after`` to get the next page, or None on the last page. It's a revision
+    id until the revisions run out, then the key of a flat reply (see
+    get_flat_reply_key).
+    """
+    def __init__(self, items, next_after):
+        self.items = items
+        self.next_after = next_after
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def get_flat_replies_page(scope, after, limit):
+    """
+    Returns up to ``limit`` flat replies waiting for moderation in ``scope``,
+    following the one with the key ``after`` (or from the first if it's
+    None). They're in order of model, then id.
+    """
+    after_model, after_id = parse_flat_reply_key(after) if after is not None else (None, None)
+
+    replies = []
+    for queryset in get_pending_flat_replies(scope):
+        if after_model is not None:
+            if queryset.model is not after_model:
+                # Replies of the models before it were on earlier pages
+                continue
+
+            queryset = queryset.filter(id__gt=after_id)
+            after_model = None
+
+        replies.extend(queryset.select_related('owner', 'topic').order_by('id')[:limit - len(replies)])
+        if len(replies) >= limit:
+            break
+
+    return replies
+
+
+def get_queue_page(scope, after=None, per_page=50):
+    """
+    Returns the page of posts waiting for moderation in ``scope`` that
+    follows ``after``, the ``next_after`` of the page before. Raises
+    ValueError if ``after`` isn't one.
+    """
+    revisions = []
+    flat_after = None
+
+    if after is not None and not str(after).isdigit():
+        # Past the revisions
+        flat_after = after
+        parse_flat_reply_key(flat_after)
+    else:
+        revisions = get_pending_revisions(scope).select_related('user').order_by('id')
+        if after is not None:
+            revisions = revisions.filter(id__gt=int(after))
+
+        revisions = list(revisions[:per_page + 1])
+
+    if len(revisions) > per_page:
+        next_after = revisions[per_page - 1].id
+        revisions = revisions[:per_page]
+        flat_replies = []
+    else:
+        # The flat replies follow the revisions
+        space = per_page - len(revisions)
+        flat_replies = get_flat_replies_page(scope, flat_after, space + 1)
+
+        if len(flat_replies) > space:
+            next_after = get_flat_reply_key(flat_replies[space - 1]) if space else revisions[-1].id
+            flat_replies = flat_replies[:space]
+        else:
+            next_after = None
+
+    posts = get_specific_pages([revision.page_id for revision in revisions])
+    histories = get_author_histories(
+        set(revision.user_id for revision in revisions if revision.user_id)
+        | set(reply.owner_id for reply in flat_replies if reply.owner_id)
+    )
+    duplicates = count_duplicates(list(posts.values()) + flat_replies)
+    score = get_spam_scorer()
+
+    items = []
+    for revision in revisions:
+        post = posts.get(revision.page_id)
+        if post is None:
+            # Deleted since the revisions were loaded
+            continue
+
+        history = histories.get(revision.user_id)
+        items.append(QueueItem(revision, post, history, score(post, history, duplicates[post])))
+
+    for reply in flat_replies:
+        history = histories.get(reply.owner_id)
+        items.append(QueueItem(None, reply, history, score(reply, history, duplicates[reply])))
+
+    return QueuePage(items, next_after)
+
+
+def approve(revisions):
+    """
+    Publishes the revisions, in batches, in one transaction. Only revisions
+    that are still waiting for moderation are published. Returns how many
+    were.
+
+    Posts that are published for the first time send ``post_created`` once
+    the transaction has committed, as they would have if they hadn't been
+    moderated, so their subscribers are notified.
+    """
+    revision_ids = list(revisions.filter(submitted_for_moderation=True).order_by('id').values_list('id', flat=True))
+
+    with tasks.post_commit():
+        for i in range(0, len(revision_ids), APPROVE_BATCH_SIZE):
+            batch = list(PageRevision.objects.filter(id__in=revision_ids[i:i + APPROVE_BATCH_SIZE]).select_related('page'))
+
+            # Publishing sets the url_path of each post from its parent, load
+            # the parents together
+            parents = dict(
+                (parent.path, parent)
+                for parent in Page.objects.filter(path__in=set(revision.page.path[:-Page.steplen] for revision in batch))
+            )
+            new_posts = {}
+            for revision in batch:
+                if revision.page.first_published_at is None:
+                    new_posts[revision.page_id] = revision
+
+                revision.page._cached_parent_obj = parents[revision.page.path[:-Page.steplen]]
+                revision.publish()
+
+            for page_id, post in get_specific_pages(list(new_posts.keys())).items():
+                tasks.defer(post_created.send, sender=type(post), instance=post, revision=new_posts[page_id], published=True)
+
+    return len(revision_ids)
+
+
+def reject(revisions):
+    """
+    Takes the revisions out of the moderation queue, leaving their posts
+    unpublished. Returns how many there were.
+    """
+    return revisions.filter(submitted_for_moderation=True).update(submitted_for_moderation=False)
+
+
+def approve_flat_replies(replies):
+    """
+    Publishes the flat replies in the querysets (see
+    get_pending_flat_replies) that are still waiting for moderation, in one
+    transaction. Returns how many were published.
+
+    Each sends ``post_created`` once the transaction has committed, as it
+    would have if it hadn't been moderated.
+    """
+    count = 0
+
+    with tasks.post_commit():
+        for queryset in replies:
+            for reply in queryset.filter(submitted_for_moderation=True).select_related('topic').order_by('id'):
+                reply.submitted_for_moderation = False
+                reply.publish()
+                tasks.defer(post_created.send, sender=type(reply), instance=reply, revision=None, published=True)
+                count += 1
+
+    return count
+
+
+def reject_flat_replies(replies):
+    """
+    Takes the flat replies in the querysets out of the moderation queue,
+    leaving them unpublished. Returns how many there were.
+    """
+    return sum(queryset.filter(submitted_for_moderation=True).update(submitted_for_moderation=False) for queryset in replies)
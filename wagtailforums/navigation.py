@@ -0,0 +1,149 @@
+"""
+The forum tree: every live forum index with its title, URL and counts, for
+breadcrumbs and subforum listings.
+
+The tree is built with one query per forum index model and kept in the
+cache, one per site. It's versioned so it's rebuilt when a forum index is
+saved, moved or deleted. The counts and last post times are updated with
+queries that don't send signals, so the tree is also rebuilt every
+WAGTAILFORUMS_FORUM_TREE_TIMEOUT seconds (60 by default) to pick these up.
+"""
+from django.conf import settings
+from django.utils.encoding import python_2_unicode_compatible
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums import cache, pageurls
+from wagtailforums.models import AbstractForumIndex, get_forum_page_models
+
+
+TREE_VERSION_KEY = 'wagtailforums:tree-version'
+
+# The post limits of each forum are kept in the tree, see wagtailforums.ratelimit
+LIMIT_NAMES = ('per_user', 'per_ip', 'per_forum', 'period')
+LIMIT_FIELDS = tuple('post_limit_' + name for name in LIMIT_NAMES)
+
+
+@python_2_unicode_compatible
+class ForumNode(object):
+    """
+    A forum index in the tree. This has the same attributes as the page for
+    its title, url, path and counts, so can be listed in its place.
+    """
+    steplen = Page.steplen
+    post_limits = {}
+
+    def __init__(self, id, path, depth, title, url_path, topic_count, reply_count, last_post_at, post_limits=None):
+        self.id = self.pk = id
+        self.path = path
+        self.depth = depth
+        self.title = title
+        self.url_path = url_path
+        self.topic_count = topic_count
+        self.reply_count = reply_count
+        self.last_post_at = last_post_at
+        self.post_limits = post_limits or {}
+        self.children = []
+
+    @property
+    def url(self):
+        # The tree is shared between requests, which can have different
+        # script prefixes, so the URL isn't kept in it
+        return pageurls.get_url_for_path(self.url_path)
+
+    def __str__(self):
+        return self.title
+
+    def __repr__(self):
+        return '<ForumNode %s: %s>' % (self.id, self.title)
+
+
+class ForumTree(object):
+    def __init__(self, nodes):
+        self.nodes = sorted(nodes, key=lambda node: node.path)
+        self.by_id = dict((node.id, node) for node in self.nodes)
+        self.by_path = dict((node.path, node) for node in self.nodes)
+        self.roots = []
+
+        for node in self.nodes:
+            # A forum inside an unpublished forum becomes a root
+            parent = self.by_path.get(node.path[:-node.steplen])
+
+            if parent is not None:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, page_id):
+        return self.by_id.get(page_id)
+
+    def get_ancestors(self, page, inclusive=False):
+        """
+        Returns the forums above the page, top first
+        """
+        end = len(page.path) + (page.steplen if inclusive else 0)
+
+        return [
+            self.by_path[page.path[:i]]
+            for i in range(page.steplen, end, page.steplen)
+            if page.path[:i] in self.by_path
+        ]
+
+    def get_children(self, page):
+        node = self.by_path.get(page.path)
+
+        return list(node.children) if node is not None else []
+
+
+def build_forum_tree(site=None):
+    nodes = []
+
+    for model in get_forum_page_models(AbstractForumIndex):
+        indexes = model.objects.live()
+        if site is not None:
+            indexes = indexes.filter(path__startswith=site.root_page.path)
+
+        for values in indexes.values_list('id', 'path', 'depth', 'title', 'url_path', 'topic_count', 'reply_count', 'last_post_at', *LIMIT_FIELDS):
+            nodes.append(ForumNode(*values[:8], post_limits=dict(zip(LIMIT_NAMES, values[8:]))))
+
+    return ForumTree(nodes)
+
+
+def get_forum_tree(site=None):
+    """
+    Returns the ForumTree of the site (or of every site), from the cache if
+    it's there
+    """
+    cache_key = 'wagtailforums:tree:%s:%s' % (site.id if site is not None else 'all', cache.get_version(TREE_VERSION_KEY))
+
+    tree = cache.get_cache().get(cache_key)
+    if tree is None:
+        tree = build_forum_tree(site)
+        cache.get_cache().set(cache_key, tree, getattr(settings, 'WAGTAILFORUMS_FORUM_TREE_TIMEOUT', 60))
+
+    return tree
+
+
+def get_request_forum_tree(request):
+    """
+    Returns the forum tree of the request's site. It's kept on the request so
+    it's only fetched once.
+    """
+    if request is None:
+        return get_forum_tree()
+
+    try:
+        return request._wagtailforums_forum_tree
+    except AttributeError:
+        request._wagtailforums_forum_tree = get_forum_tree(getattr(request, 'site', None))
+        return request._wagtailforums_forum_tree
+
+
+def invalidate_forum_tree():
+    cache.bump_version(TREE_VERSION_KEY)
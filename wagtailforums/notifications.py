@@ -0,0 +1,195 @@
+"""
+Notifies subscribers of new posts.
+
+Posting only defers a task. The task works through the subscribers of the
+post's topic and forums in batches, claiming each subscription by setting
+its ``last_notified_at`` so that nobody is notified about the same topic or
+forum more than once per digest window, and passes the notifications to the
+backend set in WAGTAILFORUMS_NOTIFICATION_BACKEND.
+"""
+import datetime
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.mail import get_connection, EmailMessage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums import tasks
+from wagtailforums.models import AbstractFlatForumReply, AbstractForumTopic, ForumSubscription, get_ancestor_paths
+
+
+Notification = namedtuple('Notification', ['user', 'post', 'page'])
+
+
+class NotificationBackend(object):
+    def send(self, notifications):
+        raise NotImplementedError
+
+
+class EmailBackend(NotificationBackend):
+    """
+    Sends an email for each notification, over one connection per batch
+    """
+    def get_subject(self, notification):
+        return "New post in %s" % notification.page.title
+
+    def get_body(self, notification):
+        return "%s\n\n%s\n" % (notification.post.message, notification.post.full_url)
+
+    def send(self, notifications):
+        messages = [
+            EmailMessage(
+                self.get_subject(notification),
+                self.get_body(notification),
+                to=[notification.user.email],
+            )
+            for notification in notifications
+            if notification.user.email
+        ]
+
+        get_connection().send_messages(messages)
+
+
+class MemoryBackend(NotificationBackend):
+    """
+    Keeps notifications in ``MemoryBackend.outbox``. For tests.
+    """
+    outbox = []
+
+    def send(self, notifications):
+        self.outbox.extend(notifications)
+
+
+class FileBackend(NotificationBackend):
+    """
+    Appends notifications as JSON lines to the file in
+    WAGTAILFORUMS_NOTIFICATION_FILE_PATH
+    """
+    def send(self, notifications):
+        with open(settings.WAGTAILFORUMS_NOTIFICATION_FILE_PATH, 'a') as f:
+            for notification in notifications:
+                f.write(json.dumps({
+                    'user': notification.user.pk,
+                    'post': notification.post.pk,
+                    'page': notification.page.pk,
+                }) + '\n')
+
+
+_backends = {}
+
+
+def get_notification_backend(path=None):
+    if path is None:
+        path = getattr(settings, 'WAGTAILFORUMS_NOTIFICATION_BACKEND', 'wagtailforums.notifications.EmailBackend')
+
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+
+    return _backends[path]
+
+
+def get_batch_size():
+    return getattr(settings, 'WAGTAILFORUMS_NOTIFICATION_BATCH_SIZE', 500)
+
+
+def get_digest_window():
+    return datetime.timedelta(seconds=getattr(settings, 'WAGTAILFORUMS_NOTIFICATION_DIGEST_WINDOW', 3600))
+
+
+def get_subscribed_pages(post):
+    """
+    Returns the pages above the post, nearest first, keyed by id
+    """
+    paths = get_ancestor_paths(post)
+
+    return dict(
+        (page.id, page)
+        for page in Page.objects.filter(path__in=paths).order_by('-depth')
+    )
+
+
+def claim_batch(post, page_ids, after_id, notified_user_ids):
+    """
+    Claims the next batch of subscriptions that are due a notification.
+
+    Returns the notifications to send and the id to continue from (or None
+    when there are no more subscriptions).
+    """
+    cutoff = timezone.now() - get_digest_window()
+
+    with transaction.atomic():
+        subscriptions = list(
+            ForumSubscription.objects.select_for_update()
+            .filter(page_id__in=page_ids, id__gt=after_id)
+            .select_related('user')
+            .order_by('id')[:get_batch_size()]
+        )
+        if not subscriptions:
+            return [], None
+
+        claimed = []
+        for subscription in subscriptions:
+            if subscription.user_id == post.owner_id or subscription.user_id in notified_user_ids:
+                continue
+            if subscription.last_notified_at is not None and subscription.last_notified_at > cutoff:
+                continue
+
+            notified_user_ids.add(subscription.user_id)
+            claimed.append(subscription)
+
+        ForumSubscription.objects.filter(
+            Q(last_notified_at__isnull=True) | Q(last_notified_at__lte=cutoff),
+            id__in=[subscription.id for subscription in claimed],
+        ).update(last_notified_at=timezone.now())
+
+    return claimed, subscriptions[-1].id
+
+
+def notify_subscribers(post):
+    """
+    Sends notifications of the post to the subscribers of its topic and
+    forums. Users subscribed to more than one of these are notified once.
+    """
+    pages = get_subscribed_pages(post)
+    backend = get_notification_backend()
+    notified_user_ids = set()
+    after_id = 0
+
+    while after_id is not None:
+        claimed, after_id = claim_batch(post, list(pages.keys()), after_id, notified_user_ids)
+
+        if claimed:
+            backend.send([
+                Notification(subscription.user, post, pages[subscription.page_id])
+                for subscription in claimed
+            ])
+
+
+def subscribe(user, page):
+    ForumSubscription.objects.get_or_create(user=user, page=page)
+
+
+def post_created(post, published):
+    """
+    Called through the post_created signal. Subscribes the author to the
+    topic and sends notifications in a separate task.
+    """
+    if post.owner_id is not None:
+        if isinstance(post, AbstractFlatForumReply):
+            topic = post.get_topic()
+        elif isinstance(post, AbstractForumTopic):
+            topic = post
+        else:
+            topic = post.get_parent().specific
+
+        if isinstance(topic, AbstractForumTopic):
+            subscribe(post.owner, topic)
+
+    if published:
+        tasks.defer(notify_subscribers, post)
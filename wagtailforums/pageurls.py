@@ -0,0 +1,168 @@
+"""
+Builds the URLs of forum pages without going through Wagtail's URL
+resolution for each one.
+
+Page.url looks up the site root paths (from the cache) and reverses
+'wagtail_serve' every time it's used. The URLs of forum views also reverse a
+subpage route. A page of 50 posts with edit and delete links does this over a
+hundred times.
+
+Here the site root paths are looked up once per request, the prefix that
+Wagtail serves pages under is reversed once, and the suffix of each subpage
+route is worked out once per page type. After that a URL is a few string
+concatenations.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.core.urlresolvers import get_script_prefix, get_urlconf, reverse
+
+from wagtail.wagtailcore.models import Site
+
+
+_local = threading.local()
+
+
+@contextmanager
+def request_scope():
+    """
+    Site root paths are looked up once for everything inside this, rather
+    than once per URL. Forum views are run inside it.
+    """
+    if getattr(_local, 'in_scope', False):
+        yield
+        return
+
+    _local.in_scope = True
+    _local.root_paths = None
+
+    try:
+        yield
+    finally:
+        _local.in_scope = False
+        _local.root_paths = None
+
+
+def get_site_root_paths():
+    if not getattr(_local, 'in_scope', False):
+        return Site.get_site_root_paths()
+
+    if _local.root_paths is None:
+        _local.root_paths = Site.get_site_root_paths()
+
+    return _local.root_paths
+
+
+_serve_prefixes = {}
+
+
+def get_serve_prefix():
+    """
+    Returns the URL that Wagtail serves the site root page at. Pages are
+    served at this followed by their path from the root.
+    """
+    urlconf = get_urlconf()
+
+    # The script prefix can differ between requests (it comes from
+    # SCRIPT_NAME), only the part of the URL after it is cached
+    script_prefix = get_script_prefix()
+
+    if urlconf not in _serve_prefixes:
+        _serve_prefixes[urlconf] = reverse('wagtail_serve', args=('', ))[len(script_prefix):]
+
+    return script_prefix + _serve_prefixes[urlconf]
+
+
+def get_url_for_path(url_path, root_paths=None):
+    """
+    Returns the URL of the page with this url_path, in the same way as
+    Page.url
+    """
+    if root_paths is None:
+        root_paths = get_site_root_paths()
+
+    for site_id, root_path, root_url in root_paths:
+        if url_path.startswith(root_path):
+            return ('' if len(root_paths) == 1 else root_url) + get_serve_prefix() + url_path[len(root_path):]
+
+
+def get_parent_url(page):
+    """
+    Returns the URL of the page's parent, from the page's url_path rather
+    than by loading the parent
+    """
+    return get_url_for_path(page.url_path[:page.url_path.rstrip('/').rfind('/') + 1])
+
+
+def get_page_url(page, root_paths=None):
+    """
+    Returns the page's URL. It's kept on the page, alongside the url_path
+    it's for, by annotate_urls.
+    """
+    annotated = page.__dict__.get('_annotated_url')
+    if annotated is not None and annotated[0] == page.url_path:
+        return annotated[1]
+
+    return get_url_for_path(page.url_path, root_paths)
+
+
+def annotate_urls(posts):
+    """
+    Works out the URL of each post (and of the topic of flat replies) in one
+    go, so url, edit_url, delete_url, etc are just joined onto it.
+
+    Returns the posts as a list.
+    """
+    posts = list(posts)
+    root_paths = get_site_root_paths()
+
+    for post in posts:
+        page = post.get_topic() if hasattr(post, 'get_topic') else post
+        if '_annotated_url' not in page.__dict__:
+            page._annotated_url = (page.url_path, get_url_for_path(page.url_path, root_paths))
+
+    return posts
+
+
+# Route arguments are replaced with these when the suffix of a route is
+# worked out. They're digits so they match any route pattern.
+PLACEHOLDER = '7305912468'
+
+_subpage_formats = {}
+
+
+def get_subpage_format(page_class, name, arg_names):
+    """
+    Returns a format string for the URL of the route, relative to the page,
+    or None if one can't be made for it
+    """
+    key = (page_class, name, arg_names)
+
+    if key not in _subpage_formats:
+        placeholders = dict((arg_name, PLACEHOLDER + str(i)) for i, arg_name in enumerate(arg_names))
+        suffix = page_class.get_resolver().reverse(name, **placeholders).replace('{', '{{').replace('}', '}}')
+
+        for arg_name, placeholder in placeholders.items():
+            if suffix.count(placeholder) != 1:
+                suffix = None
+                break
+
+            suffix = suffix.replace(placeholder, '{' + arg_name + '}')
+
+        _subpage_formats[key] = suffix
+
+    return _subpage_formats[key]
+
+
+def get_subpage_suffix(page_class, name, kwargs):
+    """
+    Like RoutablePageMixin.reverse_subpage. The route is only reversed the
+    first time.
+    """
+    kwargs = dict((arg_name, str(value)) for arg_name, value in kwargs.items())
+
+    suffix_format = get_subpage_format(page_class, name, tuple(sorted(kwargs)))
+    if suffix_format is None:
+        return page_class.get_resolver().reverse(name, **kwargs)
+
+    return suffix_format.format(**kwargs)
@@ -0,0 +1,56 @@
+class PostPage(object):
+    """
+    A page of posts.
+
+    Unlike Django's Paginator, pages are selected by ranges of post_number
+    rather than with OFFSET, so fetching the last page of a huge thread is as
+    cheap as fetching the first.
+    """
+    def __init__(self, forum_page, posts, number, num_pages):
+        self.forum_page = forum_page
+        self.object_list = list(posts)
+        self.number = number
+        self.num_pages = num_pages
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return '<PostPage %s of %s>' % (self.number, self.num_pages)
+
+    def has_next(self):
+        return self.number < self.num_pages
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @property
+    def next_page_url(self):
+        if self.has_next():
+            return self.forum_page.get_page_url(self.next_page_number())
+
+    @property
+    def previous_page_url(self):
+        if self.has_previous():
+            return self.forum_page.get_page_url(self.previous_page_number())
+
+    @property
+    def last_page_url(self):
+        return self.forum_page.get_page_url(self.num_pages)
+
+    @property
+    def next_after(self):
+        """
+        The value to pass as ``?after=`` to continue from the end of this page
+        """
+        if self.object_list:
+            return self.object_list[-1].post_number
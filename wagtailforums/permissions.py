@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+from wagtail.wagtailcore.models import UserPagePermissionsProxy, PagePermissionTester
+
+
+PostPermissions = namedtuple('PostPermissions', ['can_edit', 'can_delete'])
+
+
+class ForumPermissionCache(object):
+    """
+    Answers page permission checks for a user from a single query of their
+    group page permissions. Permission testers are memoised by page path.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.user_perms = UserPagePermissionsProxy(user)
+        self.testers = {}
+
+        # UserPagePermissionsProxy holds a lazy queryset that would be run
+        # again by every PagePermissionTester created from it
+        if hasattr(self.user_perms, 'permissions'):
+            self.user_perms.permissions = list(self.user_perms.permissions)
+
+    def for_page(self, page):
+        if page.path not in self.testers:
+            self.testers[page.path] = PagePermissionTester(self.user_perms, page)
+
+        return self.testers[page.path]
+
+
+def get_permission_cache(user):
+    """
+    Returns the permission cache for this user.
+
+    The cache is stored on the user object so, for ``request.user``, it lasts
+    for as long as the request does.
+    """
+    try:
+        return user._wagtailforums_permission_cache
+    except AttributeError:
+        user._wagtailforums_permission_cache = ForumPermissionCache(user)
+        return user._wagtailforums_permission_cache
+
+
+def permissions_for_posts(user, posts):
+    """
+    Returns a dictionary of PostPermissions for each of the posts, keyed by
+    primary key
+    """
+    return {
+        post.pk: PostPermissions(
+            can_edit=post.user_can_edit(user),
+            can_delete=post.user_can_delete(user),
+        )
+        for post in posts
+    }
+
+
+def annotate_permissions(user, posts):
+    """
+    Sets ``user_permissions`` on each post so templates can show the
+    edit/delete links without calling methods
+    """
+    permissions = permissions_for_posts(user, posts)
+
+    for post in posts:
+        post.user_permissions = permissions[post.pk]
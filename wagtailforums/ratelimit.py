@@ -0,0 +1,177 @@
+"""
+Limits how often posts can be made and edited.
+
+Each forum can limit the posts (and, separately, the edits) made in it per
+user, per IP address and in total over a period of time. Forums that don't
+set a limit take it from the forum above them, and the top level forums take
+it from WAGTAILFORUMS_POST_LIMITS. The limits are read from the forum tree
+(see wagtailforums.navigation) so checking them doesn't load any pages.
+
+Hits are counted in a store, set with WAGTAILFORUMS_RATE_LIMIT_STORE:
+
+``CacheStore``
+    Sliding windows counted in the cache, shared by every process. This is
+    the default.
+``LocalStore``
+    Token buckets kept in the process. Avoids the cache round trips, but
+    each process counts separately so it only suits sites running one.
+
+Requests that go over a limit are counted too, so someone who keeps trying
+stays blocked.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from wagtailforums import cache, navigation
+
+
+DEFAULT_LIMITS = {
+    'per_user': None,
+    'per_ip': None,
+    'per_forum': None,
+    'period': 60,
+}
+
+
+class Store(object):
+    def hit(self, key, limit, period):
+        """
+        Counts a hit. Returns 0 if there have been no more than ``limit``
+        hits on the key in the last ``period`` seconds, otherwise roughly how
+        many seconds to wait before trying again.
+        """
+        raise NotImplementedError
+
+
+class CacheStore(Store):
+    """
+    Counts hits in the current and previous periods, and estimates the hits
+    in the last ``period`` seconds by assuming the previous period's were
+    spread evenly through it
+    """
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        elapsed = now - window * period
+
+        current_key = 'wagtailforums:ratelimit:%s:%d' % (key, window)
+        previous_key = 'wagtailforums:ratelimit:%s:%d' % (key, window - 1)
+
+        cache.get_cache().add(current_key, 0, period * 2)
+        try:
+            current = cache.get_cache().incr(current_key)
+        except ValueError:
+            # Evicted since it was added
+            cache.get_cache().set(current_key, 1, period * 2)
+            current = 1
+
+        previous = cache.get_cache().get(previous_key, 0)
+
+        if previous * (1 - elapsed / period) + current <= limit:
+            return 0
+
+        if current > limit:
+            return int(math.ceil(period - elapsed))
+
+        # Wait until enough of the previous period has slid out of the window
+        return max(int(math.ceil(period * (1 - float(limit - current) / previous) - elapsed)), 1)
+
+
+class LocalStore(Store):
+    """
+    A token bucket for each key, which holds ``limit`` tokens and is refilled
+    at ``limit`` tokens per ``period``
+    """
+    # Buckets that have refilled are dropped when there are more than this
+    max_buckets = 10000
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        rate = float(limit) / period
+
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (limit, now))
+            # Hits over the limit take tokens too, up to a period's worth
+            tokens = max(min(tokens + (now - updated_at) * rate, limit) - 1, -limit)
+            self.buckets[key] = (tokens, now)
+
+            if len(self.buckets) > self.max_buckets:
+                self.prune(now)
+
+        if tokens >= 0:
+            return 0
+
+        return int(math.ceil(-tokens / rate))
+
+    def prune(self, now):
+        for key, (tokens, updated_at) in list(self.buckets.items()):
+            if now - updated_at > 3600 or (tokens >= 0 and now - updated_at > 60):
+                del self.buckets[key]
+
+
+_stores = {}
+
+
+def get_store():
+    path = getattr(settings, 'WAGTAILFORUMS_RATE_LIMIT_STORE', 'wagtailforums.ratelimit.CacheStore')
+
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+
+    return _stores[path]
+
+
+def get_limits(page, request=None):
+    """
+    Returns the forum that the page is in (a node of the forum tree) and the
+    limits that apply there
+    """
+    forums = navigation.get_request_forum_tree(request).get_ancestors(page, inclusive=True)
+    limits = dict(DEFAULT_LIMITS, **getattr(settings, 'WAGTAILFORUMS_POST_LIMITS', {}))
+
+    # The nearest forum that sets each limit wins
+    for forum in forums:
+        limits.update((name, value) for name, value in forum.post_limits.items() if value is not None)
+
+    return forums[-1] if forums else None, limits
+
+
+def get_client_ip(request):
+    # Behind a proxy, set REMOTE_ADDR from the forwarded address in a middleware
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check(page, request, action):
+    """
+    Counts a post or edit (``action``) in the page by the user making the
+    request. Returns 0 if it's allowed, or the number of seconds to wait if
+    it goes over a limit.
+    """
+    forum, limits = get_limits(page, request)
+    if forum is None:
+        return 0
+
+    keys = []
+    if limits['per_user'] and request.user.is_authenticated():
+        keys.append(('user:%d' % request.user.pk, limits['per_user']))
+    if limits['per_ip']:
+        keys.append(('ip:%s' % get_client_ip(request), limits['per_ip']))
+    if limits['per_forum']:
+        keys.append(('forum', limits['per_forum']))
+
+    store = get_store()
+    for key, limit in keys:
+        # Later limits aren't counted against once one is hit
+        retry_after = store.hit('%s:%d:%s' % (action, forum.id, key), limit, limits['period'])
+        if retry_after:
+            return retry_after
+
+    return 0
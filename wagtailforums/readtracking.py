@@ -0,0 +1,205 @@
+"""
+Tracks which posts each user has read.
+
+Viewing a topic doesn't write to the database in the request. The new read
+position is added to a buffer in the process, and a task is passed to the
+executor to write the buffer out. Positions recorded while that task is
+waiting to run are merged into it, so with a background executor, views that
+arrive together are written in one go. Until it has run, positions in the
+buffer are merged into the read state that's shown.
+
+The task isn't deferred until the request's transaction commits. It doesn't
+depend on anything the request writes, and a deferred task that was thrown
+away with a rolled back transaction would leave the buffer waiting for a
+flush that never comes.
+"""
+import threading
+
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from wagtailforums import tasks
+from wagtailforums.models import ForumReadMarker, AbstractForumIndex
+
+
+def get_read_markers(user, pages):
+    """
+    Returns the markers of the user on the pages and on every page above
+    them, keyed by path. This is a single query.
+    """
+    paths = set()
+    for page in pages:
+        paths.update(page.path[:i] for i in range(page.steplen, len(page.path), page.steplen))
+
+    markers = ForumReadMarker.objects.filter(user=user).filter(
+        Q(page_id__in=[page.pk for page in pages]) | Q(page__path__in=paths)
+    )
+
+    return dict(
+        (path, (post_number, read_until))
+        for path, post_number, read_until in markers.values_list('page__path', 'post_number', 'read_until')
+    )
+
+
+def annotate_read_state(user, pages):
+    """
+    Sets these attributes on each page:
+
+    ``read_until``
+        Everything posted up to this time has been read (or None)
+    ``read_post_number``
+        The number of the last post the user read on the page (or None)
+    ``is_unread``
+        True if something has been posted since ``read_until``
+    """
+    markers = get_read_markers(user, pages)
+
+    for page in pages:
+        page.read_until = None
+        page.read_post_number = None
+
+        for i in range(page.steplen, len(page.path) + 1, page.steplen):
+            post_number, read_until = markers.get(page.path[:i], (None, None))
+
+            if read_until is not None and (page.read_until is None or read_until > page.read_until):
+                page.read_until = read_until
+
+            if i == len(page.path):
+                page.read_post_number = post_number
+
+        # Positions that haven't been written out yet
+        pending = buffer.get(user.pk, page.pk)
+        if pending is not None:
+            post_number, read_until = pending
+            page.read_post_number = max(page.read_post_number or 0, post_number)
+            page.read_until = max(page.read_until, read_until) if page.read_until is not None else read_until
+
+        last_post_at = getattr(page, 'last_post_at', None)
+        page.is_unread = last_post_at is not None and (page.read_until is None or last_post_at > page.read_until)
+
+
+class ReadMarkerBuffer(object):
+    """
+    Collects read positions and writes them out in batches
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flush_submitted = False
+
+    def add(self, user_id, page_id, post_number, read_until):
+        with self.lock:
+            key = (user_id, page_id)
+
+            if key in self.pending:
+                old_post_number, old_read_until = self.pending[key]
+                post_number = max(post_number, old_post_number)
+                read_until = max(read_until, old_read_until)
+
+            self.pending[key] = (post_number, read_until)
+
+            # One flush at a time is waiting, later positions join it
+            should_flush = not self.flush_submitted
+            self.flush_submitted = True
+
+        if should_flush:
+            tasks.get_executor().submit(self.flush)
+
+    def get(self, user_id, page_id):
+        with self.lock:
+            return self.pending.get((user_id, page_id))
+
+    def take_pending(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.flush_submitted = False
+
+        return pending
+
+    def flush(self):
+        pending = self.take_pending()
+        if not pending:
+            return
+
+        with transaction.atomic():
+            existing = dict(
+                ((marker.user_id, marker.page_id), marker)
+                for marker in ForumReadMarker.objects.select_for_update().filter(
+                    user_id__in=set(user_id for user_id, page_id in pending),
+                    page_id__in=set(page_id for user_id, page_id in pending),
+                )
+            )
+
+            new_markers = []
+            for (user_id, page_id), (post_number, read_until) in pending.items():
+                marker = existing.get((user_id, page_id))
+
+                if marker is None:
+                    new_markers.append(ForumReadMarker(
+                        user_id=user_id,
+                        page_id=page_id,
+                        post_number=post_number,
+                        read_until=read_until,
+                    ))
+                elif (marker.post_number or 0) < post_number or marker.read_until < read_until:
+                    ForumReadMarker.objects.filter(pk=marker.pk).update(
+                        post_number=max(marker.post_number or 0, post_number),
+                        read_until=max(marker.read_until, read_until),
+                    )
+
+            try:
+                with transaction.atomic():
+                    ForumReadMarker.objects.bulk_create(new_markers)
+            except IntegrityError:
+                # Another process created some of them first. Create the
+                # rest one at a time, dropping the ones that clash.
+                for marker in new_markers:
+                    try:
+                        with transaction.atomic():
+                            marker.save()
+                    except IntegrityError:
+                        pass
+
+
+buffer = ReadMarkerBuffer()
+
+
+def record_read(user, page, post_number, read_until):
+    """
+    Records that the user has read the page up to the post with this number
+    and posting time. Does nothing if they'd already read that far (this
+    expects annotate_read_state to have been called on the page).
+    """
+    if getattr(page, 'read_until', None) is not None and read_until <= page.read_until and post_number <= (page.read_post_number or 0):
+        return
+
+    buffer.add(user.pk, page.pk, post_number, read_until)
+
+
+def flush_read_markers():
+    buffer.flush()
+
+
+def mark_read(user, page):
+    """
+    Marks everything on the page as read, straight away.
+
+    On a forum, this replaces the markers of the user on topics below it.
+    """
+    now = timezone.now()
+    post_number = None if isinstance(page, AbstractForumIndex) else page.get_max_post_number()
+
+    with transaction.atomic():
+        updated = ForumReadMarker.objects.filter(user=user, page=page).update(post_number=post_number, read_until=now)
+
+        if not updated:
+            ForumReadMarker.objects.create(user=user, page=page, post_number=post_number, read_until=now)
+
+        if isinstance(page, AbstractForumIndex):
+            ForumReadMarker.objects.filter(
+                user=user,
+                page__path__startswith=page.path,
+                read_until__lte=now,
+            ).exclude(page=page).delete()
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.html import linebreaks
+from django.utils.module_loading import import_string
+
+
+class MessageRenderer(object):
+    """
+    Converts the markup that users write their posts in into HTML
+    """
+    def render(self, message):
+        raise NotImplementedError
+
+
+class PlainTextRenderer(MessageRenderer):
+    def render(self, message):
+        return linebreaks(message, autoescape=True)
+
+
+class MarkdownRenderer(MessageRenderer):
+    """
+    Markdown lets HTML through (safe_mode is gone from Markdown 3), so the
+    output is cleaned with bleach. Only these tags, attributes and URL
+    schemes are kept.
+    """
+    allowed_tags = [
+        'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+        'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 'strong', 'ul',
+    ]
+    allowed_attributes = {
+        'a': ['href', 'title'],
+        'abbr': ['title'],
+        'acronym': ['title'],
+        'img': ['src', 'alt', 'title'],
+    }
+    allowed_protocols = ['http', 'https', 'mailto']
+
+    def __init__(self):
+        try:
+            import markdown
+            import bleach
+        except ImportError:
+            raise ImproperlyConfigured("MarkdownRenderer requires the 'markdown' and 'bleach' packages to be installed")
+
+        self.markdown = markdown
+        self.bleach = bleach
+
+    def render(self, message):
+        return self.bleach.clean(
+            self.markdown.markdown(message),
+            tags=self.allowed_tags,
+            attributes=self.allowed_attributes,
+            protocols=self.allowed_protocols,
+            strip=True,
+        )
+
+
+class BBCodeRenderer(MessageRenderer):
+    def __init__(self):
+        try:
+            import bbcode
+        except ImportError:
+            raise ImproperlyConfigured("BBCodeRenderer requires the 'bbcode' package to be installed")
+
+        # The parser escapes any HTML in the message
+        self.parser = bbcode.Parser()
+
+    def render(self, message):
+        return self.parser.format(message)
+
+
+_renderers = {}
+
+
+def get_message_renderer(path=None):
+    if path is None:
+        path = getattr(settings, 'WAGTAILFORUMS_MESSAGE_RENDERER', 'wagtailforums.renderers.PlainTextRenderer')
+
+    if path not in _renderers:
+        _renderers[path] = import_string(path)()
+
+    return _renderers[path]
@@ -0,0 +1,377 @@
+"""
+The forum search index.
+
+Posts are split into terms which are stored in an inverted index
+(ForumSearchPosting) with one row per term per post. Searches look up the
+postings of the query's terms, which are indexed, and rank the posts they
+find with BM25 in Python. The number of postings loaded for each term is
+capped, and facets are counted in the database.
+
+The index is updated when posts are published, unpublished or deleted.
+"""
+import hashlib
+import heapq
+import json
+import math
+import re
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from wagtail.wagtailcore.models import Page, PageViewRestriction
+
+from wagtailforums import cache, pageurls
+from wagtailforums.models import AbstractForumIndex, ForumSearchDocument, ForumSearchPosting, get_specific_pages
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+    'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that', 'the',
+    'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will',
+    'with',
+])
+
+MAX_TERM_LENGTH = 64
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# How long the document count and average length are cached for. These only
+# shift the scores slightly as the index grows so don't need to be exact.
+INDEX_STATS_TIMEOUT = 300
+
+# The most postings that are loaded and scored for each term of a search.
+# Terms that appear in more posts than this only find the posts they appear
+# in most often.
+MAX_POSTINGS_PER_TERM = 5000
+
+# The most forums and authors that are counted in the facets of a search
+MAX_FACET_VALUES = 50
+
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_RE.findall(text.lower())
+        if token not in STOP_WORDS and len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def get_forum_ids(posts):
+    """
+    Returns a dict mapping the id of each post to the id of the nearest
+    forum index above it
+    """
+    paths = set()
+    for post in posts:
+        paths.update(post.path[:i] for i in range(post.steplen, len(post.path), post.steplen))
+
+    forum_paths = {}
+    for page_id, path, content_type_id in Page.objects.filter(path__in=paths).values_list('id', 'path', 'content_type_id'):
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+
+        if model is not None and issubclass(model, AbstractForumIndex):
+            forum_paths[path] = page_id
+
+    forum_ids = {}
+    for post in posts:
+        for i in range(len(post.path) - post.steplen, 0, -post.steplen):
+            if post.path[:i] in forum_paths:
+                forum_ids[post.pk] = forum_paths[post.path[:i]]
+                break
+
+    return forum_ids
+
+
+@transaction.atomic
+def index_posts(posts):
+    """
+    Adds the posts to the index, replacing any earlier versions of them
+    """
+    posts = [post for post in posts if post.live]
+    if not posts:
+        return
+
+    forum_ids = get_forum_ids(posts)
+
+    ForumSearchDocument.objects.filter(page_id__in=[post.pk for post in posts]).delete()
+
+    documents = []
+    postings = []
+    for post in posts:
+        terms = Counter(tokenize(post.title) + tokenize(post.message))
+
+        documents.append(ForumSearchDocument(
+            page_id=post.pk,
+            path=post.path,
+            forum_id=forum_ids.get(post.pk),
+            author_id=post.owner_id,
+            posted_at=post.get_posted_at() or post.first_published_at,
+            length=sum(terms.values()),
+        ))
+
+        postings.extend(
+            ForumSearchPosting(term=term, document_id=post.pk, frequency=frequency)
+            for term, frequency in terms.items()
+        )
+
+    ForumSearchDocument.objects.bulk_create(documents)
+    ForumSearchPosting.objects.bulk_create(postings)
+
+
+def index_post(post):
+    # This runs after the transaction that published the post has committed,
+    # check that the post hasn't been unpublished or deleted since
+    live_post = type(post).objects.filter(pk=post.pk, live=True).first()
+
+    if live_post is not None:
+        index_posts([live_post])
+
+    # Cached results were invalidated when the post was saved but may have
+    # been cached again from the old index since
+    cache.invalidate_page(post)
+
+
+def unindex_post(post):
+    ForumSearchDocument.objects.filter(page_id=post.pk).delete()
+    cache.invalidate_page(post)
+
+
+def get_index_stats():
+    """
+    Returns the number of documents in the index and their average length
+    """
+    cache_key = 'wagtailforums:search:stats'
+    stats = cache.get_cache().get(cache_key)
+
+    if stats is None:
+        stats = ForumSearchDocument.objects.aggregate(count=Count('page'), average_length=Avg('length'))
+        stats = (stats['count'], float(stats['average_length'] or 0))
+        cache.get_cache().set(cache_key, stats, INDEX_STATS_TIMEOUT)
+
+    return stats
+
+
+class SearchResults(object):
+    """
+    The ranked results of a search.
+
+    ``hits`` is a list of (page id, score) tuples, best first. ``facets`` holds
+    the number of matching posts in each forum and by each author.
+    """
+    def __init__(self, terms, hits, facets):
+        self.terms = terms
+        self.hits = hits
+        self.facets = facets
+
+    def __len__(self):
+        return len(self.hits)
+
+    def get_page(self, number, per_page):
+        """
+        Returns a paginator page of posts, with ``search_score`` and
+        ``search_snippet`` set on each of them
+        """
+        page = Paginator(self.hits, per_page).page(number)
+        hits = page.object_list
+
+        posts = get_specific_pages([page_id for page_id, score in hits])
+
+        page.object_list = []
+        for page_id, score in hits:
+            post = posts.get(page_id)
+
+            if post is not None:
+                post.search_score = score
+                post.search_snippet = highlight(post.message, self.terms)
+                page.object_list.append(post)
+
+        pageurls.annotate_urls(page.object_list)
+
+        return page
+
+
+def get_document_filter(prefix, scope=None, author=None, posted_after=None, posted_before=None, exclude_paths=()):
+    """
+    Returns a Q object that matches the search documents that pass the
+    filters of a search. ``prefix`` leads to the document from the model
+    being filtered.
+    """
+    q = Q()
+    if scope is not None:
+        q &= Q(**{prefix + 'path__startswith': scope.path})
+    if author is not None:
+        q &= Q(**{prefix + 'author': author})
+    if posted_after is not None:
+        q &= Q(**{prefix + 'posted_at__gte': posted_after})
+    if posted_before is not None:
+        q &= Q(**{prefix + 'posted_at__lt': posted_before})
+    for path in exclude_paths:
+        q &= ~Q(**{prefix + 'path__startswith': path})
+
+    return q
+
+
+def get_facet_counts(documents, field):
+    """
+    Returns the number of documents with each value of ``field``, for the
+    MAX_FACET_VALUES values with the most
+    """
+    counts = (
+        documents.exclude(**{field: None}).values_list(field)
+        .annotate(count=Count('pk', distinct=True)).order_by('-count', field)
+    )
+
+    return dict(counts[:MAX_FACET_VALUES])
+
+
+def search(query, scope=None, author=None, posted_after=None, posted_before=None, exclude_paths=(), limit=None):
+    """
+    Searches the posts in ``scope`` (or everywhere) for the terms in the
+    query. Results can be filtered to an author (a user or id) and to posts
+    made between two datetimes. Posts below any of ``exclude_paths`` are left
+    out.
+
+    Only the best ``limit`` results are kept. Each term is looked up in at
+    most MAX_POSTINGS_PER_TERM posts (or ``limit``, if that's more), those it
+    appears in most often. Facets count every match.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return SearchResults(terms, [], {'forum': {}, 'author': {}})
+
+    document_count, average_length = get_index_stats()
+
+    # Document frequencies are taken across the whole index so the same post
+    # scores the same in every scope
+    frequencies = dict(
+        ForumSearchPosting.objects.filter(term__in=terms)
+        .values_list('term').annotate(Count('document')).order_by()
+    )
+
+    filters = dict(scope=scope, author=author, posted_after=posted_after, posted_before=posted_before, exclude_paths=exclude_paths)
+
+    # Each term loads at most MAX_POSTINGS_PER_TERM postings, the ones where it
+    # appears most often, so a common term doesn't pull in the whole index
+    postings_per_term = max(limit or 0, MAX_POSTINGS_PER_TERM)
+
+    scores = {}
+    for term in terms:
+        # The document count is cached so may be behind the frequencies
+        document_frequency = frequencies.get(term, 0)
+        idf = math.log(1 + (max(document_count, document_frequency) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        postings = (
+            ForumSearchPosting.objects.filter(get_document_filter('document__', **filters), term=term)
+            .order_by('-frequency', '-document_id')
+            .values_list('document_id', 'frequency', 'document__length')[:postings_per_term]
+        )
+
+        for document_id, frequency, length in postings:
+            length_norm = 1 - B + B * length / average_length if average_length else 1
+            scores[document_id] = scores.get(document_id, 0) + idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+
+    # Ties go to the newest post
+    sort_key = lambda hit: (-hit[1], -hit[0])
+    if limit is not None and limit < len(scores):
+        hits = heapq.nsmallest(limit, scores.items(), key=sort_key)
+    else:
+        hits = sorted(scores.items(), key=sort_key)
+
+    # Facets are counted by the database, over every match
+    documents = ForumSearchDocument.objects.filter(get_document_filter('', **filters), postings__term__in=terms)
+    facets = {
+        'forum': get_facet_counts(documents, 'forum_id'),
+        'author': get_facet_counts(documents, 'author_id'),
+    }
+
+    return SearchResults(terms, hits, facets)
+
+
+def get_hidden_paths(scope, passed_restrictions=()):
+    """
+    Returns the paths of the pages below ``scope`` whose descendants
+    shouldn't appear in results. These are the unpublished pages, which hide
+    the posts below them, and those with view restrictions that haven't been
+    passed. Paths below other hidden paths are left out.
+    """
+    paths = set(Page.objects.descendant_of(scope).filter(live=False, numchild__gt=0).values_list('path', flat=True))
+    paths.update(
+        PageViewRestriction.objects.filter(page__path__startswith=scope.path)
+        .exclude(id__in=passed_restrictions).values_list('page__path', flat=True)
+    )
+
+    hidden_paths = []
+    for path in sorted(paths):
+        if not hidden_paths or not path.startswith(hidden_paths[-1]):
+            hidden_paths.append(path)
+
+    return hidden_paths
+
+
+def cached_search(query, scope, timeout=300, **kwargs):
+    """
+    Runs ``search`` and caches the ranked ids of the results.
+
+    Entries are keyed on the version of ``scope`` so they're replaced when
+    anything inside it changes, and on every argument, including the hidden
+    paths, so users that can see different pages don't share results.
+    """
+    params = dict(kwargs, terms=sorted(set(tokenize(query))))
+    for name in ('posted_after', 'posted_before'):
+        if params.get(name) is not None:
+            params[name] = params[name].isoformat()
+    if hasattr(params.get('author'), 'pk'):
+        params['author'] = params['author'].pk
+
+    cache_key = 'wagtailforums:search:%d:%s:%s' % (
+        scope.id,
+        cache.get_page_version(scope),
+        hashlib.md5(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest(),
+    )
+
+    cached = cache.get_cache().get(cache_key)
+    if cached is not None:
+        return SearchResults(*cached)
+
+    results = search(query, scope=scope, **kwargs)
+    cache.get_cache().set(cache_key, (results.terms, results.hits, results.facets), timeout)
+
+    return results
+
+
+def highlight(text, terms, length=200):
+    """
+    Returns an HTML snippet of the text around the first match, with the
+    matches wrapped in <mark> tags
+    """
+    if not terms:
+        return escape(text[:length])
+
+    terms_re = re.compile(r'\b(%s)\b' % '|'.join(re.escape(term) for term in terms), re.IGNORECASE | re.UNICODE)
+
+    match = terms_re.search(text)
+    start = max(match.start() - length // 4, 0) if match else 0
+    snippet = text[start:start + length]
+
+    html = []
+    position = 0
+    for match in terms_re.finditer(snippet):
+        html.append(escape(snippet[position:match.start()]))
+        html.append('<mark>' + escape(match.group()) + '</mark>')
+        position = match.end()
+    html.append(escape(snippet[position:]))
+
+    if start > 0:
+        html.insert(0, '&hellip;')
+    if start + length < len(text):
+        html.append('&hellip;')
+
+    return mark_safe(''.join(html))
@@ -0,0 +1,82 @@
+from django.db.models.signals import post_save, pre_delete, post_delete
+
+from wagtail.wagtailcore.models import Page, Site
+from wagtail.wagtailcore.signals import page_published, page_unpublished
+
+from wagtailforums import cache, navigation, notifications, search, stats, tasks
+from wagtailforums.models import AbstractForumIndex, AbstractForumPost, get_flat_reply_models, get_forum_page_models
+from wagtailforums.signals import post_created
+
+
+def page_published_signal_handler(sender, instance, **kwargs):
+    if issubclass(sender, AbstractForumPost):
+        stats.post_published(instance)
+        tasks.defer(search.index_post, instance)
+
+
+def page_unpublished_signal_handler(sender, instance, **kwargs):
+    if issubclass(sender, AbstractForumPost):
+        # Pages that are being deleted are taken off the statistics together
+        if not stats.is_being_deleted(instance):
+            stats.post_unpublished(instance)
+
+        tasks.defer(search.unindex_post, instance)
+
+
+def post_save_signal_handler(sender, instance, **kwargs):
+    # Invalidating before the transaction commits would let another request
+    # cache the old version of the page again
+    tasks.defer(cache.invalidate_page, instance)
+
+
+def pre_delete_signal_handler(sender, instance, **kwargs):
+    stats.page_deleting(instance)
+
+
+def post_delete_signal_handler(sender, instance, **kwargs):
+    stats.pages_deleted()
+    tasks.defer(cache.invalidate_page, instance)
+
+
+def flat_reply_post_save_signal_handler(sender, instance, **kwargs):
+    # Flat replies don't have revisions, saving one publishes it
+    if instance.live:
+        stats.post_published(instance)
+    else:
+        stats.post_unpublished(instance)
+
+    tasks.defer(cache.invalidate_page, instance.topic)
+
+
+def flat_reply_post_delete_signal_handler(sender, instance, **kwargs):
+    stats.pages_deleted()
+    tasks.defer(cache.invalidate_page, instance.topic)
+
+
+def forum_tree_changed_signal_handler(sender, instance, **kwargs):
+    tasks.defer(navigation.invalidate_forum_tree)
+
+
+def post_created_signal_handler(sender, instance, published, **kwargs):
+    notifications.post_created(instance, published)
+
+
+def register_signal_handlers():
+    page_published.connect(page_published_signal_handler)
+    post_created.connect(post_created_signal_handler)
+    page_unpublished.connect(page_unpublished_signal_handler)
+
+    for model in get_forum_page_models():
+        post_save.connect(post_save_signal_handler, sender=model)
+        pre_delete.connect(pre_delete_signal_handler, sender=model)
+        post_delete.connect(post_delete_signal_handler, sender=model)
+
+    # Pages are saved as Page when they're moved
+    for model in get_forum_page_models(AbstractForumIndex) + [Page, Site]:
+        post_save.connect(forum_tree_changed_signal_handler, sender=model)
+        post_delete.connect(forum_tree_changed_signal_handler, sender=model)
+
+    for model in get_flat_reply_models():
+        post_save.connect(flat_reply_post_save_signal_handler, sender=model)
+        pre_delete.connect(pre_delete_signal_handler, sender=model)
+        post_delete.connect(flat_reply_post_delete_signal_handler, sender=model)
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+
+# These are sent through the task executor once the post has been committed
+# so expensive receivers (notifications, indexing, etc) don't hold up the
+# request that made the post.
+post_created = Signal(providing_args=['instance', 'revision', 'published'])
+post_edited = Signal(providing_args=['instance', 'revision'])
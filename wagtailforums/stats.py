@@ -0,0 +1,233 @@
+import threading
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Q
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums import cache, tasks
+from wagtailforums.models import (
+    AbstractFlatForumReply, AbstractForumIndex, AbstractForumTopic, get_ancestor_paths, get_last_post_fields, get_post_time
+)
+
+
+def get_stats_ancestors(post):
+    """
+    Returns a list of (model, ids) pairs for the topics and forum indexes
+    above the post.
+
+    Ancestors are found by path so this still works for a post that has just
+    been deleted.
+    """
+    paths = get_ancestor_paths(post)
+
+    ancestors = {}
+    for page_id, content_type_id in Page.objects.filter(path__in=paths).values_list('id', 'content_type_id'):
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+
+        if model is not None and issubclass(model, (AbstractForumIndex, AbstractForumTopic)):
+            ancestors.setdefault(model, []).append(page_id)
+
+    return ancestors.items()
+
+
+def get_count_field(model, post):
+    if issubclass(model, AbstractForumIndex) and isinstance(post, AbstractForumTopic):
+        return 'topic_count'
+
+    return 'reply_count'
+
+
+def post_published(post):
+    # Publishing an edit fires the same signal, make sure each post only gets counted once
+    if not type(post).objects.filter(pk=post.pk, stats_counted=False).update(stats_counted=True):
+        return
+
+    post.stats_counted = True
+
+    # Every post updates the rows of the forums above it, so doing this in
+    # the posting transaction would make all posts wait for the top forum's
+    # row lock. It's done after the post has been committed instead.
+    tasks.defer(count_post, post)
+
+
+def count_post(post):
+    """
+    Adds a published post to the statistics of its topic and forums, in one
+    short transaction. The cached views of the post and the pages above it
+    are invalidated once the counts are committed.
+    """
+    with transaction.atomic():
+        # Unpublished or deleted since
+        if not type(post).objects.filter(pk=post.pk, stats_counted=True).exists():
+            return
+
+        last_post_fields = get_last_post_fields(post)
+        is_latest = Q(last_post_at__isnull=True) | Q(last_post_at__lte=last_post_fields['last_post_at'])
+
+        if isinstance(post, AbstractForumTopic):
+            type(post).objects.filter(is_latest, pk=post.pk).update(**last_post_fields)
+
+        for model, ids in get_stats_ancestors(post):
+            count_field = get_count_field(model, post)
+            model.objects.filter(pk__in=ids).update(**{count_field: F(count_field) + 1})
+            model.objects.filter(is_latest, pk__in=ids).update(**last_post_fields)
+
+    # The views were invalidated when the post was saved, but may have been
+    # cached again with the old counts since
+    cache.invalidate_page(post.get_topic() if isinstance(post, AbstractFlatForumReply) else post)
+
+
+def post_removed(post):
+    post.stats_counted = False
+
+    for model, ids in get_stats_ancestors(post):
+        count_field = get_count_field(model, post)
+        model.objects.filter(pk__in=ids, **{count_field + '__gt': 0}).update(**{count_field: F(count_field) - 1})
+
+        # Pages that were showing this post as their latest need to find a new one.
+        # If the post is being deleted, its last_post references have already been
+        # nulled but its page row may still be there.
+        if isinstance(post, AbstractFlatForumReply):
+            # Flat replies are recorded as their topic, at the time of the reply
+            lost_last_post = Q(last_post_id=post.topic_id, last_post_at=get_post_time(post))
+        else:
+            lost_last_post = Q(last_post_id=post.pk) | Q(last_post__isnull=True, last_post_at__isnull=False)
+        for page in model.objects.filter(lost_last_post, pk__in=ids):
+            page.rebuild_stats(exclude_post=post)
+
+
+def post_unpublished(post):
+    if type(post).objects.filter(pk=post.pk, stats_counted=True).update(stats_counted=False):
+        post_removed(post)
+
+
+_local = threading.local()
+
+
+def get_deletion():
+    if not hasattr(_local, 'deletion'):
+        _local.deletion = {'pages': {}, 'handled': True}
+
+    return _local.deletion
+
+
+def get_deletion_key(page):
+    # A page whose model inherits from another forum page model is sent for
+    # each of them, so pages are keyed on their Page id
+    if isinstance(page, AbstractFlatForumReply):
+        return (type(page), page.pk)
+
+    return (Page, page.pk)
+
+
+def page_deleting(page):
+    """
+    Called before a forum page or flat reply is deleted.
+
+    Deleting a page deletes the pages below it as well, and Django sends
+    pre_delete for all of them before it sends any post_delete. The pages
+    are collected here so the deletion can be taken off the statistics in one
+    go once it has started (see pages_deleted).
+    """
+    deletion = get_deletion()
+    if deletion['handled']:
+        # The first page of a new deletion
+        deletion['pages'] = {}
+        deletion['handled'] = False
+
+    deletion['pages'].setdefault(get_deletion_key(page), page)
+
+
+def is_being_deleted(page):
+    """
+    Returns True if the page is part of a deletion that hasn't been taken off
+    the statistics yet. Wagtail unpublishes the pages it deletes, which would
+    otherwise take each of them off the statistics again.
+    """
+    deletion = get_deletion()
+    return not deletion['handled'] and get_deletion_key(page) in deletion['pages']
+
+
+def pages_deleted():
+    """
+    Called after each forum page or flat reply is deleted. The first call of
+    a deletion takes every page that's being deleted off the statistics.
+    """
+    deletion = get_deletion()
+    if deletion['handled']:
+        return
+
+    deletion['handled'] = True
+    pages, deletion['pages'] = deletion['pages'], {}
+
+    remove_branches(list(pages.values()))
+
+
+def remove_branches(pages):
+    """
+    Takes the counted posts among the pages off the statistics of the pages
+    above them. Each branch that's being deleted is handled once, from its
+    top page, rather than once for each post in it.
+    """
+    page_paths = dict((page.pk, page.path) for page in pages if not isinstance(page, AbstractFlatForumReply))
+    deleted_paths = set(page_paths.values())
+
+    roots = dict(
+        (page.path, page) for page in pages
+        if not isinstance(page, AbstractFlatForumReply)
+        and not any(page.path[:i] in deleted_paths for i in range(Page.steplen, len(page.path), Page.steplen))
+    )
+    branches = dict((path, []) for path in roots)
+
+    for page in pages:
+        # Flat replies are in the branch of their topic, if that's being
+        # deleted too, and are a branch of their own if not
+        path = page_paths.get(page.topic_id) if isinstance(page, AbstractFlatForumReply) else page.path
+        if path is None:
+            remove_branch(page, [page])
+            continue
+
+        for i in range(Page.steplen, len(path) + 1, Page.steplen):
+            if path[:i] in branches:
+                branches[path[:i]].append(page)
+                break
+
+    for path, branch in branches.items():
+        remove_branch(roots[path], branch)
+
+
+def remove_branch(root, posts):
+    """
+    Takes the posts, which are being deleted with ``root``, off the
+    statistics of the pages above ``root``
+    """
+    # Posts that weren't counted aren't on the statistics
+    posts = [post for post in posts if getattr(post, 'stats_counted', False)]
+    if not posts:
+        return
+
+    topic_count = len([post for post in posts if isinstance(post, AbstractForumTopic)])
+    counts = {'topic_count': topic_count, 'reply_count': len(posts) - topic_count}
+
+    if isinstance(root, AbstractFlatForumReply):
+        # Flat replies are recorded as their topic, at the time of the reply
+        lost_last_post = Q(last_post_id=root.topic_id, last_post_at=get_post_time(root))
+    else:
+        # Pages showing one of the posts as their latest have had their
+        # last_post nulled by now, but the post ids are checked too as the
+        # page rows may still be there
+        lost_last_post = Q(last_post_id__in=[post.pk for post in posts]) | Q(last_post__isnull=True, last_post_at__isnull=False)
+
+    for model, ids in get_stats_ancestors(root):
+        for count_field, count in counts.items():
+            if count and (count_field == 'reply_count' or issubclass(model, AbstractForumIndex)):
+                model.objects.filter(pk__in=ids, **{count_field + '__gte': count}).update(**{count_field: F(count_field) - count})
+                model.objects.filter(pk__in=ids, **{count_field + '__lt': count}).update(**{count_field: 0})
+
+        for page in model.objects.filter(lost_last_post, pk__in=ids):
+            if isinstance(root, AbstractFlatForumReply):
+                page.rebuild_stats(exclude_post=root)
+            else:
+                page.rebuild_stats(exclude_path=root.path)
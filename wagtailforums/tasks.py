@@ -0,0 +1,182 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils.module_loading import import_string
+from django.utils.six.moves import queue
+
+
+logger = logging.getLogger('wagtailforums')
+
+
+class SynchronousExecutor(object):
+    """
+    Runs tasks straight away, in the current thread. This is the one to use
+    in tests.
+    """
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class ThreadPoolExecutor(object):
+    """
+    Runs tasks in a pool of background threads inside the web process. This
+    is the default, so posting doesn't wait for notifications to be sent.
+    Tasks that haven't run yet are lost if the process exits.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or getattr(settings, 'WAGTAILFORUMS_TASK_WORKERS', 4)
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        self.start_workers()
+        self.queue.put((func, args, kwargs))
+
+    def start_workers(self):
+        if len(self.workers) >= self.max_workers:
+            return
+
+        with self.lock:
+            while len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self.work, name='wagtailforums-worker-%d' % len(self.workers))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Forum task %r failed", func)
+            finally:
+                # Worker threads have their own database connections
+                close_old_connections()
+                self.queue.task_done()
+
+    def join(self):
+        """
+        Blocks until every task that has been submitted has finished
+        """
+        self.queue.join()
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        executor_class = import_string(getattr(settings, 'WAGTAILFORUMS_TASK_EXECUTOR', 'wagtailforums.tasks.ThreadPoolExecutor'))
+        _executor = executor_class()
+
+    return _executor
+
+
+_local = threading.local()
+
+
+def get_pending_tasks():
+    if not hasattr(_local, 'pending'):
+        _local.pending = []
+
+    return _local.pending
+
+
+def get_atomic_depth():
+    """
+    Returns how many atomic blocks the default connection is inside
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return 0
+
+    return len(connection.savepoint_ids) + 1
+
+
+def start_request():
+    """
+    Called by TaskMiddleware before the view runs. Tasks deferred inside a
+    transaction that the view runs in (such as the one ATOMIC_REQUESTS opens)
+    are held until finish_request.
+    """
+    _local.request_depth = get_atomic_depth()
+    _local.awaiting_commit = []
+
+
+def finish_request(committed):
+    """
+    Called by TaskMiddleware once the view's transaction has finished.
+    Tasks held for it are run if it committed and thrown away if not.
+    """
+    awaiting_commit = getattr(_local, 'awaiting_commit', [])
+    _local.request_depth = None
+    _local.awaiting_commit = []
+
+    if committed:
+        submit_all(awaiting_commit)
+
+
+def in_request_transaction():
+    request_depth = getattr(_local, 'request_depth', None)
+    return request_depth is not None and get_atomic_depth() > request_depth
+
+
+def submit_all(tasks):
+    executor = get_executor()
+
+    for func, args, kwargs in tasks:
+        executor.submit(func, *args, **kwargs)
+
+
+@contextmanager
+def post_commit():
+    """
+    Runs the block in a transaction. Tasks deferred inside it are passed to
+    the executor once it has committed, and are thrown away if it rolls back.
+
+    If this is nested in another post_commit block, the tasks wait for the
+    outer block. If it's inside the view's transaction (for example, with
+    ATOMIC_REQUESTS) and TaskMiddleware is installed, they wait for that
+    transaction to commit.
+    """
+    pending = get_pending_tasks()
+    tasks = []
+    pending.append(tasks)
+
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        pending.pop()
+
+    if pending:
+        # Let the outer block run them
+        pending[-1].extend(tasks)
+    elif in_request_transaction():
+        _local.awaiting_commit.extend(tasks)
+    else:
+        submit_all(tasks)
+
+
+def defer(func, *args, **kwargs):
+    """
+    Runs a task once the current post_commit block (or the view's
+    transaction) has committed, or passes it to the executor straight away if
+    there isn't one.
+    """
+    pending = get_pending_tasks()
+
+    if pending:
+        pending[-1].append((func, args, kwargs))
+    elif in_request_transaction():
+        _local.awaiting_commit.append((func, args, kwargs))
+    else:
+        get_executor().submit(func, *args, **kwargs)
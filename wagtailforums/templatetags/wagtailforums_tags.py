@@ -0,0 +1,46 @@
+from django import template
+
+from wagtailforums import navigation, pageurls
+
+
+register = template.Library()
+
+
+@register.assignment_tag(takes_context=True)
+def get_forum_tree(context):
+    """
+    {% get_forum_tree as tree %}
+
+    The ForumTree of the current site. ``tree.roots`` are the top level
+    forums, each with its ``children``.
+    """
+    return navigation.get_request_forum_tree(context.get('request'))
+
+
+@register.assignment_tag(takes_context=True)
+def get_forum_breadcrumbs(context, page):
+    """
+    {% get_forum_breadcrumbs self as breadcrumbs %}
+
+    The forums above the page, top first, including the page if it's a forum
+    """
+    return navigation.get_request_forum_tree(context.get('request')).get_ancestors(page, inclusive=True)
+
+
+@register.assignment_tag(takes_context=True)
+def get_subforums(context, page):
+    """
+    {% get_subforums self as subforums %}
+    """
+    return navigation.get_request_forum_tree(context.get('request')).get_children(page)
+
+
+@register.assignment_tag
+def annotate_urls(posts):
+    """
+    {% annotate_urls posts as post_list %}
+
+    Works out the URLs of the posts together, so their url, edit_url and
+    delete_url are quick to render. Returns them as a list.
+    """
+    return pageurls.annotate_urls(posts)
@@ -0,0 +1,59 @@
+"""
+Finds and keeps the templates of the forum sub-views.
+
+Each view (``new_post``, ``edit``, ``search``, etc) renders the page's
+template with the view name added (``test/forum_topic_new_post.html``) if
+there is one, and ``wagtailforums/<view name>.html`` otherwise. The names
+are worked out once per page type.
+
+When WAGTAILFORUMS_CACHE_TEMPLATES is on (the default when DEBUG is off) the
+templates are loaded when Django starts and kept, so no request goes through
+the template loaders for them. This also means a broken forum template stops
+the site from starting rather than failing on a request.
+"""
+import os
+
+from django.conf import settings
+from django.template import loader
+
+
+SUB_VIEWS = ('new_post', 'edit', 'delete', 'search', 'edit_reply', 'delete_reply', 'rate_limited')
+
+
+def get_template_name(main_template_name, view_name):
+    root, ext = os.path.splitext(main_template_name)
+    return root + '_' + view_name + ext
+
+
+def build_template_names(page_class):
+    """
+    Returns the template names to try for each sub-view of the page type,
+    most specific first
+    """
+    return dict(
+        (view_name, (get_template_name(page_class.template, view_name), 'wagtailforums/%s.html' % view_name))
+        for view_name in SUB_VIEWS
+    )
+
+
+def get_cache_templates():
+    return getattr(settings, 'WAGTAILFORUMS_CACHE_TEMPLATES', not settings.DEBUG)
+
+
+_templates = {}
+
+
+def get_template(template_names):
+    if not get_cache_templates():
+        return loader.select_template(template_names)
+
+    if template_names not in _templates:
+        _templates[template_names] = loader.select_template(template_names)
+
+    return _templates[template_names]
+
+
+def preload_templates(page_classes):
+    for page_class in page_classes:
+        for template_names in page_class.get_view_template_names().values():
+            get_template(template_names)
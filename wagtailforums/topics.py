@@ -0,0 +1,433 @@
+"""
+Moderation operations on whole topics: closing, moving, merging and
+splitting them.
+
+Wagtail's page move reloads the page, saves it and sends signals, and
+doesn't know about the forum statistics or the search index. These work on
+the tables directly instead, with as few statements as possible:
+
+- Moving a topic rewrites the path, depth and url_path of the topic and its
+  replies with one UPDATE that swaps their prefix
+- Merging and splitting renumber the replies with one UPDATE, and give each
+  one its new path, slug and url_path with one statement executed for all of
+  them. Flat replies are moved with one UPDATE.
+- The revisions of renumbered pages are rewritten to match, as publishing
+  one takes the post number, title and slug of the page from it
+
+The forum statistics of the topics and forums involved are then rebuilt,
+which is a few aggregate queries each.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F
+from django.utils.encoding import force_text
+
+from wagtail.wagtailcore.models import Page, PageRevision
+
+from wagtailforums import cache, navigation, tasks
+from wagtailforums.models import (
+    AbstractFlatForumReply, AbstractForumIndex, AbstractForumTopic, ForumPostCounter, ForumSearchDocument, ForumSubscription,
+    get_ancestor_paths, get_forum_page_models, get_post_time
+)
+
+
+class TopicOperationError(Exception):
+    pass
+
+
+def sql_replace_prefix(column, length):
+    """
+    Returns SQL for the value of ``column`` with its first ``length``
+    characters replaced with a parameter
+    """
+    if connection.vendor == 'mysql':
+        return "CONCAT(%%s, SUBSTR(%s, %d))" % (column, length + 1)
+
+    # sqlite needs the length of the substring
+    return "%%s || SUBSTR(%s, %d, LENGTH(%s))" % (column, length + 1, column)
+
+
+def move_branch(old_path, new_path, old_url_path, new_url_path):
+    """
+    Moves a page and its descendants to a new path, in one statement
+    """
+    depth_change = (len(new_path) - len(old_path)) // Page.steplen
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE %s SET path = %s, depth = depth + %%s, url_path = %s WHERE path LIKE %%s" % (
+                connection.ops.quote_name(Page._meta.db_table),
+                sql_replace_prefix('path', len(old_path)),
+                sql_replace_prefix('url_path', len(old_url_path)),
+            ),
+            [new_path, depth_change, new_url_path, old_path + '%']
+        )
+        cursor.execute(
+            "UPDATE %s SET path = %s WHERE path LIKE %%s" % (
+                connection.ops.quote_name(ForumSearchDocument._meta.db_table),
+                sql_replace_prefix('path', len(old_path)),
+            ),
+            [new_path, old_path + '%']
+        )
+
+
+def update_revisions(changes):
+    """
+    Rewrites the revisions of pages that were renumbered with the UPDATEs
+    here. Publishing a revision (approving it in the moderation queue, for
+    example) takes the page's fields from the revision, and would put back
+    the old post number, title and slug otherwise.
+
+    ``changes`` maps page ids to tuples of
+    ``(old_number, new_number, old_slug, new_slug, new_path, new_url_path)``.
+    """
+    revision_updates = []
+    for revision_id, page_id, content_json in PageRevision.objects.filter(page_id__in=changes).values_list('id', 'page_id', 'content_json'):
+        old_number, new_number, old_slug, new_slug, new_path, new_url_path = changes[page_id]
+
+        content = json.loads(content_json)
+        title, slug = renumber_slug(content['title'], content['slug'], old_number, new_number)
+        content['title'] = title
+        content['slug'] = new_slug if content['slug'] == old_slug else slug
+        content['post_number'] = new_number
+        content['path'] = new_path
+        content['url_path'] = new_url_path
+        revision_updates.append((json.dumps(content, cls=DjangoJSONEncoder), revision_id))
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE %s SET content_json = %%s WHERE id = %%s" % connection.ops.quote_name(PageRevision._meta.db_table),
+            revision_updates
+        )
+
+
+def recount_children(paths):
+    for path in paths:
+        numchild = Page.objects.filter(path__startswith=path, depth=len(path) // Page.steplen + 1).count()
+        Page.objects.filter(path=path).update(numchild=numchild)
+
+
+def get_forum(page):
+    """
+    Returns the forum index that the page is in
+    """
+    forum = Page.objects.filter(path__in=get_ancestor_paths(page)).type(AbstractForumIndex).order_by('-path').first()
+    if forum is None:
+        raise TopicOperationError("%s isn't in a forum" % page.title)
+
+    return forum.specific
+
+
+def rebuild_stats(topics, paths):
+    """
+    Rebuilds the statistics of the topics and of the forums above the paths.
+    Their cached views are invalidated by rebuild_stats.
+    """
+    for topic in topics:
+        topic.rebuild_stats()
+
+    forum_paths = set()
+    for path in paths:
+        forum_paths.update(path[:i] for i in range(Page.steplen, len(path), Page.steplen))
+
+    for forum in Page.objects.filter(path__in=forum_paths).type(AbstractForumIndex).order_by('-path'):
+        forum.specific.rebuild_stats()
+
+    tasks.defer(navigation.invalidate_forum_tree)
+
+
+def close_topics(topics, closed=True):
+    """
+    Closes (or, with ``closed=False``, reopens) the topics. Closed topics only
+    take posts from users that can publish in them.
+    """
+    topic_ids = set(topic.pk for topic in topics)
+
+    with tasks.post_commit():
+        for model in get_forum_page_models(AbstractForumTopic):
+            model.objects.filter(pk__in=topic_ids).update(closed=closed)
+
+        for topic in topics:
+            topic.closed = closed
+            tasks.defer(cache.invalidate_page, topic)
+
+
+def move_topic(topic, forum):
+    """
+    Moves the topic, with its replies, into another forum
+    """
+    if not isinstance(forum, AbstractForumIndex):
+        raise TopicOperationError("Topics can only be moved into forums")
+    if topic.path[:-topic.steplen] == forum.path:
+        return
+
+    old_path = topic.path
+    old_parent_path = topic.path[:-topic.steplen]
+
+    with tasks.post_commit():
+        # The topic is numbered after the topics already in the forum
+        post_number = forum.get_next_post_number()
+        title, slug = renumber_slug(topic.title, topic.slug, topic.post_number, post_number)
+        if Page.objects.child_of(forum).filter(slug=slug).exists():
+            raise TopicOperationError("%s already has a page with the slug '%s'" % (forum.title, slug))
+
+        new_path = Page._get_path(forum.path, forum.depth + 1, ForumPostCounter.objects.reserve_child_steps(forum, 1))
+        new_url_path = forum.url_path + slug + '/'
+
+        move_branch(topic.path, new_path, topic.url_path, new_url_path)
+        recount_children([old_parent_path, forum.path])
+
+        Page.objects.filter(pk=topic.pk).update(title=title, slug=slug)
+        type(topic).objects.filter(pk=topic.pk).update(post_number=post_number)
+        update_revisions({topic.pk: (topic.post_number, post_number, topic.slug, slug, new_path, new_url_path)})
+
+        topic.path = new_path
+        topic.depth = forum.depth + 1
+        topic.url_path = new_url_path
+        topic.title, topic.slug, topic.post_number = title, slug, post_number
+
+        # The replies are in the new forum now
+        ForumSearchDocument.objects.filter(path__startswith=new_path).update(forum=forum)
+
+        rebuild_stats([], [old_path, new_path])
+        tasks.defer(cache.invalidate_page, Page.objects.get(path=old_parent_path))
+
+
+def renumber_slug(title, slug, old_number, new_number):
+    """
+    Returns the title and slug of a reply that's given a new post number. The
+    post number at the start of the slug is changed, and so is the title if
+    it's just the number.
+    """
+    if old_number is None:
+        return title, slug
+
+    old_number, new_number = str(old_number), str(new_number)
+
+    if title == old_number:
+        title = new_number
+    if slug == old_number or slug.startswith(old_number + '-'):
+        slug = new_number + slug[len(old_number):]
+
+    return title, slug
+
+
+def move_replies(source, target, number_offset, min_post_number=None):
+    """
+    Moves the replies of ``source`` (those numbered ``min_post_number`` and
+    above, if it's given) to ``target``, adding ``number_offset`` to their
+    post numbers. Returns how many were moved.
+    """
+    post_model = type(source).get_post_model()
+
+    if issubclass(post_model, AbstractFlatForumReply):
+        replies = post_model.objects.filter(topic=source)
+        if min_post_number is not None:
+            replies = replies.filter(post_number__gte=min_post_number)
+
+        return replies.update(topic=target, post_number=F('post_number') + number_offset)
+
+    replies = post_model.objects.child_of(source)
+    if min_post_number is not None:
+        replies = replies.filter(post_number__gte=min_post_number)
+
+    rows = list(replies.order_by('path').values_list('id', 'path', 'url_path', 'title', 'slug', 'post_number', 'numchild'))
+    if not rows:
+        return 0
+
+    replies.update(post_number=F('post_number') + number_offset)
+
+    # Steps are reserved after the target's last child so the replies keep
+    # their order and come after the target's own
+    first_step = ForumPostCounter.objects.reserve_child_steps(target, len(rows)) - len(rows) + 1
+    slugs = set(Page.objects.child_of(target).values_list('slug', flat=True))
+
+    page_updates = []
+    document_updates = []
+    revision_changes = {}
+    for step, (page_id, path, url_path, title, old_slug, post_number, numchild) in enumerate(rows, first_step):
+        new_number = post_number + number_offset if post_number is not None else None
+        title, slug = renumber_slug(title, old_slug, post_number, new_number)
+        if slug in slugs:
+            slug = '%s-%d' % (slug, page_id)
+        slugs.add(slug)
+
+        new_path = Page._get_path(target.path, target.depth + 1, step)
+        new_url_path = target.url_path + slug + '/'
+
+        if numchild:
+            move_branch(path, new_path, url_path, new_url_path)
+
+        page_updates.append((new_path, target.depth + 1, new_url_path, slug, title, page_id))
+        document_updates.append((new_path, page_id))
+        revision_changes[page_id] = (post_number, new_number, old_slug, slug, new_path, new_url_path)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE %s SET path = %%s, depth = %%s, url_path = %%s, slug = %%s, title = %%s WHERE id = %%s" % connection.ops.quote_name(Page._meta.db_table),
+            page_updates
+        )
+        cursor.executemany(
+            "UPDATE %s SET path = %%s WHERE page_id = %%s" % connection.ops.quote_name(ForumSearchDocument._meta.db_table),
+            document_updates
+        )
+
+    update_revisions(revision_changes)
+    recount_children([source.path, target.path])
+
+    # The target might be in another forum
+    from wagtailforums import search
+    ForumSearchDocument.objects.filter(path__startswith=target.path).update(forum=search.get_forum_ids([target]).get(target.pk))
+
+    return len(rows)
+
+
+def build_reply(post_model, topic, post, post_number):
+    """
+    Returns a reply with the message of ``post``, to stand in for it in
+    ``topic``
+    """
+    fields = dict(
+        message=post.message,
+        message_html=post.message_html,
+        post_number=post_number,
+        live=post.live,
+        # Counted when the statistics are rebuilt
+        stats_counted=post.live,
+        owner=post.owner,
+        posted_at=get_post_time(post),
+        posted_by=post.get_posted_by(),
+        edited_at=post.get_edited_at() or get_post_time(post),
+        edited_by=post.get_edited_by(),
+    )
+
+    if issubclass(post_model, AbstractFlatForumReply):
+        return post_model(topic=topic, **fields)
+
+    reply = post_model(title=post.title, **fields)
+    reply.slug = reply.get_slug()
+    return reply
+
+
+def add_child(parent, page):
+    """
+    Saves ``page`` as the last child of ``parent``. Unlike treebeard's
+    add_child, this doesn't rely on the numchild of ``parent`` being up to
+    date.
+    """
+    page.path = Page._get_path(parent.path, parent.depth + 1, ForumPostCounter.objects.reserve_child_steps(parent, 1))
+    page.depth = parent.depth + 1
+    page.numchild = 0
+
+    # Page.save sets url_path from the parent
+    page._cached_parent_obj = parent
+    page.save()
+
+    recount_children([parent.path])
+
+    if page.live:
+        from wagtailforums import search
+        search.index_posts([page])
+
+
+def save_first_revision(post):
+    """
+    Gives a post made here a first revision, as if it had been posted.
+    Saving one records an edit, so the last edit of the post it was made
+    from is put back.
+    """
+    edited_at, edited_by = post.edited_at, post.edited_by
+    post.save_revision(user=post.posted_by, changed=not post.live)
+    post.edited_at, post.edited_by = edited_at, edited_by
+    type(post).objects.filter(pk=post.pk).update(edited_at=edited_at, edited_by=edited_by)
+
+
+def add_reply(topic, reply):
+    if isinstance(reply, AbstractFlatForumReply):
+        reply.save()
+    else:
+        add_child(topic, reply)
+        save_first_revision(reply)
+
+
+def merge_topics(source, target):
+    """
+    Moves the posts of ``source`` to the end of ``target`` and deletes
+    ``source``. The opening post of ``source`` becomes a reply.
+    """
+    if source.pk == target.pk:
+        raise TopicOperationError("A topic can't be merged into itself")
+
+    post_model = type(target).get_post_model()
+    if type(source).get_post_model() is not post_model:
+        raise TopicOperationError("%s and %s have different types of replies" % (source.title, target.title))
+
+    with tasks.post_commit():
+        # The opening post of the source comes first, then its replies
+        number_count = source.get_max_post_number() + 1
+        number_offset = ForumPostCounter.objects.increment(target, count=number_count) - number_count
+
+        add_reply(target, build_reply(post_model, target, source, number_offset + 1))
+        move_replies(source, target, number_offset + 1)
+
+        # Subscribers to the source follow the target, unless they already do
+        ForumSubscription.objects.filter(page=source).exclude(
+            user__in=ForumSubscription.objects.filter(page=target).values('user')
+        ).update(page=target)
+
+        source_path = source.path
+        Page.objects.get(pk=source.pk).specific.delete()
+
+        rebuild_stats([target], [source_path, target.path])
+
+    return target
+
+
+def split_topic(topic, post_number, title, forum=None):
+    """
+    Moves the replies numbered ``post_number`` and above into a new topic in
+    ``forum`` (or the same forum). The first of them becomes the new topic's
+    opening post, and the new topic is live if that post was.
+    """
+    first_post = topic.get_child_posts().filter(post_number__gte=post_number).order_by('post_number').first()
+    if first_post is None:
+        raise TopicOperationError("%s has no replies from post %d" % (topic.title, post_number))
+
+    if forum is None:
+        forum = get_forum(topic)
+
+    with tasks.post_commit():
+        # The new topic is published if its opening post was
+        new_topic = type(topic)(
+            title=force_text(title),
+            message=first_post.message,
+            live=first_post.live,
+            stats_counted=first_post.live,
+            owner=first_post.owner,
+            posted_at=get_post_time(first_post),
+            posted_by=first_post.get_posted_by(),
+            edited_at=first_post.get_edited_at() or get_post_time(first_post),
+            edited_by=first_post.get_edited_by(),
+        )
+        new_topic.post_number = forum.get_next_post_number()
+        new_topic.slug = new_topic.get_slug()
+        new_topic.update_message_html()
+        add_child(forum, new_topic)
+        save_first_revision(new_topic)
+
+        move_replies(topic, new_topic, -first_post.post_number, min_post_number=first_post.post_number + 1)
+
+        # The counter may have been started before the replies were moved in
+        ForumPostCounter.objects.increment(new_topic, count=0)
+        ForumPostCounter.objects.filter(page_id=new_topic.pk).update(last_post_number=new_topic.get_max_post_number())
+
+        if isinstance(first_post, AbstractFlatForumReply):
+            first_post.delete()
+        else:
+            Page.objects.get(pk=first_post.pk).specific.delete()
+
+        rebuild_stats([topic, new_topic], [topic.path, new_topic.path])
+
+    return new_topic
@@ -0,0 +1,134 @@
+"""
+Adds posts to the page tree without queueing on their parent.
+
+treebeard's ``add_child`` works out the path of a new page from the
+parent's last child and increments the parent's ``numchild`` in the same
+transaction, so concurrent posts to one topic wait for each other on the
+parent's page row, and can pick the same path.
+
+On pages with ``batch_tree_writes`` set, each process reserves blocks of
+child paths from the parent's ForumPostCounter and hands them out itself.
+The ``url_path`` of the new page is worked out from the parent that's
+already in memory. The ``numchild`` of each parent is incremented once the
+posts have been committed, once for several posts when they arrive together.
+
+Until then, ``numchild`` can be behind. The ``repair_forum_tree`` command
+corrects it, along with any ``url_path`` that went stale.
+"""
+import threading
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums import tasks
+from wagtailforums.models import ForumPostCounter
+
+
+class ChildPathAllocator(object):
+    """
+    Hands out treebeard steps for the children of each parent from blocks
+    reserved in the database
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = {}
+
+    def allocate(self, page, block_size):
+        with self.lock:
+            next_step, last_step = self.blocks.get(page.pk, (1, 0))
+
+            if next_step > last_step:
+                last_step = ForumPostCounter.objects.reserve_child_steps(page, block_size)
+                next_step = last_step - block_size + 1
+
+            self.blocks[page.pk] = (next_step + 1, last_step)
+
+        return Page._get_path(page.path, page.depth + 1, next_step)
+
+    def discard(self, page):
+        with self.lock:
+            self.blocks.pop(page.pk, None)
+
+
+class NumchildBuffer(object):
+    """
+    Collects the number of new children of each parent and adds them to
+    ``numchild`` together.
+
+    Children are only counted here once their post has been committed (see
+    add_child), so posts that get rolled back aren't counted.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def add(self, path, count=1):
+        with self.lock:
+            self.pending[path] = self.pending.get(path, 0) + count
+
+    def take_pending(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+
+        return pending
+
+    def flush(self):
+        for path, count in self.take_pending().items():
+            Page.objects.filter(path=path).update(numchild=F('numchild') + count)
+
+
+paths = ChildPathAllocator()
+numchild_buffer = NumchildBuffer()
+
+
+def count_child(path):
+    numchild_buffer.add(path)
+
+    # With more than one worker, a flush can pick up the children counted by
+    # other posts that have committed since
+    numchild_buffer.flush()
+
+
+def reserve_path(parent, instance):
+    """
+    Gives ``instance`` the next path under ``parent``. Call this before the
+    post's transaction so that, when a new block has to be reserved, the
+    counter row is only locked for a moment.
+    """
+    instance.path = paths.allocate(parent, parent.child_path_block_size)
+
+
+def add_child(parent, instance):
+    """
+    Saves ``instance`` as the last child of ``parent``, like
+    ``parent.add_child(instance=instance)``. It's given a path if it doesn't
+    have one from reserve_path.
+    """
+    instance.depth = parent.depth + 1
+    instance.numchild = 0
+
+    # Page.save sets url_path from the parent, this saves fetching it again
+    instance._cached_parent_obj = parent
+
+    for attempt in range(2):
+        if attempt or not instance.path:
+            reserve_path(parent, instance)
+
+        try:
+            with transaction.atomic():
+                instance.save()
+            break
+        except IntegrityError:
+            # Something else took the path (for example, a page added with
+            # add_child). Start a new block after it.
+            if attempt or not Page.objects.filter(path=instance.path).exists():
+                raise
+
+            paths.discard(parent)
+
+    tasks.defer(count_child, parent.path)
+
+    return instance
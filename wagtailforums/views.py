@@ -0,0 +1,142 @@
+"""
+The forum moderation dashboard in the Wagtail admin, see
+wagtailforums.moderation, and the page of moderation actions on a topic, see
+wagtailforums.topics
+"""
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404, redirect, render
+
+from wagtail.wagtailcore.models import Page
+
+from wagtailforums import moderation, navigation, topics
+from wagtailforums.models import AbstractForumIndex, AbstractForumTopic
+from wagtailforums.permissions import get_permission_cache
+
+
+def get_moderated_forums(user):
+    """
+    Returns the forum tree and the forums in it that the user can moderate
+    """
+    tree = navigation.get_forum_tree()
+    permissions = get_permission_cache(user)
+
+    return tree, [forum for forum in tree if permissions.for_page(forum).can_publish()]
+
+
+def moderation_index(request):
+    tree, forums = get_moderated_forums(request.user)
+    counts = moderation.count_pending(tree)
+
+    for forum in forums:
+        forum.pending_count = counts.get(forum.id, 0)
+
+    return render(request, 'wagtailforums/admin/moderation_index.html', {
+        'forums': forums,
+    })
+
+
+def moderation_queue(request, forum_id):
+    tree, forums = get_moderated_forums(request.user)
+
+    forum = tree.get(int(forum_id))
+    if forum is None:
+        raise Http404
+    if forum not in forums:
+        raise PermissionDenied
+
+    if request.method == 'POST':
+        try:
+            revision_ids = [int(revision_id) for revision_id in request.POST.getlist('revision')]
+            flat_reply_keys = [moderation.parse_flat_reply_key(key) for key in request.POST.getlist('flat_reply')]
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        revisions = moderation.get_pending_revisions(forum).filter(id__in=revision_ids)
+        flat_replies = [
+            replies.filter(id__in=[reply_id for model, reply_id in flat_reply_keys if model is replies.model])
+            for replies in moderation.get_pending_flat_replies(forum)
+        ]
+
+        if request.POST.get('action') == 'approve':
+            count = moderation.approve(revisions) + moderation.approve_flat_replies(flat_replies)
+            messages.success(request, "%d posts approved" % count)
+        elif request.POST.get('action') == 'reject':
+            count = moderation.reject(revisions) + moderation.reject_flat_replies(flat_replies)
+            messages.success(request, "%d posts rejected" % count)
+
+        return redirect(request.get_full_path())
+
+    try:
+        queue_page = moderation.get_queue_page(forum, after=request.GET.get('after') or None)
+    except ValueError:
+        raise Http404
+
+    return render(request, 'wagtailforums/admin/moderation_queue.html', {
+        'forum': forum,
+        'queue_page': queue_page,
+    })
+
+
+def get_moderated_page(request, page_id, base_class):
+    """
+    Returns the specific page with this id, if it's a ``base_class`` that the
+    user can moderate
+    """
+    page = get_object_or_404(Page, id=page_id).specific
+    if not isinstance(page, base_class):
+        raise Http404
+    if not get_permission_cache(request.user).for_page(page).can_publish():
+        raise PermissionDenied
+
+    return page
+
+
+def topic_actions(request, topic_id):
+    topic = get_moderated_page(request, topic_id, AbstractForumTopic)
+
+    if request.method == 'POST':
+        action = request.POST.get('action')
+
+        try:
+            if action in ('close', 'reopen'):
+                topics.close_topics([topic], closed=action == 'close')
+                messages.success(request, "Topic %s" % ('closed' if action == 'close' else 'reopened'))
+
+            elif action == 'move':
+                forum = get_moderated_page(request, request.POST.get('forum') or 0, AbstractForumIndex)
+                topics.move_topic(topic, forum)
+                messages.success(request, "Topic moved to %s" % forum.title)
+
+            elif action == 'merge':
+                target = get_moderated_page(request, request.POST.get('target') or 0, AbstractForumTopic)
+                topics.merge_topics(topic, target)
+                messages.success(request, "Topic merged into %s" % target.title)
+                return redirect('wagtailforums_topic_actions', target.id)
+
+            elif action == 'split':
+                try:
+                    post_number = int(request.POST.get('post_number'))
+                except (TypeError, ValueError):
+                    raise topics.TopicOperationError("Enter the number of the post to split the topic from")
+
+                title = request.POST.get('title', '').strip()
+                if not title:
+                    raise topics.TopicOperationError("Enter a title for the new topic")
+
+                new_topic = topics.split_topic(topic, post_number, title)
+                messages.success(request, "Posts moved to %s" % new_topic.title)
+                return redirect('wagtailforums_topic_actions', new_topic.id)
+
+        except topics.TopicOperationError as e:
+            messages.error(request, str(e))
+
+        return redirect('wagtailforums_topic_actions', topic.id)
+
+    tree, forums = get_moderated_forums(request.user)
+
+    return render(request, 'wagtailforums/admin/topic_actions.html', {
+        'topic': topic,
+        'forums': forums,
+    })
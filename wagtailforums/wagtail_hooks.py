@@ -0,0 +1,48 @@
+from django.conf.urls import include, url
+from django.core import urlresolvers
+
+from wagtail.wagtailcore import hooks
+from wagtail.wagtailadmin.menu import MenuItem
+from wagtail.wagtailadmin.userbar import BaseItem, EditPageItem
+
+from wagtailforums import admin_urls
+from wagtailforums.models import AbstractForumTopic
+
+
+@hooks.register('register_admin_urls')
+def register_admin_urls():
+    return [
+        url(r'^forums/moderation/', include(admin_urls)),
+    ]
+
+
+class ModerationMenuItem(MenuItem):
+    def is_shown(self, request):
+        # Users that can publish anywhere might be able to moderate a forum
+        user = request.user
+        return user.is_superuser or user.groups.filter(page_permissions__permission_type='publish').exists()
+
+
+@hooks.register('register_admin_menu_item')
+def register_moderation_menu_item():
+    return ModerationMenuItem("Forum moderation", urlresolvers.reverse('wagtailforums_moderation_index'), name='forum-moderation', classnames='icon icon-group', order=750)
+
+
+class TopicActionsItem(BaseItem):
+    template = 'wagtailforums/admin/userbar/item_topic_actions.html'
+
+    def __init__(self, page):
+        self.page = page
+
+    def render(self, request):
+        if not self.page.permissions_for_user(request.user).can_publish():
+            return ""
+
+        return super(TopicActionsItem, self).render(request)
+
+
+@hooks.register('construct_wagtail_userbar')
+def add_topic_actions_item(request, items):
+    for item in list(items):
+        if isinstance(item, EditPageItem) and issubclass(item.page.specific_class, AbstractForumTopic):
+            items.append(TopicActionsItem(item.page))